@@ -0,0 +1,50 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class RoleClaimJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that, when TRUST_TOKEN_ROLE_CLAIM is on, seeds the
+    user's roles from the `role` claim added by get_tokens_for_user, so
+    permission checks never query auth_group. The claim is only as fresh
+    as the token, which is why this is opt-in.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        role = validated_token.get('role')
+        if role and getattr(settings, 'TRUST_TOKEN_ROLE_CLAIM', False):
+            user.set_roles([role])
+        return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Channels middleware that authenticates a WebSocket from the access
+    token in its `token` query parameter (browsers cannot set headers on
+    a WebSocket), the same way RoleClaimJWTAuthentication does for the
+    REST API. Without a valid token, scope['user'] is left as the inner
+    session middleware set it (AnonymousUser for API clients).
+    """
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        if token:
+            user = await authenticate_token(token)
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+
+@database_sync_to_async
+def authenticate_token(raw_token):
+    authentication = RoleClaimJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except AuthenticationFailed:
+        return None
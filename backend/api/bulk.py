@@ -0,0 +1,176 @@
+import contextvars
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import docker.errors
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .docker_clients import get_client
+from .events import publish_host_changes
+from .inventory import batched_bumps, bump_inventory
+from .log_archive import archive_container
+from .models import ContainerRecord, DockerHost
+
+logger = logging.getLogger(__name__)
+
+# Status a container is left in by each action; None means the record is deleted.
+ACTIONS = {
+    'start': 'running',
+    'stop': 'exited',
+    'restart': 'running',
+    'remove': None,
+}
+
+
+def can_manage(user, container):
+    return (
+        user.is_admin()
+        or user.pk == container.created_by_id
+        or any(editor.pk == user.pk for editor in container.editable_by.all())
+    )
+
+
+def _run_action(container, action, timeout):
+    api = get_client(container.host).api
+    if action == 'start':
+        api.start(container.container_id)
+    elif action == 'stop':
+        api.stop(container.container_id, timeout=timeout)
+    elif action == 'restart':
+        api.restart(container.container_id, timeout=timeout)
+    else:
+        try:
+            api.stop(container.container_id, timeout=timeout)
+            if getattr(settings, 'LOG_ARCHIVE_DIR', None):
+                try:
+                    archive_container(container)
+                except Exception as e:
+                    logger.warning("Could not archive logs of %s before removal: %s", container.container_id, e)
+            api.remove_container(container.container_id)
+        except docker.errors.NotFound:
+            # Already gone from the daemon; drop the record like delete_container does.
+            pass
+
+
+class BulkAction:
+    """
+    Runs one lifecycle action on many containers, possibly on many hosts.
+
+    At most `max_workers` daemon calls run at once overall and at most
+    `per_host` per host. Work is handed out round-robin across hosts, so a
+    host with hundreds of containers does not hold up the others and no
+    worker sits waiting for a busy host. The records of every container
+    that succeeded are then written with one bulk_update (or one delete for
+    `remove`). The daemon calls share the call budget of the caller (see
+    api.circuit_breaker.call_budget); those still queued when it runs out
+    fail with a timeout.
+    """
+
+    def __init__(self, action, containers, timeout=10, max_workers=None, per_host=None):
+        if action not in ACTIONS:
+            raise ValueError(f"'action' must be one of: {', '.join(ACTIONS)}.")
+        self.action = action
+        self.containers = containers
+        self.timeout = timeout
+        self.max_workers = max_workers or getattr(settings, 'BULK_ACTION_MAX_WORKERS', 32)
+        self.per_host = per_host or getattr(settings, 'BULK_ACTION_PER_HOST', 8)
+
+    def _call(self, container):
+        try:
+            _run_action(container, self.action, self.timeout)
+            return None
+        except docker.errors.APIError as e:
+            return e.explanation or str(e)
+        except Exception as e:
+            return str(e)
+        finally:
+            close_old_connections()
+
+    def run(self):
+        """Per-container results, in the order the containers were given."""
+        queues = defaultdict(deque)
+        for container in self.containers:
+            queues[container.host_id].append(container)
+        running = defaultdict(int)
+        errors = {}
+        succeeded = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bulk-action') as pool:
+            in_flight = {}
+            while queues or in_flight:
+                submitted = True
+                while submitted and len(in_flight) < self.max_workers:
+                    submitted = False
+                    for host_id in list(queues):
+                        if len(in_flight) >= self.max_workers:
+                            break
+                        if running[host_id] >= self.per_host:
+                            continue
+                        container = queues[host_id].popleft()
+                        if not queues[host_id]:
+                            del queues[host_id]
+                        # Worker threads do not inherit the caller's context, and with it its call budget.
+                        in_flight[pool.submit(contextvars.copy_context().run, self._call, container)] = container
+                        running[host_id] += 1
+                        submitted = True
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    container = in_flight.pop(future)
+                    running[container.host_id] -= 1
+                    error = future.result()
+                    if error is None:
+                        succeeded.append(container)
+                    else:
+                        errors[container.pk] = error
+
+        self._save(succeeded)
+        results = []
+        for container in self.containers:
+            error = errors.get(container.pk)
+            result = {
+                'container_id': container.container_id,
+                'host_id': str(container.host_id),
+                'ok': error is None,
+                'status': container.status,
+            }
+            if error is not None:
+                result['error'] = error
+            results.append(result)
+        return results
+
+    def _save(self, succeeded):
+        if not succeeded:
+            return
+        status = ACTIONS[self.action]
+        by_host = defaultdict(list)
+        with transaction.atomic(), batched_bumps():
+            if status is None:
+                ContainerRecord.objects.filter(pk__in=[c.pk for c in succeeded]).delete()
+                for container in succeeded:
+                    container.status = 'removed'
+            else:
+                now = timezone.now()
+                for container in succeeded:
+                    container.status = status
+                    container.last_updated = now
+                ContainerRecord.objects.bulk_update(succeeded, ['status', 'last_updated'])
+            for container in succeeded:
+                by_host[container.host_id].append(container)
+            for host_id in by_host:
+                DockerHost.objects.filter(pk=host_id).update(
+                    running_containers_count=ContainerRecord.objects.filter(
+                        host_id=host_id, is_active=True, status='running'
+                    ).count()
+                )
+            # bulk_update sends no signals (see api.inventory).
+            bump_inventory(*by_host)
+
+        change = 'destroy' if status is None else 'refresh'
+        for host_id, containers in by_host.items():
+            publish_host_changes(host_id, [
+                {'kind': 'container', 'id': container.container_id, 'action': change} for container in containers
+            ])
@@ -0,0 +1,175 @@
+"""
+Per-host circuit breakers and per-call timeout budgets for Docker API calls.
+
+Every HTTP request a DockerClient from api.docker_clients makes goes
+through its host's CircuitBreaker:
+
+- closed: calls go through. DOCKER_BREAKER_FAILURE_THRESHOLD consecutive
+  connection failures or timeouts open the circuit.
+- open: calls fail at once with HostUnavailable (HTTP 503) instead of
+  waiting on a dark host, for DOCKER_BREAKER_RESET_TIMEOUT seconds.
+- half_open: one probe call is let through; success closes the circuit,
+  failure opens it again.
+
+Breakers live in each process. State changes are also written to the
+DockerHost row (circuit_state, circuit_failures, circuit_opened_at) so
+the API can show them next to `status`.
+
+A view declares how long its Docker calls may take with
+`@docker_budget(name)`, a key of DOCKER_CALL_BUDGETS. Each request's read
+timeout is cut to what is left of the budget; streaming requests (logs,
+stats, events) only get the connect timeout.
+"""
+import contextvars
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+_deadline = contextvars.ContextVar('docker_call_deadline', default=None)
+
+
+class HostUnavailable(APIException):
+    status_code = 503
+    default_code = 'host_unavailable'
+
+    def __init__(self, host_id, retry_after):
+        self.host_id = host_id
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            f"Docker host {host_id} is unavailable: calls are suspended after repeated connection failures. "
+            f"Retry in {self.retry_after}s."
+        )
+
+
+class BudgetExceeded(requests.exceptions.Timeout):
+    """The call budget of the current request ran out before a Docker call was made."""
+
+
+class CircuitBreaker:
+    def __init__(self, host_id, failure_threshold=None, reset_timeout=None):
+        self.host_id = host_id
+        self.failure_threshold = failure_threshold or getattr(settings, 'DOCKER_BREAKER_FAILURE_THRESHOLD', 3)
+        self.reset_timeout = reset_timeout or getattr(settings, 'DOCKER_BREAKER_RESET_TIMEOUT', 30)
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _retry_after(self):
+        return self.reset_timeout - (time.monotonic() - self.opened_at)
+
+    def check(self):
+        """Raise HostUnavailable if the circuit is open and not yet due for a probe."""
+        with self._lock:
+            if self.state == 'open' and self._retry_after() > 0:
+                raise HostUnavailable(self.host_id, self._retry_after())
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                if self._retry_after() > 0:
+                    raise HostUnavailable(self.host_id, self._retry_after())
+                self.state = 'half_open'
+                self.probing = False
+            if self.state == 'half_open':
+                if self.probing:
+                    raise HostUnavailable(self.host_id, 1)
+                self.probing = True
+
+    def record_success(self):
+        with self._lock:
+            changed = self.state != 'closed'
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+        if changed:
+            logger.info("Circuit for Docker host %s closed", self.host_id)
+            self._persist()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            opened = self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold)
+            if opened:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+        if opened:
+            logger.warning("Circuit for Docker host %s opened after %d failures", self.host_id, self.failures)
+            self._persist()
+
+    def release(self):
+        """The call ended without telling whether the host is healthy."""
+        with self._lock:
+            self.probing = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'retry_after': max(0, round(self._retry_after(), 1)) if self.state == 'open' else None,
+            }
+
+    def _persist(self):
+        from .models import DockerHost
+        try:
+            DockerHost.objects.filter(pk=self.host_id).update(
+                circuit_state=self.state,
+                circuit_failures=self.failures,
+                circuit_opened_at=timezone.now() if self.state == 'open' else None,
+            )
+        except Exception as e:
+            # Called from anywhere a Docker call is made, including async code.
+            logger.debug("Could not record circuit state of host %s: %s", self.host_id, e)
+
+
+def request_timeout(timeout, stream):
+    """
+    The (connect, read) timeout for one Docker HTTP request, given the one
+    docker-py asked for and the budget of the current call, if any.
+    """
+    connect = getattr(settings, 'DOCKER_CONNECT_TIMEOUT', 3)
+    read = timeout[1] if isinstance(timeout, tuple) else timeout
+    deadline = _deadline.get()
+    if deadline is not None and not stream:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BudgetExceeded("Timed out: the Docker call budget for this request is used up.")
+        connect = min(connect, remaining)
+        read = remaining if read is None else min(read, remaining)
+    return (connect, read)
+
+
+@contextmanager
+def call_budget(seconds):
+    """Docker calls made inside this block (in this thread) share `seconds` of time."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def docker_budget(name):
+    """View decorator: run the view under the DOCKER_CALL_BUDGETS[name] budget. Goes below @api_view."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            budgets = getattr(settings, 'DOCKER_CALL_BUDGETS', {})
+            with call_budget(budgets.get(name, budgets.get('default', 30))):
+                return view(*args, **kwargs)
+        return wrapped
+    return decorator
@@ -1,193 +1,744 @@
+import asyncio
+import codecs
 import json
-import threading
+from collections import deque
+from urllib.parse import parse_qs
 import docker
-import time
-from channels.generic.websocket import WebsocketConsumer
-from .models import ContainerRecord, DockerHost
-
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
-        self.accept()
-        self.send(text_data=json.dumps({
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from .models import ContainerRecord, DockerHost, ExecSession, ImagePull, Job
+from .docker_clients import get_client
+from .events import host_group_name
+from .exec_sessions import SessionUnavailable, manager as exec_sessions
+from .image_pulls import pull_group_name, serialize_pull
+from .jobs import job_group_name, serialize_job
+from .log_merge import LogMerger, describe_entry, filter_by_labels, parse_label_selector
+from .logs import LogBatchStream, LogQuery, encode_cursor, open_log_stream
+from .stats_hub import hub as stats_hub
+from .streams import DockerStreamReader, StreamLimitExceeded
+from .views import visible_containers
+
+
+@database_sync_to_async
+def get_container_record(container_id):
+    return ContainerRecord.objects.select_related('host').get(container_id=container_id)
+
+
+@database_sync_to_async
+def get_exec_session(exec_id, container_id):
+    return ExecSession.objects.select_related('container__host').get(
+        exec_id=exec_id, container__container_id=container_id,
+    )
+
+
+@database_sync_to_async
+def get_image_pull(pull_id):
+    pull = ImagePull.objects.filter(pk=pull_id).first()
+    return serialize_pull(pull) if pull is not None else None
+
+
+@database_sync_to_async
+def may_follow_pull(user, pull_id):
+    """Whether `user` may see the pull: host owner, admin or requester, as for GET .../images/pulls/<pull_id>/."""
+    if user is None or not user.is_authenticated:
+        return False
+    pull = ImagePull.objects.filter(pk=pull_id).select_related('host').first()
+    return pull is not None and (
+        user.pk == pull.host.owner_id or user.is_admin() or user.pk == pull.requested_by_id
+    )
+
+
+@database_sync_to_async
+def get_job(job_id):
+    job = Job.objects.filter(pk=job_id).first()
+    return serialize_job(job) if job is not None else None
+
+
+@database_sync_to_async
+def may_follow_job(user, job_id):
+    """Whether `user` may see the job: its creator or an admin, as for GET jobs/<job_id>/."""
+    if user is None or not user.is_authenticated:
+        return False
+    job = Job.objects.filter(pk=job_id).only('created_by_id').first()
+    return job is not None and (user.is_admin() or user.pk == job.created_by_id)
+
+
+@database_sync_to_async
+def get_log_containers(user, container_ids, selector):
+    records = visible_containers(user, ContainerRecord.objects.select_related('host').filter(is_active=True))
+    if container_ids:
+        records = records.filter(container_id__in=container_ids)
+    if selector:
+        records = filter_by_labels(records, selector)
+    return list(records.order_by('host_id', 'name'))
+
+
+class StreamingConsumer(AsyncWebsocketConsumer):
+    """
+    Base for consumers that relay Docker streams. Every stream runs as an
+    asyncio task owned by the connection and is cancelled on disconnect.
+    """
+    max_streams = getattr(settings, 'DOCKER_STREAM_MAX_PER_CONNECTION', 4)
+
+    async def connect(self):
+        self.stream_tasks = {}
+        await self.accept()
+
+    async def send_json(self, payload):
+        await self.send(text_data=json.dumps(payload))
+
+    async def send_error(self, message):
+        await self.send_json({'type': 'error', 'message': message})
+
+    async def start_stream(self, key, coro):
+        if key in self.stream_tasks:
+            coro.close()
+            return
+        if len(self.stream_tasks) >= self.max_streams:
+            coro.close()
+            await self.send_error(f'At most {self.max_streams} streams per connection')
+            return
+        task = asyncio.create_task(self._run_stream(key, coro))
+        self.stream_tasks[key] = task
+
+    async def _run_stream(self, key, coro):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except StreamLimitExceeded as e:
+            await self.send_error(str(e))
+        finally:
+            self.stream_tasks.pop(key, None)
+
+    async def disconnect(self, close_code):
+        tasks = list(getattr(self, 'stream_tasks', {}).values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class ChatConsumer(StreamingConsumer):
+    """
+    Live container logs.
+
+    The client sends {"container_id", "tail"?, "since"?, "cursor"?, "ack"?}.
+    With {"containers": [ids]} or {"selector": "key=value,..."} instead of
+    "container_id", the logs of all matching containers are merged into
+    one stream ordered by timestamp (see api.log_merge), with each line
+    labelled by container and host. Merging needs an authenticated user,
+    only covers containers the user may see, and is capped at
+    LOG_MERGE_MAX_CONTAINERS_PER_CONNECTION containers per connection.
+    Lines arrive as {"type": "logs", "seq", "lines", "cursor"} frames,
+    batched by LOG_STREAM_BATCH_LINES or LOG_STREAM_BATCH_WINDOW seconds.
+    Sending the last `cursor` back after a reconnect resumes right after
+    the last line the client got.
+
+    Lines are dropped, and reported in a {"type": "skipped"} frame, when a
+    stream goes over LOG_STREAM_MAX_LINES_PER_SECOND, or when a client that
+    acknowledges frames ({"type": "ack", "seq"}) has more than
+    LOG_STREAM_MAX_UNACKED_BYTES outstanding.
+    """
+    batch_lines = getattr(settings, 'LOG_STREAM_BATCH_LINES', 200)
+    batch_window = getattr(settings, 'LOG_STREAM_BATCH_WINDOW', 0.1)
+    max_lines_per_second = getattr(settings, 'LOG_STREAM_MAX_LINES_PER_SECOND', 2000)
+    max_unacked_bytes = getattr(settings, 'LOG_STREAM_MAX_UNACKED_BYTES', 1024 * 1024)
+    max_merged_containers = getattr(settings, 'LOG_MERGE_MAX_CONTAINERS_PER_CONNECTION', 50)
+
+    async def connect(self):
+        self.seq = 0
+        self.merged_containers = 0
+        self.acks = False
+        self.unacked = deque()
+        self.unacked_bytes = 0
+        await super().connect()
+        await self.send_json({
             'type': 'connection_established',
             'message': 'WebSocket connection established!'
-        }))
+        })
 
-    def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         data = json.loads(text_data)
-        container_id = data.get("container_id")
+        if data.get('type') == 'ack':
+            self.acknowledge(data.get('seq', 0))
+            return
 
+        container_id = data.get("container_id")
+        container_ids = data.get("containers")
+        selector = data.get("selector")
+        if not (container_id or container_ids or selector):
+            await self.send_error('No container_id provided')
+            return
+        try:
+            if container_id:
+                query = LogQuery.from_params(data, follow=True)
+            else:
+                # A merged stream has no single resume position.
+                query = LogQuery.from_params({**data, 'cursor': None}, follow=True)
+                if selector:
+                    parse_label_selector(selector)
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+        if data.get('ack'):
+            self.acks = True
         if container_id:
-            thread = threading.Thread(target=self.stream_container_logs, args=(container_id,))
-            thread.start()
+            await self.start_stream(container_id, self.stream_container_logs(container_id, query))
         else:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'No container_id provided'
-            }))
-
-    def stream_container_logs(self, container_id):
-        container = ContainerRecord.objects.get(container_id=container_id)
-        client = docker.DockerClient(base_url=container.host.docker_api_url)
+            key = f'selector:{selector}' if selector else 'containers:' + ','.join(container_ids)
+            await self.start_stream(key, self.stream_merged_logs(key, container_ids, selector, query))
+
+    def acknowledge(self, seq):
+        while self.unacked and self.unacked[0][0] <= seq:
+            self.unacked_bytes -= self.unacked.popleft()[1]
+
+    def client_behind(self):
+        return self.acks and self.unacked_bytes > self.max_unacked_bytes
+
+    async def send_frame(self, payload):
+        self.seq += 1
+        payload['seq'] = self.seq
+        text = json.dumps(payload)
+        if self.acks:
+            self.unacked.append((self.seq, len(text)))
+            self.unacked_bytes += len(text)
+        await self.send(text_data=text)
+
+    async def stream_container_logs(self, container_id, query):
         try:
-            container = client.containers.get(container_id)
+            container_record = await get_container_record(container_id)
 
-            for line in container.logs(stream=True, follow=True, stdout=True, stderr=True):
-                self.send(text_data=json.dumps({
-                    'type': 'log',
-                    'message': line.decode('utf-8').strip()
-                }))
+            def open_stream():
+                client = get_client(container_record.host)
+                return open_log_stream(client, container_id, query, LogBatchStream)
+
+            async with DockerStreamReader(open_stream) as batches:
+                await self.relay_logs(batches, query, {'container_id': container_id}, resumable=True)
+        except ContainerRecord.DoesNotExist:
+            await self.send_error(f'Container record not found for ID {container_id}')
         except docker.errors.NotFound:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': f'Container with ID {container_id} not found'
-            }))
+            await self.send_error(f'Container with ID {container_id} not found')
+        except (asyncio.CancelledError, StreamLimitExceeded):
+            raise
         except Exception as e:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
-
-class StatsConsumer(WebsocketConsumer):
-    def connect(self):
-        self.accept()
-        self.send(text_data=json.dumps({
+            await self.send_error(str(e))
+
+    async def stream_merged_logs(self, key, container_ids, selector, query):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.send_error('Authentication required to merge logs')
+            return
+        try:
+            records = await get_log_containers(user, container_ids, selector)
+            if not records:
+                await self.send_error('No containers match')
+                return
+            # The cap covers every merged stream of the connection together.
+            if self.merged_containers + len(records) > self.max_merged_containers:
+                await self.send_error(f'At most {self.max_merged_containers} containers can be merged per connection')
+                return
+            self.merged_containers += len(records)
+            try:
+                async with LogMerger(records, query) as merged:
+                    await self.relay_logs(merged, query, {'merge': key})
+            finally:
+                self.merged_containers -= len(records)
+        except (asyncio.CancelledError, StreamLimitExceeded):
+            raise
+        except Exception as e:
+            await self.send_error(str(e))
+
+    async def relay_logs(self, batches, query, tags, resumable=False):
+        """
+        Send entry batches from `batches` as framed, rate-limited log frames.
+        `tags` are added to every frame. Merged entries carry their
+        ContainerRecord and are labelled with container and host.
+        """
+        loop = asyncio.get_running_loop()
+        lines = []
+        skipped = 0
+        skipped_from = skipped_to = None
+        # Resume position: last line handled (sent or skipped) and how many lines share its timestamp.
+        last_point, at_last = (query.since, query.resume_skip) if query.resume_skip else (None, 0)
+        tokens = float(self.max_lines_per_second)
+        refilled_at = loop.time()
+        deadline = None
+
+        def cursor():
+            return encode_cursor(last_point, at_last) if resumable and last_point else None
+
+        async def flush():
+            nonlocal lines, skipped, deadline
+            if skipped:
+                await self.send_frame({
+                    'type': 'skipped',
+                    **tags,
+                    'count': skipped,
+                    'from': skipped_from,
+                    'to': skipped_to,
+                    'cursor': cursor(),
+                })
+                skipped = 0
+            if lines:
+                await self.send_frame({'type': 'logs', **tags, 'lines': lines, 'cursor': cursor()})
+                lines = []
+            deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                entries = await asyncio.wait_for(batches.__anext__(), timeout)
+            except asyncio.TimeoutError:
+                entries = ()
+            except StopAsyncIteration:
+                break
+
+            now = loop.time()
+            tokens = min(self.max_lines_per_second, tokens + (now - refilled_at) * self.max_lines_per_second)
+            refilled_at = now
+            behind = self.client_behind()
+            for entry in entries:
+                point, stamp = entry[0], entry[2]
+                if point is not None:
+                    at_last = at_last + 1 if point == last_point else 1
+                    last_point = point
+                    if behind or tokens < 1:
+                        skipped_to = stamp.decode()
+                        if not skipped:
+                            skipped_from = skipped_to
+                        skipped += 1
+                        continue
+                    tokens -= 1
+                lines.append(describe_entry(entry, query.timestamps))
+                if len(lines) >= self.batch_lines:
+                    await flush()
+                    behind = self.client_behind()
+
+            if deadline is None and (lines or skipped):
+                deadline = now + self.batch_window
+            elif deadline is not None and now >= deadline:
+                await flush()
+        await flush()
+        await self.send_frame({'type': 'end', **tags, 'cursor': cursor()})
+
+
+class StatsConsumer(AsyncWebsocketConsumer):
+    """
+    Subscribes the socket to the shared per-container stats stream in
+    api.stats_hub instead of opening a daemon stream per client. When that
+    stream ends, the client gets {"type": "ended", "container_id"} and may
+    subscribe again.
+    """
+    max_streams = getattr(settings, 'DOCKER_STREAM_MAX_PER_CONNECTION', 4)
+
+    async def connect(self):
+        self.subscriptions = set()
+        await self.accept()
+        await self.send(text_data=json.dumps({
             'type': 'connection_established',
             'message': 'Stats WebSocket connection established!'
         }))
 
-    def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         data = json.loads(text_data)
         container_id = data.get("container_id")
 
-        if container_id:
-            thread = threading.Thread(target=self.stream_container_stats, args=(container_id,))
-            thread.start()
+        if not container_id:
+            await self.send_error('No container_id provided')
+        elif container_id in self.subscriptions:
+            return
+        elif len(self.subscriptions) >= self.max_streams:
+            await self.send_error(f'At most {self.max_streams} streams per connection')
         else:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'No container_id provided'
-            }))
+            try:
+                container_record = await get_container_record(container_id)
+            except ContainerRecord.DoesNotExist:
+                await self.send_error(f'Container record not found for ID {container_id}')
+                return
+            self.subscriptions.add(container_id)
+            await stats_hub.subscribe(container_id, container_record.host, self.channel_layer, self.channel_name)
 
-    def stream_container_stats(self, container_id):
-        try:
-            container_record = ContainerRecord.objects.get(container_id=container_id)
-            client = docker.DockerClient(base_url=container_record.host.docker_api_url)
-            container = client.containers.get(container_id)
+    async def disconnect(self, close_code):
+        for container_id in getattr(self, 'subscriptions', ()):
+            await stats_hub.unsubscribe(container_id, self.channel_layer, self.channel_name)
 
-            # Stream stats every 2 seconds
-            for raw_stats in container.stats(stream=True, decode=True):
-                try:
-                    # Process stats similar to the model's stats method
-                    if raw_stats["read"].startswith("0001-01-01"):
-                        continue  # Skip invalid stats
-
-                    # CPU stats
-                    cpu_stats = raw_stats["cpu_stats"]
-                    cpu_user = cpu_stats["cpu_usage"]["usage_in_usermode"]
-                    cpu_kernel = cpu_stats["cpu_usage"]["usage_in_kernelmode"]
-                    cpu_total_time_sec = (cpu_user + cpu_kernel) / 1e9
-
-                    # Memory stats
-                    mem_usage = raw_stats["memory_stats"]["usage"]
-                    mem_limit = raw_stats["memory_stats"]["limit"]
-
-                    # Network stats
-                    net = raw_stats["networks"]["eth0"]
-                    rx_bytes = net["rx_bytes"]
-                    tx_bytes = net["tx_bytes"]
-                    network_rx_mb = round(rx_bytes / (1024 ** 2), 2)
-                    network_tx_mb = round(tx_bytes / (1024 ** 2), 2)
-
-                    # PIDs
-                    pids = raw_stats["pids_stats"]["current"]
-
-                    # Send processed stats
-                    stats_data = {
-                        "type": "stats",
-                        "data": {
-                            "container_id": raw_stats["id"][:12],
-                            "name": raw_stats["name"].lstrip("/"),
-                            "cpu_total_time_sec": round(cpu_total_time_sec, 2),
-                            "memory_usage_mb": round(mem_usage / (1024 ** 2), 2),
-                            "memory_limit_mb": round(mem_limit / (1024 ** 2), 2),
-                            "pids": pids,
-                            "network_rx_mb": network_rx_mb,
-                            "network_tx_mb": network_tx_mb,
-                            "timestamp": raw_stats["read"]
-                        }
-                    }
-                    
-                    self.send(text_data=json.dumps(stats_data))
-                    
-                    # Small delay to prevent overwhelming the client
-                    time.sleep(2)
-                    
-                except KeyError as ke:
-                    self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': f'Missing expected stat field: {ke}'
-                    }))
-                    break
-                except Exception as e:
-                    self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': f'Error processing stats: {str(e)}'
-                    }))
-                    break
-                    
-        except ContainerRecord.DoesNotExist:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': f'Container record not found for ID {container_id}'
-            }))
-        except docker.errors.NotFound:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': f'Container with ID {container_id} not found'
-            }))
-        except Exception as e:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
+    async def send_error(self, message):
+        await self.send(text_data=json.dumps({'type': 'error', 'message': message}))
+
+    async def stats_sample(self, event):
+        await self.send(text_data=json.dumps({'type': 'stats', 'data': event['data']}))
+
+    async def stats_error(self, event):
+        await self.send_error(event['message'])
+
+    async def stats_ended(self, event):
+        container_id = event['container_id']
+        # A subscribe after the end may already have started a new upstream.
+        if container_id not in self.subscriptions or stats_hub.is_subscribed(container_id, self.channel_name):
+            return
+        self.subscriptions.discard(container_id)
+        await stats_hub.unsubscribe(container_id, self.channel_layer, self.channel_name)
+        await self.send(text_data=json.dumps({'type': 'ended', 'container_id': container_id}))
+
+
+class TerminalConsumer(StreamingConsumer):
+    """
+    Interactive exec session (see create_exec_session and api.exec_sessions).
+
+    Output is relayed as binary frames of raw terminal bytes, coalesced for
+    up to TERMINAL_BATCH_WINDOW seconds or TERMINAL_MAX_FRAME_BYTES, so a
+    multibyte character split across reads reaches the client intact and
+    heavy output does not turn into thousands of tiny frames. With
+    ?encoding=text the frames are text instead, decoded incrementally.
+    Status messages are JSON text frames: {"type": "exit", "exit_code"},
+    {"type": "closed", "reason"} (the session was reaped, closed elsewhere
+    or taken over by another socket) and {"type": "error", "message"}.
+
+    The exec socket belongs to the session manager: a socket reconnecting
+    to a session kept after a disconnect (a page refresh) is first sent
+    the session's recent output, then continues the same shell. Closing
+    with code 1000 ends the session; any other disconnect leaves it for
+    EXEC_REATTACH_GRACE seconds.
 
-class TerminalConsumer(WebsocketConsumer):
-    def connect(self):
+    The client sends keystrokes as binary frames (plain text frames that
+    are not a JSON control message are taken as input too) and control
+    messages as JSON text frames:
+    - {"type": "resize", "cols", "rows"}: resize the TTY (also ?cols=&rows=
+      on connect);
+    - {"type": "ack", "bytes"}: total output bytes received so far. A client
+      that acks is sent at most TERMINAL_MAX_UNACKED_BYTES ahead; past that
+      the relay stops reading, which pauses the Docker stream and, through
+      it, the process writing to the terminal;
+    - {"type": "close"}: end the session.
+    """
+    max_streams = 1
+    read_size = getattr(settings, 'TERMINAL_READ_SIZE', 16384)
+    buffer_chunks = getattr(settings, 'TERMINAL_BUFFER_CHUNKS', 16)
+    batch_window = getattr(settings, 'TERMINAL_BATCH_WINDOW', 0.015)
+    max_frame_bytes = getattr(settings, 'TERMINAL_MAX_FRAME_BYTES', 64 * 1024)
+    max_unacked_bytes = getattr(settings, 'TERMINAL_MAX_UNACKED_BYTES', 512 * 1024)
+
+    async def connect(self):
         self.container_id = self.scope['url_route']['kwargs']['container_id']
         self.exec_id = self.scope['url_route']['kwargs']['exec_id']
-        self.accept()
-        self.start_terminal_session()
-
-    def start_terminal_session(self):
-        container_record = ContainerRecord.objects.get(container_id=self.container_id)
-        docker_api_url = container_record.host.docker_api_url
-        client = docker.DockerClient(base_url=docker_api_url)
-        self.exec_socket = client.api.exec_start(
-            exec_id=self.exec_id,
-            socket=True,
-            tty=True,
-            stream=True
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.decoder = (
+            codecs.getincrementaldecoder('utf-8')(errors='replace')
+            if params.get('encoding', [''])[0] == 'text' else None
         )
-        threading.Thread(target=self.stream_output).start()
+        self.live = None
+        self.client = None
+        self.sent_bytes = 0
+        self.acked_bytes = None
+        self.window_open = asyncio.Event()
+        self.window_open.set()
+        self.size = None
+        self.applied_size = None
+        self.resize_task = None
+        try:
+            self.size = (int(params['cols'][0]), int(params['rows'][0]))
+        except (KeyError, ValueError):
+            pass
+        await super().connect()
+        await self.start_stream('terminal', self.stream_output())
+
+    async def stream_output(self):
+        try:
+            session = await get_exec_session(self.exec_id, self.container_id)
+            self.live = await exec_sessions.attach(session, self, self.read_size, self.buffer_chunks)
+        except ExecSession.DoesNotExist:
+            await self.send_error('Terminal session not found')
+            await self.close()
+            return
+        except SessionUnavailable as e:
+            await self.send_error(str(e))
+            await self.close()
+            return
+        except (asyncio.CancelledError, StreamLimitExceeded):
+            raise
+        except Exception as e:
+            await self.send_error(str(e))
+            await self.close()
+            return
+
+        self.client = self.live.client
+        if self.live.scrollback:
+            await self.send_output(bytes(self.live.scrollback))
+        if self.size is not None:
+            self.request_resize(*self.size)
+        try:
+            await self.relay_output(self.live.reader)
+            exit_code = await exec_sessions.close(self.live, 'exited', notify=False)
+            await self.send_json({'type': 'exit', 'exit_code': exit_code})
+        except (asyncio.CancelledError, StreamLimitExceeded):
+            raise
+        except Exception as e:
+            await self.send_error(str(e))
+            await exec_sessions.close(self.live, 'failed', notify=False)
+        await self.close()
+
+    async def send_output(self, data, final=False):
+        if self.decoder is not None:
+            text = self.decoder.decode(data, final=final)
+            if text:
+                await self.send(text_data=text)
+        elif data:
+            await self.send(bytes_data=data)
+        self.sent_bytes += len(data)
+        if self.acked_bytes is not None and self.sent_bytes - self.acked_bytes > self.max_unacked_bytes:
+            self.window_open.clear()
+
+    async def relay_output(self, chunks):
+        loop = asyncio.get_running_loop()
+        pending = bytearray()
+        deadline = None
+
+        async def flush(final=False):
+            nonlocal deadline
+            deadline = None
+            data = bytes(pending)
+            pending.clear()
+            self.live.record_output(data, exec_sessions.scrollback_bytes)
+            await self.send_output(data, final)
 
-    def stream_output(self):
         try:
             while True:
-                data = self.exec_socket._sock.recv(4096)
-                if not data:
-                    print("No more data, closing stream_output")
+                # Stop pulling while the client is too far behind; the reader's
+                # bounded queue then fills and the Docker read pauses.
+                await self.window_open.wait()
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    data = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except asyncio.TimeoutError:
+                    await flush()
+                    continue
+                except StopAsyncIteration:
                     break
-                self.send(text_data=data.decode('utf-8', errors='replace'))
-        except Exception as e:
-            print(f"Exception in stream_output: {e}")
+                pending += data
+                if len(pending) >= self.max_frame_bytes:
+                    await flush()
+                elif deadline is None:
+                    deadline = loop.time() + self.batch_window
+        except asyncio.CancelledError:
+            # Read but not sent: keep it for the socket that reattaches.
+            self.live.record_output(bytes(pending), exec_sessions.scrollback_bytes)
+            raise
+        await flush(final=True)
 
-    def receive(self, text_data):
-        self.exec_socket._sock.sendall(text_data.encode('utf-8'))
+    async def session_ended(self, reason):
+        """Called by the session manager when it ends the session or hands it to another socket."""
+        tasks = list(self.stream_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.send_json({'type': 'closed', 'reason': reason})
+        await self.close()
 
-    def disconnect(self, close_code):
-        if hasattr(self, 'exec_socket'):
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is not None:
+            message = None
+            if text_data.startswith('{'):
+                try:
+                    message = json.loads(text_data)
+                except ValueError:
+                    pass
+            if isinstance(message, dict) and 'type' in message:
+                await self.control(message)
+                return
+            bytes_data = text_data.encode('utf-8')
+        if self.client is None or not bytes_data:
+            return
+        await self.live.send(bytes_data)
+
+    async def control(self, message):
+        if message['type'] == 'ack':
             try:
-                self.exec_socket.close()
+                self.acked_bytes = max(self.acked_bytes or 0, int(message.get('bytes', 0)))
+            except (TypeError, ValueError):
+                return
+            if self.sent_bytes - self.acked_bytes <= self.max_unacked_bytes // 2:
+                self.window_open.set()
+        elif message['type'] == 'resize':
+            try:
+                cols, rows = int(message['cols']), int(message['rows'])
+            except (KeyError, TypeError, ValueError):
+                await self.send_error('resize needs integer cols and rows')
+                return
+            if cols > 0 and rows > 0:
+                self.request_resize(cols, rows)
+        elif message['type'] == 'close':
+            await exec_sessions.detach(self, end=True)
+            await self.close()
+
+    def request_resize(self, cols, rows):
+        # Windows report many sizes while being dragged; only the latest is applied.
+        self.size = (cols, rows)
+        if self.client is not None and (self.resize_task is None or self.resize_task.done()):
+            self.resize_task = asyncio.create_task(self.apply_resize())
+
+    async def apply_resize(self):
+        while self.size != self.applied_size:
+            size = self.size
+            try:
+                await asyncio.to_thread(self.client.api.exec_resize, self.exec_id, height=size[1], width=size[0])
             except Exception as e:
-                print(f"Error closing exec_socket: {e}")
+                await self.send_error(f'Could not resize terminal: {e}')
+                return
+            self.applied_size = size
+
+    async def disconnect(self, close_code):
+        self.window_open.set()
+        if self.resize_task is not None:
+            self.resize_task.cancel()
+        await super().disconnect(close_code)
+        await exec_sessions.detach(self, end=close_code == 1000)
+
+
+class HostEventsConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.host_id = self.scope['url_route']['kwargs']['host_id']
+        self.group_name = host_group_name(self.host_id)
+        if self.channel_layer is None:
+            await self.close()
+            return
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.send(text_data=json.dumps({
+            'type': 'connection_established',
+            'message': f'Watching events for host {self.host_id}'
+        }))
+
+    async def disconnect(self, close_code):
+        if self.channel_layer is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def inventory_changed(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'inventory_changed',
+            'host_id': event['host_id'],
+            'changes': event['changes']
+        }))
+
+
+class ImagePullConsumer(AsyncWebsocketConsumer):
+    """
+    Progress of one image pull: the current state on connect, then every
+    update until it finishes. Updates come from the pulling thread through
+    the channel layer. The row is also re-read every
+    IMAGE_PULL_POLL_INTERVAL seconds while no update arrives, so the end of
+    the pull is seen even when the layer cannot deliver across threads (the
+    in-memory layer) or the pulling process died. Only the host's owner,
+    admins and the user who started the pull may follow it.
+    """
+
+    async def connect(self):
+        self.pull_id = self.scope['url_route']['kwargs']['pull_id']
+        self.group_name = pull_group_name(self.pull_id)
+        self.poll_task = None
+        self.last_update = 0
+        if self.channel_layer is None:
+            await self.close()
+            return
+        if not await may_follow_pull(self.scope.get('user'), self.pull_id):
+            await self.accept()
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Pull not found'}))
+            await self.close()
+            return
+        # Join before reading the row so no update falls in between.
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        pull = await get_image_pull(self.pull_id)
+        if pull is None:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Pull not found'}))
+            await self.close()
+            return
+        await self.pull_progress({'pull': pull})
+        if pull['status'] == 'running':
+            self.poll_task = asyncio.create_task(self.poll())
+
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        interval = getattr(settings, 'IMAGE_PULL_POLL_INTERVAL', 2)
+        while True:
+            await asyncio.sleep(interval)
+            if loop.time() - self.last_update < interval:
+                continue
+            pull = await get_image_pull(self.pull_id)
+            if pull is not None:
+                await self.pull_progress({'pull': pull})
+
+    async def disconnect(self, close_code):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        if self.channel_layer is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def pull_progress(self, event):
+        pull = event['pull']
+        self.last_update = asyncio.get_running_loop().time()
+        await self.send(text_data=json.dumps({'type': 'pull', **pull}))
+        if pull['status'] != 'running':
+            if self.poll_task is not None and self.poll_task is not asyncio.current_task():
+                self.poll_task.cancel()
+            await self.close()
+
+
+class JobConsumer(AsyncWebsocketConsumer):
+    """
+    Status of one background job: the current state on connect, then every
+    update until it finishes. Like ImagePullConsumer, the row is re-read
+    every JOBS_SOCKET_POLL_INTERVAL seconds while no update arrives. Only
+    the job's creator and admins may follow it; anyone else is told the
+    job does not exist.
+    """
+
+    async def connect(self):
+        self.job_id = self.scope['url_route']['kwargs']['job_id']
+        self.group_name = job_group_name(self.job_id)
+        self.poll_task = None
+        self.last_update = 0
+        if self.channel_layer is None:
+            await self.close()
+            return
+        if not await may_follow_job(self.scope.get('user'), self.job_id):
+            await self.accept()
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Job not found'}))
+            await self.close()
+            return
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        job = await get_job(self.job_id)
+        if job is None:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Job not found'}))
+            await self.close()
+            return
+        await self.job_update({'job': job})
+        if job['status'] not in Job.FINISHED_STATUSES:
+            self.poll_task = asyncio.create_task(self.poll())
+
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        interval = getattr(settings, 'JOBS_SOCKET_POLL_INTERVAL', 2)
+        while True:
+            await asyncio.sleep(interval)
+            if loop.time() - self.last_update < interval:
+                continue
+            job = await get_job(self.job_id)
+            if job is not None:
+                await self.job_update({'job': job})
+
+    async def disconnect(self, close_code):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        if self.channel_layer is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def job_update(self, event):
+        job = event['job']
+        self.last_update = asyncio.get_running_loop().time()
+        await self.send(text_data=json.dumps({'type': 'job', **job}))
+        if job['status'] in Job.FINISHED_STATUSES:
+            if self.poll_task is not None and self.poll_task is not asyncio.current_task():
+                self.poll_task.cancel()
+            await self.close()
@@ -0,0 +1,268 @@
+import threading
+import time
+
+import docker
+import requests
+from django.conf import settings
+
+from .circuit_breaker import CircuitBreaker, HostUnavailable, request_timeout
+
+
+# Fields on DockerHost that change how we reach the daemon. If any of them
+# change, the cached client for that host is thrown away and rebuilt.
+CONNECTION_FIELDS = (
+    'docker_api_url',
+    'auth_type',
+    'tls_cert',
+    'tls_key',
+    'tls_ca_cert',
+    'ssh_username',
+    'ssh_private_key',
+    'ssh_password',
+    'api_token',
+)
+
+
+def connection_fingerprint(host):
+    return tuple(getattr(host, field, None) for field in CONNECTION_FIELDS)
+
+
+class GuardedAPIClient(docker.APIClient):
+    """
+    APIClient whose HTTP requests go through the host's circuit breaker and
+    get their timeouts from the current call budget (see api.circuit_breaker).
+    """
+
+    def __init__(self, *args, breaker, **kwargs):
+        self.breaker = breaker
+        super().__init__(*args, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs['timeout'] = request_timeout(kwargs.get('timeout'), kwargs.get('stream'))
+        self.breaker.before_call()
+        try:
+            response = super().request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+
+class GuardedDockerClient(docker.DockerClient):
+    def __init__(self, *args, **kwargs):
+        self.api = GuardedAPIClient(*args, **kwargs)
+
+
+class _Entry:
+    __slots__ = ('client', 'fingerprint', 'created_at', 'last_used_at', 'uses', 'holds')
+
+    def __init__(self, client, fingerprint):
+        self.client = client
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.uses = 0
+        self.holds = 0  # open long-lived streams; see DockerClientRegistry.hold
+
+
+class DockerClientRegistry:
+    """
+    Process-wide cache of DockerClient instances keyed by DockerHost.id.
+
+    Each client owns a bounded urllib3 pool, so reusing it skips the
+    TCP/TLS/SSH handshake that a fresh DockerClient pays on every call.
+    The circuit breaker of each host is kept here too, and outlives the
+    client unless the host's connection settings change.
+
+    Clients unused for `idle_timeout` seconds are closed, except those
+    `hold()` says are still serving a stream (events, stats, logs, exec
+    sockets): a stream only checks its client out when it opens.
+    """
+
+    def __init__(self, max_pool_size=None, idle_timeout=None, timeout=None):
+        self.max_pool_size = max_pool_size or getattr(settings, 'DOCKER_CLIENT_MAX_POOL_SIZE', 4)
+        self.idle_timeout = idle_timeout or getattr(settings, 'DOCKER_CLIENT_IDLE_TIMEOUT', 300)
+        self.timeout = timeout or getattr(settings, 'DOCKER_CLIENT_TIMEOUT', 60)
+        self._entries = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._counters = {'created': 0, 'reused': 0, 'invalidated': 0, 'evicted': 0}
+
+    def breaker(self, host_id):
+        with self._lock:
+            breaker = self._breakers.get(host_id)
+            if breaker is None:
+                breaker = self._breakers[host_id] = CircuitBreaker(host_id)
+            return breaker
+
+    def _build(self, host):
+        return GuardedDockerClient(
+            base_url=host.docker_api_url,
+            timeout=self.timeout,
+            max_pool_size=self.max_pool_size,
+            breaker=self.breaker(host.id),
+        )
+
+    def get(self, host):
+        fingerprint = connection_fingerprint(host)
+        client = self._checkout(host.id, fingerprint)
+        if client is not None:
+            return client
+
+        # Building a client talks to the daemon (/version), so never hold the
+        # lock while doing it - one dark host must not block every other host.
+        self.breaker(host.id).check()
+        try:
+            built = self._build(host)
+        except docker.errors.DockerException as e:
+            # docker-py wraps errors of the /version call; keep a fail-fast one recognisable.
+            if isinstance(e.__context__, HostUnavailable):
+                raise e.__context__
+            raise
+        stale = []
+        with self._lock:
+            entry = self._entries.get(host.id)
+            if entry is not None and entry.fingerprint == fingerprint:
+                # Another thread won the race; keep its client.
+                stale.append(built)
+            else:
+                if entry is not None:
+                    stale.append(entry.client)
+                entry = _Entry(built, fingerprint)
+                self._entries[host.id] = entry
+                self._counters['created'] += 1
+            entry.uses += 1
+            entry.last_used_at = time.monotonic()
+            client = entry.client
+        self._close_all(stale)
+        return client
+
+    def _checkout(self, host_id, fingerprint):
+        stale = []
+        client = None
+        with self._lock:
+            stale.extend(self._evict_idle_locked())
+            entry = self._entries.get(host_id)
+            if entry is not None and entry.fingerprint != fingerprint:
+                stale.append(self._entries.pop(host_id).client)
+                self._breakers.pop(host_id, None)
+                self._counters['invalidated'] += 1
+            elif entry is not None:
+                self._counters['reused'] += 1
+                entry.uses += 1
+                entry.last_used_at = time.monotonic()
+                client = entry.client
+        self._close_all(stale)
+        return client
+
+    def hold(self, client):
+        """
+        Keep `client` from being evicted as idle until the returned
+        function is called (once the stream using it is closed).
+        """
+        with self._lock:
+            entry = next((entry for entry in self._entries.values() if entry.client is client), None)
+            if entry is None:
+                return lambda: None
+            entry.holds += 1
+        released = threading.Event()
+
+        def release():
+            if released.is_set():
+                return
+            released.set()
+            with self._lock:
+                entry.holds -= 1
+                entry.last_used_at = time.monotonic()
+
+        return release
+
+    def invalidate(self, host_id):
+        with self._lock:
+            entry = self._entries.pop(host_id, None)
+            self._breakers.pop(host_id, None)
+            if entry is not None:
+                self._counters['invalidated'] += 1
+        if entry is not None:
+            self._close_all([entry.client])
+
+    def evict_idle(self):
+        with self._lock:
+            stale = self._evict_idle_locked()
+        self._close_all(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            stale = [entry.client for entry in self._entries.values()]
+            self._entries.clear()
+        self._close_all(stale)
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            return {
+                'clients': len(self._entries),
+                'max_pool_size': self.max_pool_size,
+                'idle_timeout': self.idle_timeout,
+                **self._counters,
+                'hosts': {
+                    str(host_id): {
+                        'uses': entry.uses,
+                        'holds': entry.holds,
+                        'idle_seconds': round(time.monotonic() - entry.last_used_at, 1),
+                    }
+                    for host_id, entry in self._entries.items()
+                },
+                'breakers': {str(host_id): breaker.snapshot() for host_id, breaker in breakers.items()},
+            }
+
+    def _evict_idle_locked(self):
+        deadline = time.monotonic() - self.idle_timeout
+        expired = [
+            host_id for host_id, entry in self._entries.items()
+            if entry.last_used_at < deadline and not entry.holds
+        ]
+        self._counters['evicted'] += len(expired)
+        return [self._entries.pop(host_id).client for host_id in expired]
+
+    @staticmethod
+    def _close_all(clients):
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+class HeldStream:
+    """A Docker stream that keeps its client held (see hold) until it ends or is closed."""
+
+    def __init__(self, client, stream):
+        self.stream = stream
+        self.release = registry.hold(client)
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            close = getattr(self.stream, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.release()
+
+
+registry = DockerClientRegistry()
+
+
+def get_client(host):
+    return registry.get(host)
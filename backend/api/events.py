@@ -0,0 +1,350 @@
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .docker_clients import connection_fingerprint, get_client, registry as docker_clients
+from .inventory import batched_bumps, bump_inventory
+from .models import ContainerRecord, DockerHost, Network, Volume
+from .sync import sync_containers, sync_images, sync_networks, sync_volumes
+
+logger = logging.getLogger(__name__)
+
+# Container actions that move the container into a known status.
+CONTAINER_STATUS_BY_ACTION = {
+    'start': 'running',
+    'unpause': 'running',
+    'restart': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'oom': 'exited',
+}
+
+
+def host_group_name(host_id):
+    return f"host_{host_id}"
+
+
+def publish_host_changes(host_id, changes):
+    """Fan inventory changes out to every websocket watching this host."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not changes:
+        return
+    async_to_sync(channel_layer.group_send)(host_group_name(host_id), {
+        'type': 'inventory.changed',
+        'host_id': str(host_id),
+        'changes': changes,
+    })
+
+
+class EventBatch:
+    """
+    Collapses a burst of Docker events into the minimum set of DB writes:
+    the last status per container, summed restarts, and the ids of objects
+    that must be (re)fetched or deleted.
+    """
+
+    def __init__(self):
+        self.container_status = {}
+        self.container_restarts = {}
+        self.container_refresh = set()
+        self.container_destroyed = set()
+        self.network_refresh = set()
+        self.network_destroyed = set()
+        self.volume_refresh = set()
+        self.volume_destroyed = set()
+        self.images_changed = False
+        self.last_time_nano = None
+        self.size = 0
+
+    def add(self, event):
+        self.size += 1
+        self.last_time_nano = event.get('timeNano') or self.last_time_nano
+        kind = event.get('Type')
+        action = (event.get('Action') or '').split(':')[0]
+        actor = event.get('Actor') or {}
+        object_id = actor.get('ID')
+        if not object_id:
+            return
+
+        if kind == 'container':
+            if action == 'destroy':
+                self.container_destroyed.add(object_id)
+                self.container_status.pop(object_id, None)
+            elif action in ('create', 'rename', 'update'):
+                self.container_refresh.add(object_id)
+            if action in CONTAINER_STATUS_BY_ACTION:
+                attributes = actor.get('Attributes') or {}
+                status = CONTAINER_STATUS_BY_ACTION[action]
+                # Mirror the wording of the daemon's own `Status` column.
+                state = {'running': 'Up', 'paused': 'Up (Paused)'}.get(status, 'Exited')
+                if 'exitCode' in attributes:
+                    state = f"Exited ({attributes['exitCode']})"
+                self.container_status[object_id] = (status, state)
+            if action == 'restart':
+                self.container_restarts[object_id] = self.container_restarts.get(object_id, 0) + 1
+        elif kind == 'network':
+            if action == 'destroy':
+                self.network_destroyed.add(object_id)
+                self.network_refresh.discard(object_id)
+            elif action == 'create':
+                self.network_refresh.add(object_id)
+        elif kind == 'volume':
+            if action == 'destroy':
+                self.volume_destroyed.add(object_id)
+                self.volume_refresh.discard(object_id)
+            elif action == 'create':
+                self.volume_refresh.add(object_id)
+        elif kind == 'image':
+            self.images_changed = True
+
+
+def apply_event_batch(host, batch):
+    """Apply a coalesced EventBatch for `host` and return the change list."""
+    client = get_client(host)
+    changes = []
+
+    # Fetch fresh summaries with one filtered list call per resource type.
+    container_summaries = []
+    if batch.container_refresh:
+        container_summaries = client.api.containers(all=True, filters={'id': list(batch.container_refresh)})
+    network_summaries = []
+    if batch.network_refresh:
+        network_summaries = client.api.networks(ids=list(batch.network_refresh))
+    volume_summaries = []
+    if batch.volume_refresh:
+        volume_summaries = [
+            volume for volume in client.api.volumes().get('Volumes') or []
+            if volume['Name'] in batch.volume_refresh
+        ]
+    image_summaries = client.api.images() if batch.images_changed else None
+
+    with transaction.atomic(), batched_bumps():
+        if container_summaries:
+            sync_containers(host, container_summaries, prune=False)
+            changes.extend({'kind': 'container', 'id': c['Id'], 'action': 'refresh'} for c in container_summaries)
+
+        touched = set(batch.container_status) | set(batch.container_restarts)
+        records = list(ContainerRecord.objects.filter(host=host, container_id__in=touched))
+        for record in records:
+            if record.container_id in batch.container_status:
+                record.status, record.state = batch.container_status[record.container_id]
+            record.restarted_count += batch.container_restarts.get(record.container_id, 0)
+            changes.append({
+                'kind': 'container',
+                'id': record.container_id,
+                'action': 'status',
+                'status': record.status,
+                'state': record.state,
+                'restarted_count': record.restarted_count,
+            })
+        ContainerRecord.objects.bulk_update(records, ['status', 'state', 'restarted_count'])
+
+        if batch.container_destroyed:
+            ContainerRecord.objects.filter(host=host, container_id__in=batch.container_destroyed).update(
+                is_active=False, status='removed'
+            )
+            changes.extend({'kind': 'container', 'id': i, 'action': 'destroy'} for i in batch.container_destroyed)
+
+        if network_summaries:
+            sync_networks(host, network_summaries, prune=False)
+            changes.extend({'kind': 'network', 'id': n['Id'], 'action': 'refresh'} for n in network_summaries)
+        if batch.network_destroyed:
+            Network.objects.filter(host=host, id__in=batch.network_destroyed).delete()
+            changes.extend({'kind': 'network', 'id': i, 'action': 'destroy'} for i in batch.network_destroyed)
+
+        if volume_summaries:
+            sync_volumes(host, volume_summaries, prune=False)
+            changes.extend({'kind': 'volume', 'id': v['Name'], 'action': 'refresh'} for v in volume_summaries)
+        if batch.volume_destroyed:
+            Volume.objects.filter(host=host, name__in=batch.volume_destroyed).delete()
+            changes.extend({'kind': 'volume', 'id': i, 'action': 'destroy'} for i in batch.volume_destroyed)
+
+        if image_summaries is not None:
+            sync_images(host, image_summaries)
+            DockerHost.objects.filter(pk=host.pk).update(total_images_count=len(image_summaries))
+            changes.append({'kind': 'image', 'action': 'refresh'})
+
+        if touched or container_summaries or batch.container_destroyed:
+            DockerHost.objects.filter(pk=host.pk).update(
+                running_containers_count=ContainerRecord.objects.filter(
+                    host=host, is_active=True, status='running'
+                ).count()
+            )
+
+        if changes:
+            # The bulk writes above send no signals (see api.inventory).
+            bump_inventory(host.pk)
+
+        if batch.last_time_nano:
+            DockerHost.objects.filter(pk=host.pk).update(events_since=batch.last_time_nano)
+            host.events_since = batch.last_time_nano
+
+    return changes
+
+
+class HostEventSubscriber:
+    """
+    Follows `client.events()` for one host. A reader thread pushes raw events
+    into a queue; the applier thread drains it in windows of
+    `batch_window` seconds (or `batch_size` events) and writes each window
+    as one batch. A batch that fails to apply is retried, with the events
+    that arrive in between folded in, after a backoff starting at
+    `reconnect_delay` seconds and doubling up to a minute.
+    """
+
+    def __init__(self, host, batch_window=None, batch_size=None, reconnect_delay=None):
+        self.host = host
+        self.batch_window = batch_window or getattr(settings, 'DOCKER_EVENTS_BATCH_WINDOW', 0.5)
+        self.batch_size = batch_size or getattr(settings, 'DOCKER_EVENTS_BATCH_SIZE', 500)
+        self.reconnect_delay = reconnect_delay or getattr(settings, 'DOCKER_EVENTS_RECONNECT_DELAY', 5)
+        self._queue = queue.Queue(maxsize=self.batch_size * 10)
+        self._stopped = threading.Event()
+        self._stream = None
+        self._threads = []
+        # timeNano of the last event queued. events_since only moves once a
+        # batch is applied, so a reconnect resumes from here instead.
+        self._read_nano = None
+
+    def start(self):
+        for target, name in ((self._read_loop, 'reader'), (self._apply_loop, 'applier')):
+            thread = threading.Thread(target=target, name=f"events-{name}-{self.host.id}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _read_loop(self):
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            release = None
+            try:
+                since_nano = DockerHost.objects.filter(pk=self.host.pk).values_list('events_since', flat=True).first()
+                close_old_connections()
+                if self._read_nano and (not since_nano or self._read_nano > since_nano):
+                    since_nano = self._read_nano
+                # The daemon only takes whole seconds; events already read
+                # inside that second are skipped by timeNano below.
+                since = since_nano // 1_000_000_000 if since_nano else int(time.time())
+                client = get_client(self.host)
+                release = docker_clients.hold(client)
+                self._stream = client.events(since=since, decode=True)
+                delay = self.reconnect_delay
+                for event in self._stream:
+                    if since_nano and event.get('timeNano', 0) <= since_nano:
+                        continue
+                    self._queue.put(event)
+                    if event.get('timeNano'):
+                        self._read_nano = event['timeNano']
+                    if self._stopped.is_set():
+                        break
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning("Event stream for host %s dropped: %s", self.host.id, e)
+            finally:
+                self._stream = None
+                if release is not None:
+                    release()
+            self._stopped.wait(delay)
+            delay = min(delay * 2, 60)
+
+    def _apply_loop(self):
+        batch = None
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            if batch is None:
+                try:
+                    first = self._queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                batch = EventBatch()
+                batch.add(first)
+            deadline = time.monotonic() + self.batch_window
+            while batch.size < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.add(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                changes = apply_event_batch(self.host, batch)
+            except Exception as e:
+                # Nothing was written and the reader has moved past these
+                # events: keep the batch, fold in what arrives meanwhile and
+                # try again.
+                logger.warning(
+                    "Failed to apply %d events for host %s, retrying in %ss: %s",
+                    batch.size, self.host.id, delay, e,
+                )
+                self._stopped.wait(delay)
+                delay = min(delay * 2, 60)
+                continue
+            finally:
+                close_old_connections()
+            batch = None
+            delay = self.reconnect_delay
+            try:
+                publish_host_changes(self.host.id, changes)
+            except Exception as e:
+                logger.warning("Could not publish changes of host %s: %s", self.host.id, e)
+
+
+class EventWatcher:
+    """Keeps one HostEventSubscriber running per DockerHost."""
+
+    def __init__(self, refresh_interval=60, host_ids=None):
+        self.refresh_interval = refresh_interval
+        self.host_ids = host_ids
+        self.subscribers = {}
+        self._stopped = threading.Event()
+
+    def refresh(self):
+        hosts = DockerHost.objects.all()
+        if self.host_ids:
+            hosts = hosts.filter(id__in=self.host_ids)
+        current = {host.id: host for host in hosts}
+        close_old_connections()
+
+        for host_id in list(self.subscribers):
+            subscriber = self.subscribers[host_id]
+            host = current.get(host_id)
+            if (
+                host is None
+                or not subscriber.is_alive()
+                or connection_fingerprint(host) != connection_fingerprint(subscriber.host)
+            ):
+                subscriber.stop()
+                del self.subscribers[host_id]
+        for host_id, host in current.items():
+            if host_id not in self.subscribers:
+                subscriber = HostEventSubscriber(host)
+                subscriber.start()
+                self.subscribers[host_id] = subscriber
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._stopped.wait(self.refresh_interval)
+
+    def stop(self):
+        self._stopped.set()
+        for subscriber in self.subscribers.values():
+            subscriber.stop()
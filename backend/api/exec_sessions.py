@@ -0,0 +1,419 @@
+"""
+Exec sessions: the interactive shells opened in containers from the
+terminal page.
+
+Each shell is an ExecSession row. `open_session` (create_exec_session)
+enforces EXEC_MAX_PER_CONTAINER and EXEC_MAX_PER_USER over the sessions
+that are not closed, and hands back the user's detached (or not yet
+attached) shell in the container instead of starting another one, so a
+page refresh lands in the same shell.
+
+The exec socket is owned by `manager`, not by the TerminalConsumer
+relaying it. When the WebSocket goes away the shell is kept, with its
+recent output, for EXEC_REATTACH_GRACE seconds; a socket connecting to the
+same exec in that time takes over where the last one stopped. An explicit
+close (close code 1000 or {"type": "close"}) ends it at once, and a shell
+without input or output for EXEC_IDLE_TIMEOUT seconds is reaped.
+
+Docker has no call to stop an exec, and closing its socket does not stop
+the shell. Every session's shell is started with DIH_EXEC_SESSION=<session
+id> in its environment, which the processes started from it inherit; ending
+a session runs a second exec that hangs those processes up (then kills
+what is left).
+
+Sockets are held per backend process, so reattaching needs the new
+socket to reach the same process: with several replicas, WebSockets must
+be routed stickily (kubernetes/ pins each browser to a backend pod with
+a cookie on the ingress, and in-cluster clients by IP on the Service).
+A socket that lands on another process gets "held by another backend
+process" and has to open a new session. Sessions whose process stopped
+sending heartbeats, and created sessions no socket ever attached to, are
+closed by the reaper of any process.
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+import docker.errors
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, Count, IntegerField, Q, When
+from django.utils import timezone
+
+from .circuit_breaker import HostUnavailable
+from .docker_clients import get_client, registry as docker_clients
+from .models import ContainerRecord, ExecSession
+from .operations import OperationError
+from .streams import DockerStreamReader, SocketStream
+
+logger = logging.getLogger(__name__)
+
+SESSION_ENV = 'DIH_EXEC_SESSION'
+
+# Lists the processes carrying the session's marker, hangs them up, and
+# kills the ones still there a second later. Only needs sh, tr and grep.
+KILL_SCRIPT = (
+    'pids=; for d in /proc/[0-9]*; do '
+    'tr "\\000" "\\n" < "$d/environ" 2>/dev/null | grep -qx "$1" && pids="$pids ${d#/proc/}"; '
+    'done; '
+    '[ -z "$pids" ] && exit 0; '
+    'kill -HUP $pids 2>/dev/null; sleep 1; kill -KILL $pids 2>/dev/null; exit 0'
+)
+
+
+def open_session(container, user, new=False):
+    """
+    (session, reattached) for a shell of `user` in `container`. Unless
+    `new`, the user's detached or unattached shell there is returned rather
+    than creating one. Raises OperationError (429) past the session limits.
+    """
+    command = '/bin/sh'
+    with transaction.atomic():
+        # Serializes opens in the same container, where the database locks rows.
+        ContainerRecord.objects.select_for_update().filter(pk=container.pk).first()
+        active = ExecSession.objects.filter(status__in=ExecSession.ACTIVE_STATUSES)
+        if not new:
+            existing = (
+                active.filter(container=container, user=user, status__in=('detached', 'created'),
+                              exec_id__isnull=False)
+                .order_by(Case(When(status='detached', then=0), default=1, output_field=IntegerField()),
+                          '-last_activity_at')
+                .first()
+            )
+            if existing is not None:
+                return existing, True
+
+        max_per_container = getattr(settings, 'EXEC_MAX_PER_CONTAINER', 4)
+        if active.filter(container=container).count() >= max_per_container:
+            raise OperationError(f'At most {max_per_container} terminal sessions per container.', status=429)
+        max_per_user = getattr(settings, 'EXEC_MAX_PER_USER', 10)
+        if active.filter(user=user).count() >= max_per_user:
+            raise OperationError(f'At most {max_per_user} terminal sessions per user.', status=429)
+
+        # Reserve the slot; the daemon is only called once the lock is released.
+        session = ExecSession.objects.create(container=container, user=user, command=command)
+
+    try:
+        exec_instance = get_client(container.host).api.exec_create(
+            container=container.container_id,
+            cmd=command,
+            tty=True,
+            stdin=True,
+            environment={SESSION_ENV: str(session.id)},
+        )
+    except Exception:
+        session.delete()
+        raise
+    session.exec_id = exec_instance['Id']
+    session.save(update_fields=['exec_id'])
+    return session, False
+
+
+def terminate(session):
+    """Stop the session's shell and what it started; its exit code if it has ended."""
+    if session.exec_id is None:
+        # Reserved by open_session, which never got to create the exec.
+        return None
+    client = get_client(session.container.host)
+    state = client.api.exec_inspect(session.exec_id)
+    if state.get('Running'):
+        kill = client.api.exec_create(
+            container=session.container.container_id,
+            cmd=['sh', '-c', KILL_SCRIPT, 'sh', f'{SESSION_ENV}={session.id}'],
+        )
+        client.api.exec_start(kill['Id'])
+        state = client.api.exec_inspect(session.exec_id)
+    return None if state.get('Running') else state.get('ExitCode')
+
+
+def close_session(session, reason, kill=True):
+    """Mark `session` closed, stopping its processes first unless `kill` is false. Returns the exit code."""
+    exit_code = None
+    if kill:
+        try:
+            exit_code = terminate(session)
+        except (HostUnavailable, docker.errors.APIError) as e:
+            # The container or host is gone, and the shell with it.
+            logger.info("Could not stop exec session %s: %s", session.id, e)
+    ExecSession.objects.filter(pk=session.pk, status__in=ExecSession.ACTIVE_STATUSES).update(
+        status='closed', closed_at=timezone.now(), close_reason=reason, exit_code=exit_code,
+    )
+    return exit_code
+
+
+def serialize_session(session):
+    return {
+        'id': str(session.id),
+        'exec_id': session.exec_id,
+        'host_id': str(session.container.host_id),
+        'container_id': session.container.container_id,
+        'user': session.user.username,
+        'status': session.status,
+        'created_at': session.created_at,
+        'last_activity_at': session.last_activity_at,
+    }
+
+
+def session_counts(sessions):
+    """Active sessions of the ExecSession queryset `sessions`, per container and per user."""
+    active = sessions.filter(status__in=ExecSession.ACTIVE_STATUSES).order_by()
+    return {
+        'total': active.count(),
+        'by_status': dict(active.values_list('status').annotate(n=Count('pk'))),
+        'by_container': dict(active.values_list('container__container_id').annotate(n=Count('pk'))),
+        'by_user': dict(active.values_list('user__username').annotate(n=Count('pk'))),
+    }
+
+
+def _sweep(live_activity, reap_before, attach_before):
+    """
+    Heartbeat the sessions this process holds ({id: last activity}) and
+    close the ones no process holds any more.
+    """
+    now = timezone.now()
+    try:
+        for session_id, last_activity in live_activity.items():
+            ExecSession.objects.filter(pk=session_id, status__in=ExecSession.ACTIVE_STATUSES).update(
+                heartbeat_at=now, last_activity_at=last_activity,
+            )
+        stale = list(
+            ExecSession.objects.select_related('container__host')
+            .filter(
+                Q(status='created', created_at__lt=attach_before)
+                | Q(status__in=('attached', 'detached'), heartbeat_at__lt=reap_before)
+            )
+            .exclude(pk__in=list(live_activity))
+        )
+        for session in stale:
+            close_session(session, 'abandoned')
+        return len(stale)
+    finally:
+        close_old_connections()
+
+
+class _Live:
+    """An exec socket held by this process across the WebSockets attached to it."""
+
+    def __init__(self, session):
+        self.session = session
+        self.client = None
+        self.socket = None
+        self.reader = None
+        self.consumer = None
+        self.scrollback = bytearray()
+        self.last_activity = time.monotonic()
+        self.last_activity_at = timezone.now()
+        self.started = None
+        self.detach_timer = None
+        self.closing = None
+        self.release_client = lambda: None
+        self.status_lock = asyncio.Lock()
+
+    @property
+    def exec_id(self):
+        return self.session.exec_id
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+        self.last_activity_at = timezone.now()
+
+    def record_output(self, data, limit):
+        if not data:
+            return
+        self.touch()
+        self.scrollback += data
+        if len(self.scrollback) > limit:
+            del self.scrollback[:len(self.scrollback) - limit]
+            # Replay from a line start rather than from inside a character or escape sequence.
+            newline = self.scrollback.find(b'\n')
+            if newline != -1:
+                del self.scrollback[:newline + 1]
+
+    async def send(self, data):
+        self.touch()
+        await asyncio.to_thread(self.socket._sock.sendall, data)
+
+    async def start(self, read_size, buffer_size):
+        def open_socket():
+            self.client = get_client(self.session.container.host)
+            self.release_client = docker_clients.hold(self.client)
+            try:
+                self.socket = self.client.api.exec_start(exec_id=self.exec_id, socket=True, tty=True, stream=True)
+            except BaseException:
+                self.release_client()
+                raise
+
+        await asyncio.to_thread(open_socket)
+        sock = self.socket._sock
+        self.reader = DockerStreamReader(lambda: SocketStream(sock, read_size), buffer_size=buffer_size).start()
+
+    def close_socket(self):
+        if self.reader is not None:
+            self.reader.close()
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except Exception:
+                pass
+        self.release_client()
+
+
+class SessionUnavailable(Exception):
+    pass
+
+
+class ExecSessionManager:
+    """
+    The exec sockets of this process, keyed by session id. A TerminalConsumer
+    `attach`es to get the socket and its output reader, and `detach`es when
+    it disconnects; the consumer attached to a session is sent
+    `session_ended(reason)` when the manager closes it.
+    """
+
+    def __init__(self):
+        self.live = {}
+        self.reaper = None
+        self.reaped = 0
+        self.idle_timeout = getattr(settings, 'EXEC_IDLE_TIMEOUT', 30 * 60)
+        self.reattach_grace = getattr(settings, 'EXEC_REATTACH_GRACE', 60)
+        self.attach_timeout = getattr(settings, 'EXEC_ATTACH_TIMEOUT', 120)
+        self.reap_interval = getattr(settings, 'EXEC_REAP_INTERVAL', 15)
+        self.scrollback_bytes = getattr(settings, 'EXEC_SCROLLBACK_BYTES', 64 * 1024)
+
+    async def attach(self, session, consumer, read_size, buffer_size):
+        """
+        The live exec of `session` with `consumer` as its socket. The first
+        attach starts the exec; a later one replaces the consumer attached
+        before it, if any. Raises SessionUnavailable for a session that is
+        closed or held by another process.
+        """
+        self._ensure_reaper()
+        live = self.live.get(session.id)
+        if live is None:
+            if session.status != 'created':
+                raise SessionUnavailable(
+                    'Terminal session has ended.' if session.status == 'closed'
+                    else 'Terminal session is held by another backend process.'
+                )
+            live = _Live(session)
+            self.live[session.id] = live
+            live.started = asyncio.ensure_future(live.start(read_size, buffer_size))
+        try:
+            await asyncio.shield(live.started)
+        except asyncio.CancelledError:
+            # The socket went away while the exec was starting.
+            self._expire_later(live)
+            raise
+        except Exception:
+            if self.live.get(session.id) is live:
+                del self.live[session.id]
+                await asyncio.to_thread(self._close_row, live, 'failed', False)
+            raise
+
+        if live.detach_timer is not None:
+            live.detach_timer.cancel()
+            live.detach_timer = None
+        previous, live.consumer = live.consumer, consumer
+        if previous is not None and previous is not consumer:
+            await previous.session_ended('replaced')
+        await self._save_status(live)
+        return live
+
+    async def detach(self, consumer, end=False):
+        """`consumer` went away: end its session if `end`, else keep it for a reattach."""
+        live = next((live for live in list(self.live.values()) if live.consumer is consumer), None)
+        if live is None:
+            return
+        live.consumer = None
+        if end:
+            await self.close(live, 'closed')
+            return
+        self._expire_later(live)
+        await self._save_status(live)
+
+    def _expire_later(self, live):
+        if live.consumer is None and live.detach_timer is None and self.live.get(live.session.id) is live:
+            live.detach_timer = asyncio.get_running_loop().call_later(self.reattach_grace, self._expire, live)
+
+    def _expire(self, live):
+        live.detach_timer = None
+        if live.consumer is None:
+            live.closing = asyncio.ensure_future(self.close(live, 'abandoned'))
+
+    async def close(self, live, reason, notify=True):
+        """End a live session, stopping its processes. Returns the exit code, if known."""
+        if self.live.get(live.session.id) is not live:
+            return None
+        del self.live[live.session.id]
+        if live.detach_timer is not None:
+            live.detach_timer.cancel()
+        consumer, live.consumer = live.consumer, None
+        if consumer is not None and notify:
+            await consumer.session_ended(reason)
+        live.close_socket()
+        return await asyncio.to_thread(self._close_row, live, reason)
+
+    @staticmethod
+    async def _save_status(live):
+        def save(status):
+            try:
+                ExecSession.objects.filter(pk=live.session.id, status__in=ExecSession.ACTIVE_STATUSES).update(
+                    status=status, heartbeat_at=timezone.now(), last_activity_at=live.last_activity_at,
+                )
+            finally:
+                close_old_connections()
+
+        # Attaches and detaches can overlap; whichever saves last writes the current state.
+        async with live.status_lock:
+            await asyncio.to_thread(save, 'attached' if live.consumer is not None else 'detached')
+
+    @staticmethod
+    def _close_row(live, reason, kill=True):
+        try:
+            return close_session(live.session, reason, kill)
+        finally:
+            close_old_connections()
+
+    def _ensure_reaper(self):
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.ensure_future(self._reap())
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("Exec session sweep failed")
+
+    async def reap(self):
+        """Close idle sessions of this process and sessions no process holds."""
+        now = time.monotonic()
+        for live in list(self.live.values()):
+            if now - live.last_activity > self.idle_timeout:
+                await self.close(live, 'idle')
+                self.reaped += 1
+        wall = timezone.now()
+        orphans = await asyncio.to_thread(
+            _sweep,
+            {session_id: live.last_activity_at for session_id, live in self.live.items()},
+            # A holder missing three heartbeats is taken to be gone.
+            wall - timedelta(seconds=max(self.reap_interval * 3, self.reattach_grace)),
+            wall - timedelta(seconds=self.attach_timeout),
+        )
+        self.reaped += orphans
+
+    def metrics(self):
+        lives = list(self.live.values())
+        attached = sum(1 for live in lives if live.consumer is not None)
+        return {
+            'live': len(lives),
+            'attached': attached,
+            'detached': len(lives) - attached,
+            'reaped': self.reaped,
+        }
+
+
+manager = ExecSessionManager()
+
@@ -0,0 +1,157 @@
+"""
+Fleet-wide summary (GET /api/fleet/summary/).
+
+Per-host counts come from one query: each count is a correlated subquery
+annotated on DockerHost, so hosts x containers x volumes x ... is never
+joined. Totals are summed from those rows.
+
+With `live=true` every host is also asked for `info()` (and `df()` with
+`disk=true`) at once on a bounded thread pool. The response waits at most
+FLEET_LIVE_DEADLINE seconds: hosts that have not answered by then, whose
+circuit is open or that fail are returned as stale, with the facts last
+stored by the health monitor and how old they are, instead of failing
+the whole request.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .circuit_breaker import HostUnavailable, call_budget
+from .docker_clients import get_client
+from .models import ContainerRecord, Image, Network, Volume
+
+COUNT_FIELDS = ['containers', 'running_containers', 'volumes', 'networks', 'images']
+CAPACITY_FIELDS = ['total_cpu_cores', 'total_memory_mb', 'running_containers_count', 'total_images_count']
+
+
+def _count(model, **filters):
+    rows = (
+        model.objects.filter(host=OuterRef('pk'), **filters)
+        .order_by().values('host').annotate(n=Count('pk')).values('n')
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def with_counts(hosts):
+    """
+    Annotate a DockerHost queryset with `n_<field>` for each of
+    COUNT_FIELDS (database rows, not live Docker state), in the same query.
+    """
+    return hosts.annotate(
+        n_containers=_count(ContainerRecord),
+        n_running_containers=_count(ContainerRecord, status='running', is_active=True),
+        n_volumes=_count(Volume),
+        n_networks=_count(Network),
+        n_images=_count(Image),
+    )
+
+
+def _disk_usage(df):
+    return {
+        'images_mb': round(sum(image.get('Size') or 0 for image in df.get('Images') or []) / 2 ** 20, 1),
+        'containers_mb': round(sum(c.get('SizeRw') or 0 for c in df.get('Containers') or []) / 2 ** 20, 1),
+        'volumes_mb': round(sum(
+            max((volume.get('UsageData') or {}).get('Size') or 0, 0) for volume in df.get('Volumes') or []
+        ) / 2 ** 20, 1),
+        'build_cache_mb': round(sum(entry.get('Size') or 0 for entry in df.get('BuildCache') or []) / 2 ** 20, 1),
+    }
+
+
+def _live(host, budget, disk):
+    try:
+        with call_budget(budget):
+            client = get_client(host)
+            info = client.info()
+            result = {
+                'state': 'fresh',
+                'checked_at': timezone.now(),
+                'containers_running': info.get('ContainersRunning'),
+                'containers_stopped': info.get('ContainersStopped'),
+                'images': info.get('Images'),
+                'cpu_cores': info.get('NCPU'),
+                'memory_mb': info['MemTotal'] // 2 ** 20 if info.get('MemTotal') else None,
+                'docker_version': info.get('ServerVersion'),
+            }
+            if disk:
+                result['disk'] = _disk_usage(client.df())
+            return result
+    except HostUnavailable:
+        return {'state': 'stale', 'reason': 'unavailable'}
+    except Exception as e:
+        return {'state': 'stale', 'reason': 'error', 'error': str(getattr(e, 'explanation', None) or e)[:255]}
+    finally:
+        # A circuit breaker changing state writes to the database from this thread.
+        close_old_connections()
+
+
+def live_facts(hosts, deadline, disk=False):
+    """
+    {host_id: live result} for every host, returned within `deadline`
+    seconds. Hosts still pending then are {'state': 'stale', 'reason': 'timeout'}.
+    """
+    if not hosts:
+        return {}
+    started = time.monotonic()
+    workers = min(getattr(settings, 'FLEET_LIVE_CONCURRENCY', 50), len(hosts))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fleet')
+    try:
+        # A call started late only gets what is left of the deadline, so no
+        # thread outlives the response by much.
+        futures = {
+            pool.submit(lambda host: _live(host, max(0.001, deadline - (time.monotonic() - started)), disk), host): host.pk
+            for host in hosts
+        }
+        done, _ = wait(futures, timeout=deadline)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return {
+        host_id: future.result() if future in done else {'state': 'stale', 'reason': 'timeout'}
+        for future, host_id in futures.items()
+    }
+
+
+def summarize(hosts, live=False, disk=False, deadline=None):
+    """The fleet summary for the DockerHost queryset `hosts`."""
+    hosts = list(with_counts(hosts).order_by('host_name'))
+    now = timezone.now()
+    results = live_facts(hosts, deadline, disk) if live else {}
+
+    totals = {field: 0 for field in COUNT_FIELDS + CAPACITY_FIELDS}
+    by_status = {}
+    entries = []
+    for host in hosts:
+        counts = {field: getattr(host, f'n_{field}') for field in COUNT_FIELDS}
+        cached = {field: getattr(host, field) for field in CAPACITY_FIELDS}
+        for field, value in list(counts.items()) + list(cached.items()):
+            totals[field] += value or 0
+        by_status[host.status] = by_status.get(host.status, 0) + 1
+        entry = {
+            'id': str(host.id),
+            'host_name': host.host_name,
+            'status': host.status,
+            'circuit_state': host.circuit_state,
+            'counts': counts,
+            'cached': {
+                **cached,
+                'last_seen_at': host.last_seen_at,
+                'age_seconds': round((now - host.last_seen_at).total_seconds(), 1) if host.last_seen_at else None,
+            },
+        }
+        if live:
+            entry['live'] = results[host.pk]
+        entries.append(entry)
+
+    summary = {'hosts': len(hosts), 'by_status': by_status, 'totals': totals}
+    if live:
+        states = [result['state'] for result in results.values()]
+        summary['live'] = {'fresh': states.count('fresh'), 'stale': states.count('stale'), 'deadline': deadline}
+        summary['totals']['live_running_containers'] = sum(
+            result.get('containers_running') or 0 for result in results.values() if result['state'] == 'fresh'
+        )
+    summary['per_host'] = entries
+    return summary
@@ -0,0 +1,146 @@
+"""
+Fleet health monitor (python manage.py monitor_hosts).
+
+Every sweep pings and `info()`s all Docker hosts at once on a bounded
+thread pool, each probe under a HEALTH_PROBE_TIMEOUT call budget, then
+writes the results in bulk: one UPDATE for the hosts that answered
+(status, last_seen_at), one for those that did not, a bulk_update of
+versions and capacity only for hosts where they changed, and one
+bulk_create of HostPing rows. A sweep therefore takes about as long as
+the slowest batch of probes, not the sum of them, and touches the
+database a handful of times whatever the fleet size.
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .circuit_breaker import call_budget
+from .docker_clients import get_client
+from .models import DockerHost, HostPing
+
+logger = logging.getLogger(__name__)
+
+HOST_FACT_FIELDS = [
+    'docker_version', 'operating_system', 'total_cpu_cores',
+    'total_memory_mb', 'running_containers_count', 'total_images_count',
+]
+
+
+def probe_host(host, timeout=None):
+    """
+    Ping one host and read its facts. Never raises: returns
+    (facts or None, HostPing). Does not touch the database.
+    """
+    timeout = timeout or getattr(settings, 'HEALTH_PROBE_TIMEOUT', 5)
+    checked_at = timezone.now()
+    try:
+        with call_budget(timeout):
+            client = get_client(host)
+            started = time.monotonic()
+            client.ping()
+            latency_ms = (time.monotonic() - started) * 1000
+            info = client.info()
+    except Exception as e:
+        error = getattr(e, 'explanation', None) or str(e) or type(e).__name__
+        return None, HostPing(host_id=host.pk, checked_at=checked_at, ok=False, error=error[:255])
+    facts = {
+        'docker_version': info.get('ServerVersion'),
+        'operating_system': info.get('OperatingSystem'),
+        'total_cpu_cores': info.get('NCPU'),
+        'total_memory_mb': info['MemTotal'] // (1024 * 1024) if info.get('MemTotal') else None,
+        'running_containers_count': info.get('ContainersRunning'),
+        'total_images_count': info.get('Images'),
+    }
+    return facts, HostPing(host_id=host.pk, checked_at=checked_at, ok=True, latency_ms=round(latency_ms, 2))
+
+
+class HealthMonitor:
+    """
+    Sweeps every DockerHost every `interval` seconds (plus or minus
+    HEALTH_INTERVAL_JITTER of it, so several monitors drift apart), with at
+    most `concurrency` probes in flight.
+    """
+
+    def __init__(self, interval=None, concurrency=None):
+        self.interval = interval or getattr(settings, 'HEALTH_INTERVAL', 30)
+        self.concurrency = concurrency or getattr(settings, 'HEALTH_CONCURRENCY', 100)
+        self.interval_jitter = getattr(settings, 'HEALTH_INTERVAL_JITTER', 0.1)
+        self.probe_jitter = getattr(settings, 'HEALTH_PROBE_JITTER', 0.5)
+        self.retention = timedelta(days=getattr(settings, 'HEALTH_PING_RETENTION_DAYS', 7))
+        self._stopped = False
+
+    def sweep(self, hosts=None):
+        """Probe `hosts` (default: all) and store the results. Returns a summary."""
+        started = time.monotonic()
+        if hosts is None:
+            hosts = list(DockerHost.objects.all())
+        if not hosts:
+            return {'hosts': 0, 'ok': 0, 'failed': 0, 'seconds': 0}
+
+        # Spread the first wave of probes over HEALTH_PROBE_JITTER instead of
+        # hitting every daemon (and the local resolver/TLS stack) at once.
+        # Later probes start as soon as a worker is free.
+        starts = [started + random.uniform(0, self.probe_jitter) for _ in hosts]
+        workers = min(self.concurrency, len(hosts))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='health') as pool:
+            results = list(pool.map(self._probe, hosts, starts))
+
+        now = timezone.now()
+        pings = []
+        up, down, changed = [], [], []
+        for host, (facts, ping) in zip(hosts, results):
+            pings.append(ping)
+            if facts is None:
+                down.append(host.pk)
+                continue
+            up.append(host.pk)
+            if any(getattr(host, field) != value for field, value in facts.items()):
+                for field, value in facts.items():
+                    setattr(host, field, value)
+                changed.append(host)
+        for i in range(0, len(up), 1000):
+            DockerHost.objects.filter(pk__in=up[i:i + 1000]).update(status='active', last_seen_at=now)
+        for i in range(0, len(down), 1000):
+            DockerHost.objects.filter(pk__in=down[i:i + 1000]).update(status='inactive')
+        DockerHost.objects.bulk_update(changed, HOST_FACT_FIELDS, batch_size=500)
+        HostPing.objects.bulk_create(pings, batch_size=1000)
+        HostPing.objects.filter(checked_at__lt=now - self.retention).delete()
+
+        ok = sum(ping.ok for ping in pings)
+        summary = {
+            'hosts': len(hosts),
+            'ok': ok,
+            'failed': len(hosts) - ok,
+            'changed': len(changed),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+        logger.info("Health sweep: %s", summary)
+        return summary
+
+    def _probe(self, host, start_at):
+        time.sleep(max(0, start_at - time.monotonic()))
+        try:
+            return probe_host(host)
+        finally:
+            # A circuit breaker changing state writes to the database from this thread.
+            close_old_connections()
+
+    def run_forever(self):
+        while not self._stopped:
+            started = time.monotonic()
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.exception("Health sweep failed: %s", e)
+            close_old_connections()
+            delay = self.interval * random.uniform(1 - self.interval_jitter, 1 + self.interval_jitter)
+            time.sleep(max(0, delay - (time.monotonic() - started)))
+
+    def stop(self):
+        self._stopped = True
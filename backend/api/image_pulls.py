@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import docker.errors
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .docker_clients import get_client
+from .models import Image, ImagePull
+
+logger = logging.getLogger(__name__)
+
+
+def pull_group_name(pull_id):
+    return f"image_pull_{pull_id}"
+
+
+def split_reference(reference):
+    """"registry:5000/app:1.2" -> ("registry:5000/app", "1.2"); digests stay on the repository."""
+    if '@' in reference:
+        return reference, None
+    repository, _, tag = reference.rpartition(':')
+    if not repository or '/' in tag:
+        return reference, 'latest'
+    return repository, tag
+
+
+def image_reference(name, tag=None):
+    """Full reference for an image name as entered: `tag` is added unless the name has a tag or digest."""
+    if '@' in name or ':' in name.rsplit('/', 1)[-1]:
+        return name
+    return f"{name}:{tag or 'latest'}"
+
+
+def serialize_pull(pull):
+    return {
+        'id': str(pull.id),
+        'host_id': str(pull.host_id),
+        'reference': pull.reference,
+        'status': pull.status,
+        'progress': pull.progress,
+        'error': pull.error or None,
+        'image_id': pull.image_id,
+        'created_at': pull.created_at.isoformat() if pull.created_at else None,
+        'finished_at': pull.finished_at.isoformat() if pull.finished_at else None,
+    }
+
+
+def publish_pull(pull):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(pull_group_name(pull.id), {
+        'type': 'pull.progress',
+        'pull': serialize_pull(pull),
+    })
+
+
+class PullProgress:
+    """
+    Folds the daemon's per-layer pull messages into one summary: layers
+    seen and finished, bytes downloaded out of the known total, and the
+    last status line.
+    """
+
+    DONE_STATUSES = ('Pull complete', 'Already exists', 'Download complete')
+
+    def __init__(self):
+        self.layers = {}
+        self.status = None
+
+    def update(self, event):
+        layer_id = event.get('id')
+        status = event.get('status')
+        if layer_id and 'progressDetail' in event:
+            layer = self.layers.setdefault(layer_id, {'current': 0, 'total': 0, 'done': False})
+            detail = event.get('progressDetail') or {}
+            if status == 'Downloading' and detail.get('total'):
+                layer['current'] = detail.get('current', 0)
+                layer['total'] = detail['total']
+            if status in self.DONE_STATUSES:
+                layer['done'] = True
+                layer['current'] = layer['total']
+        elif status:
+            self.status = status
+
+    def summary(self):
+        current = sum(layer['current'] for layer in self.layers.values())
+        total = sum(layer['total'] for layer in self.layers.values())
+        done = sum(layer['done'] for layer in self.layers.values())
+        return {
+            'layers': len(self.layers),
+            'layers_done': done,
+            'bytes_downloaded': current,
+            'bytes_total': total,
+            'percent': round(current / total * 100, 1) if total else None,
+            'status': self.status,
+        }
+
+
+def record_image(host, reference, attrs):
+    """Create or refresh the Image row for a pulled image."""
+    name, tag = split_reference(reference)
+    digest = attrs['Id'].split(':')[-1]
+    # create_container has stored bare digests, create_image "sha256:<hex>".
+    image = (Image.objects.filter(host=host, image_id__in=[attrs['Id'], digest]).first()
+             or Image(host=host, image_id=attrs['Id']))
+    image.name = name
+    image.tag = tag or 'latest'
+    image.size = attrs.get('Size')
+    image.save()
+    return image
+
+
+def _run_pull(pull_id):
+    pull = ImagePull.objects.select_related('host').get(pk=pull_id)
+    publish_interval = getattr(settings, 'IMAGE_PULL_PUBLISH_INTERVAL', 0.5)
+    save_interval = getattr(settings, 'IMAGE_PULL_SAVE_INTERVAL', 5)
+    progress = PullProgress()
+    published_at = saved_at = time.monotonic()
+    try:
+        api = get_client(pull.host).api
+        repository, tag = split_reference(pull.reference)
+        for event in api.pull(repository, tag=tag, stream=True, decode=True):
+            if 'error' in event:
+                raise docker.errors.APIError(event['error'])
+            progress.update(event)
+            now = time.monotonic()
+            if now - published_at >= publish_interval:
+                pull.progress = progress.summary()
+                publish_pull(pull)
+                published_at = now
+            if now - saved_at >= save_interval:
+                # Also the heartbeat that tells other requests this pull is alive.
+                pull.save(update_fields=['progress', 'updated_at'])
+                saved_at = now
+
+        pull.image = record_image(pull.host, pull.reference, api.inspect_image(pull.reference))
+        pull.status = 'succeeded'
+    except Exception as e:
+        logger.warning("Pull of %s on %s failed: %s", pull.reference, pull.host_id, e)
+        pull.status = 'failed'
+        pull.error = getattr(e, 'explanation', None) or str(e)
+    finally:
+        pull.progress = progress.summary()
+        pull.finished_at = pull.updated_at = timezone.now()
+        # Only while still running: start_pull may have marked it abandoned
+        # (and started a replacement) if this thread stalled for too long.
+        finished = ImagePull.objects.filter(pk=pull.pk, status='running').update(
+            status=pull.status, error=pull.error, image=pull.image, progress=pull.progress,
+            finished_at=pull.finished_at, updated_at=pull.updated_at,
+        )
+        if not finished:
+            pull.refresh_from_db()
+            logger.info("Pull of %s on %s was already marked %s", pull.reference, pull.host_id, pull.status)
+        publish_pull(pull)
+        close_old_connections()
+
+
+def start_pull(host, reference, user=None):
+    """
+    Start pulling `reference` on `host` in the background, or join the pull
+    already running for it. Returns (pull, started).
+
+    A running pull that has not reported progress for
+    IMAGE_PULL_STALE_AFTER seconds (its process died) is marked failed and
+    replaced.
+    """
+    stale_after = getattr(settings, 'IMAGE_PULL_STALE_AFTER', 300)
+    ImagePull.objects.filter(
+        host=host, reference=reference, status='running',
+        updated_at__lt=timezone.now() - timedelta(seconds=stale_after),
+    ).update(status='failed', error='Pull abandoned: no progress reported.', finished_at=timezone.now())
+
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                pull = ImagePull.objects.create(host=host, reference=reference, requested_by=user)
+        except IntegrityError:
+            existing = ImagePull.objects.filter(host=host, reference=reference, status='running').first()
+            if existing is not None:
+                return existing, False
+            continue  # it finished in between; try again
+        transaction.on_commit(lambda: threading.Thread(
+            target=_run_pull, args=(pull.pk,), name=f"image-pull-{pull.pk}", daemon=True,
+        ).start())
+        return pull, True
+    raise RuntimeError(f"Could not start a pull of {reference}.")
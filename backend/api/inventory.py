@@ -0,0 +1,108 @@
+"""
+Per-host inventory versions and conditional GETs for the host listings.
+
+DockerHost.inventory_version goes up by one whenever the containers,
+networks, volumes or images stored for the host change: single-object
+saves and deletes through api.signals, bulk writes (inventory sync,
+Docker events, bulk actions) by calling bump_inventory themselves,
+inside `batched_bumps()` so each host is bumped once however many rows
+changed.
+
+The polled list endpoints answer through `conditional_response`. Its
+ETag is built from the version, the host fields the listings return,
+the query string and who is asking, so an unchanged poll with a
+matching If-None-Match gets a 304 after one query for the host, without
+running the listing's queryset or serializer. A 200 is rendered once per
+ETag and then served from the cache for INVENTORY_CACHE_TTL seconds.
+Heartbeat timestamps (last_seen_at) are left out of the ETag, since the
+health monitor moves them on every sweep; in a listing they are as of
+when it was rendered.
+"""
+import contextvars
+import hashlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import DockerHost
+from .serializers import DockerHostSerializer
+
+# Written by every health sweep (api.health) without anything else changing.
+HEARTBEAT_FIELDS = ('last_seen_at',)
+
+# The host fields the listings return (DockerHostSerializer), heartbeats aside.
+HOST_ETAG_FIELDS = [field for field in DockerHostSerializer.Meta.fields if field not in HEARTBEAT_FIELDS]
+
+
+_pending = contextvars.ContextVar('inventory_bumps', default=None)
+
+
+def bump_inventory(*host_ids):
+    """Record that the stored inventory of these hosts changed."""
+    pending = _pending.get()
+    if pending is not None:
+        pending.update(host_ids)
+    elif host_ids:
+        DockerHost.objects.filter(pk__in=host_ids).update(inventory_version=F('inventory_version') + 1)
+
+
+@contextmanager
+def batched_bumps():
+    """Bump every host bump_inventory was called for in this block once, at its end."""
+    if _pending.get() is not None:
+        yield
+        return
+    token = _pending.set(set())
+    try:
+        yield
+        host_ids = _pending.get()
+    finally:
+        _pending.reset(token)
+    bump_inventory(*host_ids)
+
+
+def _audience(user, per_user):
+    roles = ','.join(sorted(user.get_roles())) or '-'
+    # Listings filtered by per-object permissions differ between users of the same role.
+    return f'{roles}:{user.pk}' if per_user and not user.is_admin() else roles
+
+
+def inventory_etag(request, host, view, per_user=False):
+    host_state = '|'.join(str(getattr(host, field)) for field in HOST_ETAG_FIELDS)
+    digest = hashlib.blake2b(
+        f'{view}|{_audience(request.user, per_user)}|{request.GET.urlencode()}|{host_state}'.encode(),
+        digest_size=8,
+    ).hexdigest()
+    return f'"{host.pk}-{host.inventory_version}-{digest}"'
+
+
+def _matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    return header.strip() == '*' or etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+def conditional_response(request, host, view, render, per_user=False):
+    """
+    304 if the client already has the current listing, else the listing
+    from the cache or from `render()` (which returns the response data and
+    may raise like the view would).
+    """
+    etag = inventory_etag(request, host, view, per_user)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if _matches(request, etag):
+        return Response(status=304, headers=headers)
+
+    key = f'inventory:{etag.strip(chr(34))}'
+    body = cache.get(key)
+    if body is None:
+        body = JSONRenderer().render(render())
+        cache.set(key, body, getattr(settings, 'INVENTORY_CACHE_TTL', 300))
+    response = HttpResponse(body, content_type='application/json')
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,251 @@
+"""
+Durable background jobs for Docker operations.
+
+A Job row is the queue entry and the record of the outcome. `enqueue()`
+creates it; the `run_jobs` command (JobWorker) claims queued jobs with a
+conditional UPDATE, so several workers can share the table, and runs
+them on a thread pool with at most JOBS_PER_HOST running per host.
+
+Transient failures (daemon unreachable, timeouts, 5xx) are retried up to
+`max_attempts` with exponential backoff. A worker that dies leaves its
+jobs with a stale heartbeat; they are put back in the queue. Queued jobs
+are cancelled at once, running ones when their handler next calls
+`context.check_cancelled()`.
+
+Handlers are registered with `@job_handler(kind)` (see api.operations)
+and called as handler(context, **job.params). They return a
+JSON-serializable result.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import docker.errors
+import requests
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .circuit_breaker import HostUnavailable
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(kind, max_attempts=None):
+    def register(func):
+        HANDLERS[kind] = (func, max_attempts)
+        return func
+    return register
+
+
+def job_group_name(job_id):
+    return f"job_{job_id}"
+
+
+def serialize_job(job):
+    return {
+        'id': str(job.id),
+        'kind': job.kind,
+        'host_id': str(job.host_id) if job.host_id else None,
+        'status': job.status,
+        'progress': job.progress,
+        'result': job.result,
+        'error': job.error or None,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'cancel_requested': job.cancel_requested,
+        'run_after': job.run_after.isoformat() if job.run_after else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def publish_job(job):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(job_group_name(job.id), {
+            'type': 'job.update',
+            'job': serialize_job(job),
+        })
+    except Exception as e:
+        # Sockets fall back to polling the row; never fail a job over this.
+        logger.debug("Could not publish job %s: %s", job.id, e)
+
+
+def enqueue(kind, params, host=None, user=None):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    max_attempts = HANDLERS[kind][1] or getattr(settings, 'JOBS_MAX_ATTEMPTS', 3)
+    return Job.objects.create(kind=kind, params=params, host=host, created_by=user, max_attempts=max_attempts)
+
+
+def cancel(job):
+    """Cancel a queued job now, or ask a running one to stop. Returns the refreshed job."""
+    now = timezone.now()
+    if not Job.objects.filter(pk=job.pk, status='queued').update(status='cancelled', cancel_requested=True, finished_at=now):
+        Job.objects.filter(pk=job.pk, status='running').update(cancel_requested=True)
+    job.refresh_from_db()
+    publish_job(job)
+    return job
+
+
+def is_transient(exc):
+    """Failures worth retrying: the daemon could not be reached or answered with a server error."""
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, HostUnavailable)):
+        return True
+    if isinstance(exc, docker.errors.APIError) and not isinstance(exc, docker.errors.NotFound):
+        return exc.response is not None and exc.is_server_error()
+    return False
+
+
+def backoff(attempt):
+    """Delay before retry number `attempt` (1-based): exponential with jitter, capped."""
+    base = getattr(settings, 'JOBS_RETRY_BASE_DELAY', 5)
+    cap = getattr(settings, 'JOBS_RETRY_MAX_DELAY', 300)
+    return min(base * 2 ** (attempt - 1), cap) * random.uniform(0.5, 1.0)
+
+
+class JobContext:
+    """Handed to handlers: cancellation checks and progress reports."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def check_cancelled(self):
+        if Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+    def report(self, progress):
+        self.job.progress = progress
+        Job.objects.filter(pk=self.job.pk).update(progress=progress, heartbeat_at=timezone.now())
+        publish_job(self.job)
+
+
+class JobWorker:
+    """
+    Claims and runs jobs until stopped. `concurrency` jobs run at once in
+    this process, at most `per_host` of them (counted over all workers)
+    for any one host.
+    """
+
+    def __init__(self, concurrency=None, per_host=None, poll_interval=None, kinds=None):
+        self.concurrency = concurrency or getattr(settings, 'JOBS_CONCURRENCY', 8)
+        self.per_host = per_host or getattr(settings, 'JOBS_PER_HOST', 2)
+        self.poll_interval = poll_interval or getattr(settings, 'JOBS_POLL_INTERVAL', 1)
+        self.heartbeat_interval = getattr(settings, 'JOBS_HEARTBEAT_INTERVAL', 10)
+        self.stale_after = getattr(settings, 'JOBS_STALE_AFTER', 60)
+        self.kinds = kinds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def claim(self):
+        now = timezone.now()
+        busy_hosts = [
+            row['host'] for row in
+            Job.objects.filter(status='running', host__isnull=False)
+            .values('host').annotate(running=Count('id')).filter(running__gte=self.per_host)
+        ]
+        candidates = Job.objects.filter(status='queued', run_after__lte=now).exclude(host__in=busy_hosts)
+        if self.kinds:
+            candidates = candidates.filter(kind__in=self.kinds)
+        for job_id in candidates.order_by('run_after', 'created_at').values_list('id', flat=True)[:20]:
+            claimed = Job.objects.filter(pk=job_id, status='queued').update(
+                status='running', worker=self.worker_id, started_at=now, heartbeat_at=now,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return Job.objects.get(pk=job_id)
+        return None
+
+    def execute(self, job):
+        handler = HANDLERS.get(job.kind, (None, None))[0]
+        update = {'worker': '', 'heartbeat_at': None}
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            result = handler(JobContext(job), **job.params)
+            update.update(status='succeeded', result=result, error='')
+        except JobCancelled:
+            update.update(status='cancelled', error='')
+        except Exception as e:
+            error = getattr(e, 'explanation', None) or str(e) or type(e).__name__
+            if is_transient(e) and job.attempts < job.max_attempts:
+                delay = backoff(job.attempts)
+                logger.info("Job %s (%s) failed, retrying in %.0fs: %s", job.id, job.kind, delay, error)
+                update.update(status='queued', error=error, run_after=timezone.now() + timedelta(seconds=delay))
+            else:
+                logger.warning("Job %s (%s) failed: %s", job.id, job.kind, error)
+                update.update(status='failed', error=error)
+        finally:
+            if update.get('status') in Job.FINISHED_STATUSES:
+                update['finished_at'] = timezone.now()
+            # Only write the outcome if the job is still ours (it may have been reaped).
+            Job.objects.filter(pk=job.pk, worker=self.worker_id, status='running').update(**update)
+            job.refresh_from_db()
+            publish_job(job)
+            close_old_connections()
+            with self._lock:
+                self.running.discard(job.pk)
+            self._wakeup.set()
+
+    def heartbeat(self):
+        with self._lock:
+            running = list(self.running)
+        if running:
+            Job.objects.filter(pk__in=running, worker=self.worker_id).update(heartbeat_at=timezone.now())
+
+    def requeue_stale(self):
+        """Jobs whose worker stopped heartbeating go back in the queue, or fail if out of attempts."""
+        stale = Job.objects.filter(status='running', heartbeat_at__lt=timezone.now() - timedelta(seconds=self.stale_after))
+        stale.filter(attempts__gte=F('max_attempts')).update(
+            status='failed', error='Worker stopped while running the job.', worker='', finished_at=timezone.now(),
+        )
+        requeued = stale.update(status='queued', worker='', run_after=timezone.now())
+        if requeued:
+            logger.info("Requeued %d jobs from stopped workers", requeued)
+
+    def run_forever(self):
+        last_heartbeat = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self._stopped.is_set():
+                self._wakeup.clear()
+                now = timezone.now().timestamp()
+                if now - last_heartbeat >= self.heartbeat_interval:
+                    self.heartbeat()
+                    self.requeue_stale()
+                    last_heartbeat = now
+                while len(self.running) < self.concurrency:
+                    job = self.claim()
+                    if job is None:
+                        break
+                    with self._lock:
+                        self.running.add(job.pk)
+                    publish_job(job)
+                    pool.submit(self.execute, job)
+                close_old_connections()
+                self._wakeup.wait(self.poll_interval)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
@@ -0,0 +1,582 @@
+"""
+On-disk archive of container logs, searchable after the container is gone.
+
+Layout, under LOG_ARCHIVE_DIR:
+
+    <host_id>/<container_id>/meta.json
+    <host_id>/<container_id>/<first timestamp>.log.gz
+    <host_id>/<container_id>/<first timestamp>.idx
+    <host_id>/<container_id>/.lock
+
+A segment (.log.gz) is a series of independent gzip members ("blocks"),
+each holding up to LOG_ARCHIVE_BLOCK_BYTES of lines, and is only ever
+appended to. Its .idx file gets one JSON line per block, written after
+the block: byte offset and length, first and last timestamp, and a bloom
+filter of the block's words. The .idx is the sparse time index and the
+token index at once. A search reads it and decompresses only the blocks
+whose time range overlaps the query and whose filter may contain every
+word.
+
+Only the holder of `.lock` writes to a container's directory.
+"""
+import base64
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .docker_clients import get_client
+from .log_merge import filter_by_labels
+from .logs import LogBatchStream, LogQuery, encode_cursor, format_api_time, open_log_stream
+from .models import ContainerRecord
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.log.gz'
+INDEX_SUFFIX = '.idx'
+BLOOM_HASHES = 7
+BLOOM_BITS_PER_TOKEN = 10
+
+WORD_RE = re.compile(rb'[a-z0-9_]{1,64}')
+
+
+def archive_root():
+    return getattr(settings, 'LOG_ARCHIVE_DIR', None)
+
+
+def container_directory(host_id, container_id):
+    return os.path.join(archive_root(), str(host_id), container_id)
+
+
+def tokenize(text):
+    """Distinct lower-cased words of `text` (bytes); these are what the bloom filters hold."""
+    return set(WORD_RE.findall(text.lower()))
+
+
+def _parse_point(value):
+    seconds, _, nanos = value.partition('.')
+    return int(seconds), int(nanos or 0)
+
+
+def format_timestamp(point):
+    """(seconds, nanoseconds) as the RFC 3339 timestamp Docker prints."""
+    base = datetime.fromtimestamp(point[0], tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    return f"{base}.{point[1]:09d}Z"
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over words, sized for the block it describes (~1% false positives)."""
+    __slots__ = ('bits', 'size')
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.size = len(bits) * 8
+
+    @classmethod
+    def for_tokens(cls, tokens):
+        bloom = cls(bytearray(max(8, (len(tokens) * BLOOM_BITS_PER_TOKEN + 7) // 8)))
+        for token in tokens:
+            bloom.add(token)
+        return bloom
+
+    def _positions(self, token):
+        digest = hashlib.blake2b(token, digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], 'little')
+        h2 = int.from_bytes(digest[4:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(BLOOM_HASHES))
+
+    def add(self, token):
+        for position in self._positions(token):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, token):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(token))
+
+    def encode(self):
+        return base64.b64encode(bytes(self.bits)).decode()
+
+    @classmethod
+    def decode(cls, value):
+        return cls(base64.b64decode(value))
+
+
+def read_index(path):
+    """Block entries of one .idx file. A line still being written is ignored."""
+    blocks = []
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    blocks.append(json.loads(line))
+                except ValueError:
+                    break
+    except FileNotFoundError:
+        pass
+    return blocks
+
+
+def list_segments(directory):
+    """Segment names (without suffix), oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len(SEGMENT_SUFFIX)] for name in names if name.endswith(SEGMENT_SUFFIX))
+
+
+class ArchiveWriter:
+    """
+    Appends log entries to one container's archive. Entries are buffered
+    and written as a block when LOG_ARCHIVE_BLOCK_BYTES is reached or on
+    flush(). A new segment is started when the current one is larger than
+    LOG_ARCHIVE_SEGMENT_BYTES or spans more than LOG_ARCHIVE_SEGMENT_SECONDS
+    of log time, so retention can drop old output a segment at a time.
+
+    The writer owns the directory lock from open() to close(); open()
+    returns False when another writer (the archive_logs command, or a
+    request archiving a container before removal) holds it.
+    """
+
+    def __init__(self, directory, meta=None):
+        self.directory = directory
+        self.meta = meta
+        self.block_bytes = getattr(settings, 'LOG_ARCHIVE_BLOCK_BYTES', 256 * 1024)
+        self.segment_bytes = getattr(settings, 'LOG_ARCHIVE_SEGMENT_BYTES', 16 * 1024 * 1024)
+        self.segment_seconds = getattr(settings, 'LOG_ARCHIVE_SEGMENT_SECONDS', 86400)
+        self.segment = None
+        self.segment_started = None
+        self.last_point = None
+        self.at_last = 0
+        self.lines = []
+        self.size = 0
+        self.first_buffered = None
+        self._lock_file = None
+        self._mutex = threading.Lock()
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        if self.meta:
+            meta_path = os.path.join(self.directory, 'meta.json')
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(self.meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+        segments = list_segments(self.directory)
+        if segments:
+            self.segment = segments[-1]
+            self.segment_started = int(self.segment[:12])
+        for segment in reversed(segments):
+            blocks = read_index(os.path.join(self.directory, segment + INDEX_SUFFIX))
+            if blocks:
+                self.last_point = _parse_point(blocks[-1]['last'])
+                self.at_last = blocks[-1]['at_last']
+                break
+        return True
+
+    def resume_cursor(self):
+        """Log cursor continuing right after the last archived line, None for an empty archive."""
+        if self.last_point is None:
+            return None
+        return encode_cursor(self.last_point, self.at_last)
+
+    def append(self, entries):
+        with self._mutex:
+            for point, stream, stamp, message in entries:
+                line = b'%s %s %s\n' % (format_api_time(point).encode(), stream.encode(), message)
+                if self.first_buffered is None:
+                    self.first_buffered = time.monotonic()
+                self.lines.append((point, line))
+                self.size += len(line)
+                if self.size >= self.block_bytes:
+                    self._write_block()
+
+    def flush(self, max_age=0):
+        """Write buffered lines as a block, if any have been waiting at least `max_age` seconds."""
+        with self._mutex:
+            if self.lines and time.monotonic() - self.first_buffered >= max_age:
+                self._write_block()
+
+    def _start_segment(self, first_point):
+        self.segment = f"{first_point[0]:012d}{first_point[1]:09d}"
+        self.segment_started = first_point[0]
+
+    def _write_block(self):
+        lines = self.lines
+        data = b''.join(line for _, line in lines)
+        first, last = lines[0][0], lines[-1][0]
+        at_last = sum(1 for point, _ in lines if point == last)
+        if at_last == len(lines) and last == self.last_point:
+            at_last += self.at_last
+
+        segment_path = self.segment and os.path.join(self.directory, self.segment + SEGMENT_SUFFIX)
+        if (
+            self.segment is None
+            or not os.path.exists(segment_path)
+            or os.path.getsize(segment_path) >= self.segment_bytes
+            or last[0] - self.segment_started >= self.segment_seconds
+        ):
+            self._start_segment(first)
+            segment_path = os.path.join(self.directory, self.segment + SEGMENT_SUFFIX)
+
+        compressed = zlib.compressobj(6, zlib.DEFLATED, 31)
+        member = compressed.compress(data) + compressed.flush()
+        with open(segment_path, 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+        entry = {
+            'offset': offset,
+            'length': len(member),
+            'first': format_api_time(first),
+            'last': format_api_time(last),
+            'lines': len(lines),
+            'at_last': at_last,
+            'bloom': BloomFilter.for_tokens(tokenize(data)).encode(),
+        }
+        with open(os.path.join(self.directory, self.segment + INDEX_SUFFIX), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+        self.last_point = last
+        self.at_last = at_last
+        self.lines = []
+        self.size = 0
+        self.first_buffered = None
+
+    def close(self):
+        if self._lock_file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def container_meta(container):
+    return {
+        'container_id': container.container_id,
+        'name': container.name,
+        'image': container.image,
+        'host_id': str(container.host_id),
+        'created_by': container.created_by_id,
+    }
+
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def archive_container(container, client=None, timeout=None, max_bytes=None):
+    """
+    Archive what the daemon has for `container` and return, without
+    following. Used before a container is removed so its last output is
+    kept. Returns False when the archive_logs command is already following
+    the container; it will have the output once the log stream ends.
+
+    At most `max_bytes` of log are read, for at most `timeout` seconds
+    (LOG_ARCHIVE_ON_REMOVE_MAX_BYTES and LOG_ARCHIVE_ON_REMOVE_TIMEOUT by
+    default) so a removal never waits on a huge or stalled log; what was
+    read by then is kept.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'LOG_ARCHIVE_ON_REMOVE_TIMEOUT', 10)
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'LOG_ARCHIVE_ON_REMOVE_MAX_BYTES', 64 * 1024 * 1024)
+    writer = ArchiveWriter(container_directory(container.host_id, container.container_id), container_meta(container))
+    if not writer.open():
+        return False
+    try:
+        query = LogQuery(resume=writer.resume_cursor())
+        # The read timeout bounds a stalled daemon, the deadline a slow trickle.
+        stream = open_log_stream(client or get_client(container.host), container.container_id, query,
+                                 LogBatchStream, timeout=timeout)
+        deadline = time.monotonic() + timeout
+        read = 0
+        try:
+            for entries in stream:
+                writer.append(entries)
+                read += sum(len(entry[3]) for entry in entries)
+                if read >= max_bytes or time.monotonic() >= deadline:
+                    logger.warning("Archived only %d bytes of %s's log before removal", read, container.container_id[:12])
+                    break
+        finally:
+            stream.close()
+    finally:
+        writer.close()
+    return True
+
+
+class ContainerArchiver(threading.Thread):
+    """Follows one container's log into its archive until the log ends or stop() is called."""
+
+    def __init__(self, container):
+        super().__init__(name=f"archive-{container.container_id[:12]}", daemon=True)
+        self.container = container
+        self.writer = ArchiveWriter(container_directory(container.host_id, container.container_id), container_meta(container))
+        self.stream = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        container = self.container
+        if not self.writer.open():
+            logger.info("Archive of %s is locked by another writer", container.container_id[:12])
+            return
+        try:
+            query = LogQuery(follow=True, resume=self.writer.resume_cursor())
+            self.stream = open_log_stream(get_client(container.host), container.container_id, query, LogBatchStream)
+            if self._stopped.is_set():
+                return
+            for entries in self.stream:
+                self.writer.append(entries)
+        except Exception as e:
+            if not self._stopped.is_set():
+                logger.warning("Archiving logs of %s stopped: %s", container.container_id[:12], e)
+        finally:
+            if self.stream is not None:
+                self.stream.close()
+            self.writer.close()
+
+    def flush(self, max_age):
+        self.writer.flush(max_age)
+
+    def stop(self):
+        self._stopped.set()
+        if self.stream is not None:
+            self.stream.close()
+
+
+class LogArchiver:
+    """
+    Keeps one ContainerArchiver running per running container (optionally
+    only those matching a label selector), flushes partial blocks every
+    LOG_ARCHIVE_FLUSH_INTERVAL seconds so recent output is searchable,
+    and applies retention.
+    """
+
+    def __init__(self, refresh_interval=30, host_ids=None, selector=None):
+        self.refresh_interval = refresh_interval
+        self.host_ids = host_ids
+        self.selector = selector
+        self.flush_interval = getattr(settings, 'LOG_ARCHIVE_FLUSH_INTERVAL', 5)
+        self.retention_interval = getattr(settings, 'LOG_ARCHIVE_RETENTION_INTERVAL', 300)
+        self.archivers = {}
+        self._stopped = threading.Event()
+
+    def refresh(self):
+        containers = ContainerRecord.objects.select_related('host').filter(is_active=True, status='running')
+        if self.host_ids:
+            containers = containers.filter(host_id__in=self.host_ids)
+        if self.selector:
+            containers = filter_by_labels(containers, self.selector)
+        current = {container.container_id: container for container in containers}
+        close_old_connections()
+
+        for container_id in list(self.archivers):
+            archiver = self.archivers[container_id]
+            if container_id not in current and archiver.is_alive():
+                archiver.stop()
+            if not archiver.is_alive():
+                del self.archivers[container_id]
+        for container_id, container in current.items():
+            if container_id not in self.archivers:
+                archiver = ContainerArchiver(container)
+                archiver.start()
+                self.archivers[container_id] = archiver
+
+    def flush(self):
+        for archiver in list(self.archivers.values()):
+            archiver.flush(self.flush_interval)
+
+    def run_forever(self):
+        next_refresh = next_retention = 0
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            if now >= next_refresh:
+                self.refresh()
+                next_refresh = now + self.refresh_interval
+            if now >= next_retention:
+                removed = enforce_retention()
+                if removed:
+                    logger.info("Log archive retention removed %d segments", removed)
+                next_retention = now + self.retention_interval
+            self.flush()
+            self._stopped.wait(self.flush_interval)
+
+    def stop(self):
+        self._stopped.set()
+        for archiver in self.archivers.values():
+            archiver.stop()
+        for archiver in self.archivers.values():
+            archiver.join(timeout=5)
+
+
+def _remove_segment(directory, segment):
+    for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+        try:
+            os.remove(os.path.join(directory, segment + suffix))
+        except FileNotFoundError:
+            pass
+
+
+def _is_locked(directory):
+    try:
+        with open(os.path.join(directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+    except BlockingIOError:
+        return True
+
+
+def enforce_retention(root=None, max_age=None, max_bytes=None):
+    """
+    Delete segments last written more than LOG_ARCHIVE_MAX_AGE seconds
+    ago, then the oldest segments across all containers until the archive
+    fits in LOG_ARCHIVE_MAX_BYTES. The segment a running archiver is
+    appending to is only removed by age. Directories left without segments
+    whose writer is gone are removed too. Returns the number of segments
+    deleted.
+    """
+    root = root or archive_root()
+    max_age = max_age if max_age is not None else getattr(settings, 'LOG_ARCHIVE_MAX_AGE', 30 * 86400)
+    max_bytes = max_bytes if max_bytes is not None else getattr(settings, 'LOG_ARCHIVE_MAX_BYTES', 10 * 1024 ** 3)
+    if not root or not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - max_age
+    removed = 0
+    total = 0
+    evictable = []
+    for host_id in os.listdir(root):
+        host_directory = os.path.join(root, host_id)
+        if not os.path.isdir(host_directory):
+            continue
+        for container_id in os.listdir(host_directory):
+            directory = os.path.join(host_directory, container_id)
+            live = []
+            for name in list_segments(directory):
+                try:
+                    stat = os.stat(os.path.join(directory, name + SEGMENT_SUFFIX))
+                    size = stat.st_size + os.path.getsize(os.path.join(directory, name + INDEX_SUFFIX))
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < cutoff:
+                    _remove_segment(directory, name)
+                    removed += 1
+                else:
+                    live.append((stat.st_mtime, directory, name, size))
+                    total += size
+            locked = _is_locked(directory)
+            if not live and not locked:
+                shutil.rmtree(directory, ignore_errors=True)
+            # Never size-evict the segment a writer is appending to.
+            evictable.extend(live[:-1] if locked else live)
+
+    evictable.sort()
+    for _, directory, name, size in evictable:
+        if total <= max_bytes:
+            break
+        _remove_segment(directory, name)
+        total -= size
+        removed += 1
+    return removed
+
+
+def search_archive(directory, terms, start=None, end=None, streams=None, cursor=None, limit=1000):
+    """
+    Archived lines containing every word in `terms`, oldest first, between
+    `start` and `end` ((seconds, nanoseconds) tuples or None).
+
+    `cursor` is (point, skip) from a previous page: matches before `point`,
+    and the first `skip` matches at it, were already returned. Returns
+    (matches, next cursor or None, stats) where matches are (point, stream,
+    message) tuples and stats counts the blocks read out of those indexed.
+    """
+    query_words = set()
+    for term in terms:
+        query_words |= tokenize(term.encode())
+    if cursor:
+        start = cursor[0] if start is None or cursor[0] > start else start
+        skip_point, skip = cursor
+    else:
+        skip_point, skip = None, 0
+
+    matches = []
+    scanned = indexed = 0
+    for segment in list_segments(directory):
+        blocks = read_index(os.path.join(directory, segment + INDEX_SUFFIX))
+        indexed += len(blocks)
+        candidates = []
+        for block in blocks:
+            if start and _parse_point(block['last']) < start:
+                continue
+            if end and _parse_point(block['first']) > end:
+                continue
+            if query_words:
+                bloom = BloomFilter.decode(block['bloom'])
+                if not all(bloom.might_contain(word) for word in query_words):
+                    continue
+            candidates.append(block)
+        if not candidates:
+            continue
+        try:
+            f = open(os.path.join(directory, segment + SEGMENT_SUFFIX), 'rb')
+        except FileNotFoundError:
+            continue
+        with f:
+            for block in candidates:
+                f.seek(block['offset'])
+                data = zlib.decompress(f.read(block['length']), 31)
+                scanned += 1
+                for line in data.split(b'\n'):
+                    if not line:
+                        continue
+                    stamp, stream, message = line.split(b' ', 2)
+                    point = _parse_point(stamp.decode())
+                    if (start and point < start) or (end and point > end):
+                        continue
+                    stream = stream.decode()
+                    if streams and stream not in streams:
+                        continue
+                    if query_words and not query_words <= tokenize(message):
+                        continue
+                    if skip and point == skip_point:
+                        skip -= 1
+                        continue
+                    matches.append((point, stream, message))
+                    if len(matches) > limit:
+                        break
+                if len(matches) > limit:
+                    break
+        if len(matches) > limit:
+            break
+
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        last = matches[-1][0]
+        at_last = sum(1 for point, _, _ in matches if point == last)
+        if last == skip_point:
+            at_last += cursor[1]
+        next_cursor = encode_cursor(last, at_last)
+    return matches, next_cursor, {'blocks_read': scanned, 'blocks_indexed': indexed}
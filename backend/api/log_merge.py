@@ -0,0 +1,226 @@
+import asyncio
+import heapq
+import json
+from collections import deque
+
+from django.conf import settings
+
+from .docker_clients import get_client
+from .logs import LogBatchStream, open_log_stream
+from .streams import DockerStreamReader
+
+
+_END = object()
+
+
+def parse_label_selector(selector):
+    """
+    "app=web,tier" -> [('app', 'web'), ('tier', None)]: every label must
+    match, a bare key only has to be present.
+    """
+    terms = []
+    for term in selector.split(','):
+        term = term.strip()
+        if not term:
+            continue
+        key, sep, value = term.partition('=')
+        key = key.strip()
+        if not key or '__' in key:
+            raise ValueError(f"Invalid label selector term: {term}")
+        terms.append((key, value.strip() if sep else None))
+    if not terms:
+        raise ValueError("Empty label selector.")
+    return terms
+
+
+def filter_by_labels(queryset, selector):
+    for key, value in parse_label_selector(selector):
+        if value is None:
+            queryset = queryset.filter(labels__has_key=key)
+        else:
+            queryset = queryset.filter(**{f'labels__{key}': value})
+    return queryset
+
+
+def describe_entry(entry, timestamps):
+    """JSON-ready dict for a log entry; merged entries are labelled with their container and host."""
+    point, stream, stamp, message = entry[:4]
+    line = {'stream': stream, 'message': message.decode('utf-8', errors='replace')}
+    if timestamps and stamp:
+        line['timestamp'] = stamp.decode()
+    if len(entry) > 4:
+        record = entry[4]
+        line['container_id'] = record.container_id[:12]
+        line['container'] = record.name
+        line['host'] = record.host.host_name
+    return line
+
+
+class _Source:
+    __slots__ = ('index', 'record', 'reader', 'pending', 'task', 'done', 'idle')
+
+    def __init__(self, index, record):
+        self.index = index
+        self.record = record
+        self.reader = None
+        self.pending = deque()
+        self.task = None
+        self.done = False
+        self.idle = False
+
+
+class LogMerger:
+    """
+    Reads the logs of several containers (on any hosts) at once and yields
+    their lines as one stream ordered by Docker timestamp.
+
+    Items are lists of (point, stream, stamp, message, record) entries.
+    A container whose log cannot be read yields a single entry with
+    point None and stream 'error'.
+
+    Each container is read through its own DockerStreamReader with a
+    small queue, and at most one batch per container is held for the
+    merge. Memory therefore grows with the number of containers, not with
+    log volume. When following, a container that has produced nothing for
+    `max_delay` seconds stops holding the others back. Its next lines are
+    merged as soon as they arrive, even if other lines with later
+    timestamps have already been sent. Without follow the merge waits for
+    every container and the order is exact.
+    """
+
+    def __init__(self, records, query, max_delay=None, buffer_size=None):
+        self.query = query
+        self.max_delay = max_delay or getattr(settings, 'LOG_MERGE_MAX_DELAY', 0.5)
+        self.buffer_size = buffer_size or getattr(settings, 'LOG_MERGE_BUFFER_BATCHES', 4)
+        self.sources = [_Source(index, record) for index, record in enumerate(records)]
+        self._queue = asyncio.Queue(maxsize=2)
+        self._task = None
+
+    def _open(self, record):
+        def open_stream():
+            return open_log_stream(get_client(record.host), record.container_id, self.query, LogBatchStream)
+        return open_stream
+
+    def _absorb(self, errors):
+        for source in self.sources:
+            task = source.task
+            if task is None or not task.done():
+                continue
+            source.task = None
+            try:
+                batch = task.result()
+            except StopAsyncIteration:
+                source.done = True
+                continue
+            except Exception as e:
+                source.done = True
+                errors.append((None, 'error', b'', str(e).encode(), source.record))
+                continue
+            source.pending.extend(batch)
+            source.idle = False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        sources = self.sources
+        deadline = None
+        try:
+            for source in sources:
+                source.reader = DockerStreamReader(self._open(source.record), self.buffer_size).start()
+
+            while True:
+                for source in sources:
+                    if not source.pending and not source.done and source.task is None:
+                        source.task = asyncio.ensure_future(source.reader.__anext__())
+
+                tasks = {source.task for source in sources if source.task is not None}
+                held = any(source.pending for source in sources)
+                blocking = [s for s in sources if not s.pending and not s.done and not s.idle]
+                if not held and not tasks:
+                    break
+
+                if blocking or not held:
+                    timeout = None
+                    if not held:
+                        deadline = None
+                    if held and self.query.follow:
+                        if deadline is None:
+                            deadline = loop.time() + self.max_delay
+                        timeout = max(deadline - loop.time(), 0)
+                    await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    errors = []
+                    self._absorb(errors)
+                    if errors:
+                        await self._queue.put(errors)
+                    if deadline is not None and loop.time() >= deadline:
+                        # Stop waiting for containers that are quiet right now.
+                        for source in sources:
+                            if not source.pending and not source.done:
+                                source.idle = True
+                        deadline = None
+                    continue
+
+                deadline = None
+                merged = []
+                heap = [(source.pending[0][0], source.index) for source in sources if source.pending]
+                heapq.heapify(heap)
+                while heap:
+                    _, index = heapq.heappop(heap)
+                    source = sources[index]
+                    merged.append(source.pending.popleft() + (source.record,))
+                    if source.pending:
+                        heapq.heappush(heap, (source.pending[0][0], index))
+                    elif not source.done and not source.idle:
+                        # Its next line may sort before the remaining heads.
+                        break
+                await self._queue.put(merged)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(e)
+        finally:
+            for source in sources:
+                if source.task is not None:
+                    source.task.cancel()
+                if source.reader is not None:
+                    source.reader.close()
+        await self._queue.put(_END)
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        item = await self._queue.get()
+        if item is _END:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+async def merged_ndjson(records, query):
+    """NDJSON body for the merged logs endpoint, in the same shape as api.logs.LogStream."""
+    count = 0
+    async with LogMerger(records, query) as merged:
+        async for entries in merged:
+            chunk = []
+            for entry in entries:
+                record = describe_entry(entry, query.timestamps)
+                record['type'] = 'log' if entry[0] is not None else 'error'
+                count += entry[0] is not None
+                chunk.append(json.dumps(record).encode() + b'\n')
+            yield b''.join(chunk)
+    yield json.dumps({'type': 'end', 'count': count, 'cursor': None}).encode() + b'\n'
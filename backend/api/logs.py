@@ -0,0 +1,396 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+
+from django.conf import settings
+from docker.types.daemon import CancellableStream
+from django.utils.dateparse import parse_datetime
+
+from .docker_clients import registry
+
+
+STREAM_NAMES = {0: 'stdin', 1: 'stdout', 2: 'stderr'}
+
+
+def _truthy(value, default):
+    if value is None:
+        return default
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def parse_timestamp(value):
+    """
+    Docker log timestamp ("2024-05-01T10:00:00.123456789Z") as an
+    (epoch seconds, nanoseconds) tuple, which keeps full precision and
+    compares correctly.
+    """
+    value = value.rstrip('Z')
+    base, _, fraction = value.partition('.')
+    seconds = int(datetime.fromisoformat(base).replace(tzinfo=timezone.utc).timestamp())
+    return seconds, int(fraction[:9].ljust(9, '0')) if fraction else 0
+
+
+def format_api_time(point):
+    """(seconds, nanoseconds) in the `seconds.nanoseconds` form the daemon accepts for since/until."""
+    return f"{point[0]}.{point[1]:09d}"
+
+
+def parse_query_time(value):
+    """since/until from a request: epoch seconds or ISO 8601."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid time: {value}")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        seconds = parsed.timestamp()
+    whole = int(seconds)
+    return whole, int(round((seconds - whole) * 1e9))
+
+
+def encode_cursor(until, skip):
+    payload = json.dumps({'u': format_api_time(until), 's': skip}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        seconds, _, nanos = payload['u'].partition('.')
+        return (int(seconds), int(nanos or 0)), int(payload['s'])
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor.")
+
+
+class LogQuery:
+    """
+    What to read from a container's log.
+
+    `cursor` pages backwards: it points at the oldest line already returned
+    (its exact timestamp, and how many lines at that timestamp were
+    returned), so the next page is the `tail` lines before it.
+
+    The daemon applies `tail` to the whole log before `until`, so `tail`
+    with `until` cannot be sent as is. find_page_window picks a `since`
+    for which the window up to `until` holds at least `tail` lines, and
+    the `drop` oldest lines of that window are left out.
+    """
+
+    def __init__(self, tail=None, since=None, until=None, timestamps=False, stdout=True, stderr=True,
+                 cursor=None, follow=False, resume=None):
+        self.tail = tail
+        self.since = since
+        self.until = until
+        self.timestamps = timestamps
+        self.stdout = stdout
+        self.stderr = stderr
+        self.follow = follow
+        self.skip = 0
+        self.resume_skip = 0
+        self.windowed = False
+        self.window_since = None
+        self.drop = 0
+        if cursor:
+            self.until, self.skip = decode_cursor(cursor)
+        if resume:
+            # Same encoding as `cursor`, read forwards: continue after the
+            # last line a follower was sent.
+            self.since, self.resume_skip = decode_cursor(resume)
+            self.tail = None
+
+    @classmethod
+    def from_params(cls, params, follow=False):
+        """
+        Build a query from request parameters. With `follow`, `cursor` is a
+        resume cursor from the log socket rather than a backwards page cursor.
+        """
+        tail = params.get('tail')
+        since = params.get('since')
+        if tail in (None, ''):
+            # Without a bound, reading the whole history is what we are trying to avoid.
+            if since:
+                tail = None
+            elif follow:
+                tail = getattr(settings, 'LOG_STREAM_DEFAULT_TAIL', 100)
+            else:
+                tail = getattr(settings, 'CONTAINER_LOGS_DEFAULT_TAIL', 1000)
+        elif tail == 'all':
+            tail = None
+        else:
+            try:
+                tail = int(tail)
+            except ValueError:
+                tail = -1
+            if tail < 0:
+                raise ValueError("'tail' must be a positive number or 'all'.")
+        until = params.get('until')
+        query = cls(
+            tail=tail,
+            since=parse_query_time(since) if since else None,
+            until=parse_query_time(until) if until else None,
+            timestamps=_truthy(params.get('timestamps'), False),
+            stdout=_truthy(params.get('stdout'), True),
+            stderr=_truthy(params.get('stderr'), True),
+            cursor=None if follow else params.get('cursor'),
+            follow=follow,
+            resume=params.get('cursor') if follow else None,
+        )
+        if not (query.stdout or query.stderr):
+            raise ValueError("At least one of 'stdout' and 'stderr' must be selected.")
+        return query
+
+    def pages_back(self):
+        """Whether the last `tail` lines before `until` have to be found with find_page_window."""
+        return self.tail is not None and self.until is not None and not self.follow
+
+    def api_params(self, since=None):
+        params = {
+            'stdout': int(self.stdout),
+            'stderr': int(self.stderr),
+            # Always fetch timestamps: they are what the cursor is made of.
+            'timestamps': 1,
+            'tail': 'all' if self.tail is None or self.windowed else self.tail + self.skip,
+            'follow': int(self.follow),
+        }
+        since = since or (self.window_since if self.windowed else self.since)
+        if since:
+            params['since'] = format_api_time(since)
+        if self.until:
+            params['until'] = format_api_time(self.until)
+        return params
+
+
+class LineSplitter:
+    """
+    Splits the raw log body into (stream name, line) pairs as chunks
+    arrive, demultiplexing non-TTY frames and carrying partial frames and
+    lines over to the next chunk.
+    """
+
+    def __init__(self, tty):
+        self.tty = tty
+        self.buffer = bytearray()
+        self.pending = {}
+
+    def _frames(self, chunk):
+        if self.tty:
+            yield 'stdout', chunk
+            return
+        buffer = self.buffer
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= 8:
+            size = int.from_bytes(buffer[offset + 4:offset + 8], 'big')
+            end = offset + 8 + size
+            if end > len(buffer):
+                break
+            yield STREAM_NAMES.get(buffer[offset], 'stdout'), bytes(buffer[offset + 8:end])
+            offset = end
+        del buffer[:offset]
+
+    def feed(self, chunk):
+        lines = []
+        for stream, data in self._frames(chunk):
+            if stream in self.pending:
+                data = self.pending.pop(stream) + data
+            *complete, rest = data.split(b'\n')
+            if rest:
+                self.pending[stream] = rest
+            lines.extend((stream, line) for line in complete)
+        return lines
+
+    def flush(self):
+        lines = list(self.pending.items())
+        self.pending = {}
+        return lines
+
+
+def iter_log_lines(chunks, tty):
+    """(stream name, line) for every complete line, plus any unterminated tail at EOF."""
+    splitter = LineSplitter(tty)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.flush()
+
+
+def parse_entry(stream, raw):
+    """(point, stream, stamp, message) for a timestamped line, None if it has no timestamp."""
+    stamp, _, message = raw.rstrip(b'\r').partition(b' ')
+    try:
+        return parse_timestamp(stamp.decode()), stream, stamp, message
+    except ValueError:
+        return None
+
+
+class LogStream:
+    """
+    NDJSON body for a log query, produced while reading the daemon's
+    response so memory stays constant whatever the log size.
+
+    One `{"type": "log", ...}` object per line, oldest first, then a final
+    `{"type": "end", "count": n, "cursor": ...}`. `cursor` is null when
+    there is nothing older to page to.
+    """
+
+    def __init__(self, response, tty, query, batch_bytes=None, release=None):
+        self.response = response
+        self.tty = tty
+        self.query = query
+        self.release = release or (lambda: None)
+        self.batch_bytes = batch_bytes or getattr(settings, 'CONTAINER_LOGS_BATCH_BYTES', 32 * 1024)
+
+    def _lines(self):
+        query = self.query
+        held = []
+        drop = query.drop
+        for stream, raw in iter_log_lines(self.response.iter_content(chunk_size=64 * 1024), self.tty):
+            entry = parse_entry(stream, raw)
+            if entry is None:
+                continue
+            if drop:
+                # Older than the page, see find_page_window.
+                drop -= 1
+                continue
+            if query.skip and entry[0] == query.until:
+                # The last `skip` lines at the cursor's timestamp were on the previous page.
+                held.append(entry)
+                continue
+            yield from held
+            held = []
+            yield entry
+        yield from held[:max(len(held) - query.skip, 0)]
+
+    def __iter__(self):
+        query = self.query
+        count = 0
+        oldest = None
+        at_oldest = 0
+        batch = []
+        size = 0
+        for point, stream, stamp, message in self._lines():
+            if oldest is None:
+                oldest = point
+            if point == oldest:
+                at_oldest += 1
+            record = {'type': 'log', 'stream': stream, 'message': message.decode('utf-8', errors='replace')}
+            if query.timestamps:
+                record['timestamp'] = stamp.decode()
+            line = json.dumps(record).encode() + b'\n'
+            batch.append(line)
+            size += len(line)
+            count += 1
+            if size >= self.batch_bytes:
+                yield b''.join(batch)
+                batch = []
+                size = 0
+
+        cursor = None
+        if query.tail and count >= query.tail and oldest is not None:
+            skip = at_oldest + (query.skip if oldest == query.until else 0)
+            cursor = encode_cursor(oldest, skip)
+        batch.append(json.dumps({'type': 'end', 'count': count, 'cursor': cursor}).encode() + b'\n')
+        yield b''.join(batch)
+
+    def close(self):
+        try:
+            # Shutting the socket down also wakes a thread blocked reading a followed log.
+            CancellableStream(None, self.response).close()
+        except Exception:
+            self.response.close()
+        finally:
+            self.release()
+
+
+class LogBatchStream(LogStream):
+    """
+    Lists of (point, stream, stamp, message) entries, one list per read
+    from the daemon, for followers that frame lines themselves (the log
+    socket). Lines already delivered before a `resume` cursor are skipped.
+    """
+
+    def __iter__(self):
+        query = self.query
+        skip = query.resume_skip
+        splitter = LineSplitter(self.tty)
+        for chunk in self.response.iter_content(chunk_size=64 * 1024):
+            entries = []
+            for stream, raw in splitter.feed(chunk):
+                entry = parse_entry(stream, raw)
+                if entry is None:
+                    continue
+                if skip:
+                    if entry[0] == query.since:
+                        skip -= 1
+                        continue
+                    skip = 0
+                entries.append(entry)
+            if entries:
+                yield entries
+
+
+def _count_lines(client, url, tty, query, since, **kwargs):
+    """Lines the daemon has for `query` from `since` on, without the `skip` ones at `until`."""
+    response = client.api._get(url, params={**query.api_params(since), 'tail': 'all'}, stream=True, **kwargs)
+    client.api._raise_for_status(response)
+    total = at_until = 0
+    try:
+        for stream, raw in iter_log_lines(response.iter_content(chunk_size=64 * 1024), tty):
+            entry = parse_entry(stream, raw)
+            if entry is None:
+                continue
+            total += 1
+            at_until = at_until + 1 if entry[0] == query.until else 0
+    finally:
+        response.close()
+    return total - min(query.skip, at_until)
+
+
+def find_page_window(client, url, tty, query, start=None, **kwargs):
+    """
+    Set `query.window_since` and `query.drop` so that reading from
+    `window_since` to `until` and dropping the `drop` oldest lines gives
+    the last `tail` lines before `until`. The window starts at
+    CONTAINER_LOGS_PAGE_WINDOW seconds and doubles until it holds `tail`
+    lines or reaches `query.since` or `start` (when the container was
+    created). Lines are only counted, never kept.
+    """
+    floor = max(point for point in (query.since, start, (0, 0)) if point is not None)
+    width = getattr(settings, 'CONTAINER_LOGS_PAGE_WINDOW', 60)
+    while True:
+        since = (query.until[0] - width, query.until[1])
+        if since <= floor:
+            since = query.since
+        count = _count_lines(client, url, tty, query, since, **kwargs)
+        if count >= query.tail or since == query.since:
+            break
+        width *= 2
+    query.windowed = True
+    query.window_since = since
+    query.drop = max(count - query.tail, 0)
+
+
+def open_log_stream(client, container_id, query, stream_class=LogStream, timeout=None):
+    """
+    Start reading a container's log for `query` and return a LogStream.
+    The daemon request is made here, so a missing container or bad
+    parameters raise before any of the body is sent. `timeout` overrides
+    the client's timeout for each read of the body.
+
+    This goes through docker-py's low-level request helpers instead of
+    `logs()`: `logs()` only accepts `until` as a float, which drops the
+    nanoseconds the cursor relies on, and reads TTY output one byte at a time.
+    """
+    info = client.api.inspect_container(container_id)
+    tty = info['Config']['Tty']
+    url = client.api._url('/containers/{0}/logs', container_id)
+    kwargs = {'timeout': timeout} if timeout is not None else {}
+    if query.pages_back():
+        created = info.get('Created')
+        find_page_window(client, url, tty, query, parse_timestamp(created) if created else None, **kwargs)
+    response = client.api._get(url, params=query.api_params(), stream=True, **kwargs)
+    client.api._raise_for_status(response)
+    # A followed log can outlive the client's idle timeout.
+    return stream_class(response, tty, query, release=registry.hold(client))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.log_archive import LogArchiver
+
+
+class Command(BaseCommand):
+    help = "Follow the logs of running containers into the compressed, searchable archive under LOG_ARCHIVE_DIR."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh-interval', type=int, default=30, help="Seconds between checks for started or stopped containers.")
+        parser.add_argument('--host', action='append', dest='hosts', help="Only archive containers of this host id (repeatable).")
+        parser.add_argument('--selector', help="Only archive containers whose labels match, e.g. \"app=web,tier\".")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'LOG_ARCHIVE_DIR', None):
+            raise CommandError("LOG_ARCHIVE_DIR is not set.")
+        archiver = LogArchiver(refresh_interval=options['refresh_interval'], host_ids=options['hosts'], selector=options['selector'])
+        self.stdout.write(f"Archiving container logs to {settings.LOG_ARCHIVE_DIR}")
+        try:
+            archiver.run_forever()
+        except KeyboardInterrupt:
+            archiver.stop()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.health import HealthMonitor
+from api.models import DockerHost
+
+
+class Command(BaseCommand):
+    help = "Ping every Docker host on a schedule and keep its status, versions and capacity up to date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, help="Seconds between sweeps (default: HEALTH_INTERVAL).")
+        parser.add_argument('--concurrency', type=int, help="Hosts probed in parallel (default: HEALTH_CONCURRENCY).")
+        parser.add_argument('--once', action='store_true', help="Run a single sweep and exit.")
+        parser.add_argument('--host', action='append', dest='hosts', help="Only probe this host id (repeatable).")
+
+    def handle(self, *args, **options):
+        monitor = HealthMonitor(interval=options['interval'], concurrency=options['concurrency'])
+
+        if options['once'] or options['hosts']:
+            hosts = DockerHost.objects.all()
+            if options['hosts']:
+                hosts = hosts.filter(id__in=options['hosts'])
+            self.stdout.write(str(monitor.sweep(list(hosts))))
+            return
+
+        self.stdout.write(f"Sweeping every {monitor.interval}s with concurrency {monitor.concurrency}")
+        try:
+            monitor.run_forever()
+        except KeyboardInterrupt:
+            monitor.stop()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.stats_history import StatsRecorder
+
+
+class Command(BaseCommand):
+    help = "Sample every running container's stats on a schedule and keep the rolled-up history in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, help="Seconds between sweeps (default: STATS_RECORD_INTERVAL).")
+        parser.add_argument('--concurrency', type=int, help="Stats calls in parallel (default: STATS_RECORD_CONCURRENCY).")
+        parser.add_argument('--once', action='store_true', help="Run a single sweep and exit.")
+        parser.add_argument('--host', action='append', dest='hosts', help="Only sample containers of this host id (repeatable).")
+
+    def handle(self, *args, **options):
+        recorder = StatsRecorder(interval=options['interval'], concurrency=options['concurrency'], host_ids=options['hosts'])
+
+        if options['once']:
+            self.stdout.write(str(recorder.sweep()))
+            return
+
+        self.stdout.write(f"Sampling every {recorder.interval}s with concurrency {recorder.concurrency}")
+        try:
+            recorder.run_forever()
+        except KeyboardInterrupt:
+            recorder.stop()
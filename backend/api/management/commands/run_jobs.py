@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (requests made with async=true). Several workers may run at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help="Jobs run at once by this worker (default JOBS_CONCURRENCY).")
+        parser.add_argument('--per-host', type=int, help="Jobs running at once per Docker host, over all workers (default JOBS_PER_HOST).")
+        parser.add_argument('--kind', action='append', dest='kinds', help="Only run jobs of this kind (repeatable).")
+
+    def handle(self, *args, **options):
+        worker = JobWorker(concurrency=options['concurrency'], per_host=options['per_host'], kinds=options['kinds'])
+        self.stdout.write(f"Running background jobs as {worker.worker_id}")
+        try:
+            worker.run_forever()
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,90 @@
+import json
+import random
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from api.placement import HostIndex, HostState, PlacementRequest
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a placement trace against a HostIndex and report decision latency and how evenly "
+        "the load was spread. Nothing is created; by default the fleet and the trace are synthetic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hosts', type=int, default=2000, help="Hosts in the synthetic fleet.")
+        parser.add_argument('--placements', type=int, default=20000, help="Requests generated when no --trace is given.")
+        parser.add_argument('--trace', help="JSON lines file of requests ({\"cpus\", \"memory_mb\", \"constraints\", \"ports\"}).")
+        parser.add_argument('--from-db', action='store_true', help="Place against the real fleet instead of a synthetic one.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        index = HostIndex()
+        if options['from_db']:
+            index.refresh(force=True)
+        else:
+            index.load(self.fleet(rng, options['hosts']))
+        if options['trace']:
+            with open(options['trace']) as f:
+                requests = [self.request(json.loads(line)) for line in f if line.strip()]
+        else:
+            requests = [self.random_request(rng) for _ in range(options['placements'])]
+
+        latencies = []
+        failed = 0
+        for request in requests:
+            started = time.perf_counter()
+            state = index.place(request)
+            latencies.append(time.perf_counter() - started)
+            failed += state is None
+
+        latencies.sort()
+        used = [1 - state.headroom() for state in index.states()]
+        self.stdout.write(f"hosts: {len(index)}, requests: {len(requests)}, placed: {len(requests) - failed}, failed: {failed}")
+        self.stdout.write(
+            "latency (us): p50 %.1f, p99 %.1f, max %.1f" % tuple(
+                latencies[int(q * (len(latencies) - 1))] * 1e6 for q in (0.5, 0.99, 1)
+            )
+        )
+        if used:
+            self.stdout.write(
+                "host load (max of CPU/memory used): min %.2f, mean %.2f, max %.2f, stdev %.3f"
+                % (min(used), statistics.mean(used), max(used), statistics.pstdev(used))
+            )
+
+    def fleet(self, rng, count):
+        zones = ['eu', 'us', 'ap']
+        states = []
+        for _ in range(count):
+            cores = rng.choice([4, 8, 16, 32, 64])
+            labels = {'zone': rng.choice(zones)}
+            if rng.random() < 0.05:
+                labels['gpu'] = None
+            states.append(HostState(
+                uuid.uuid4(), None, None, labels, cores, cores * 4096,
+                cpu_used=cores * rng.uniform(0, 0.5), memory_used=cores * 4096 * rng.uniform(0, 0.5),
+            ))
+        return states
+
+    def random_request(self, rng):
+        constraints = []
+        if rng.random() < 0.3:
+            constraints.append(f"zone={rng.choice(['eu', 'us', 'ap'])}")
+        if rng.random() < 0.02:
+            constraints.append('gpu')
+        ports = [rng.randint(8000, 8999)] if rng.random() < 0.2 else []
+        return PlacementRequest(
+            cpus=rng.choice([0.25, 0.5, 1, 2]), memory_mb=rng.choice([128, 256, 512, 1024, 2048]),
+            constraints=constraints, ports=ports,
+        )
+
+    def request(self, entry):
+        return PlacementRequest(
+            cpus=entry.get('cpus'), memory_mb=entry.get('memory_mb'),
+            constraints=entry.get('constraints'), ports=entry.get('ports', ()),
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.models import DockerHost
+from api.sync import InventorySyncWorker
+
+
+class Command(BaseCommand):
+    help = "Mirror containers, networks, volumes and images from every Docker host into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, help="Seconds between sync passes (default: INVENTORY_SYNC_INTERVAL).")
+        parser.add_argument('--concurrency', type=int, help="Hosts synced in parallel (default: INVENTORY_SYNC_CONCURRENCY).")
+        parser.add_argument('--once', action='store_true', help="Run a single pass and exit.")
+        parser.add_argument('--host', action='append', dest='hosts', help="Only sync this host id (repeatable).")
+
+    def handle(self, *args, **options):
+        worker = InventorySyncWorker(interval=options['interval'], concurrency=options['concurrency'])
+
+        if options['once'] or options['hosts']:
+            hosts = DockerHost.objects.all()
+            if options['hosts']:
+                hosts = hosts.filter(id__in=options['hosts'])
+            for host_id, result in worker.run_once(list(hosts)).items():
+                self.stdout.write(f"{host_id}: {result}")
+            return
+
+        self.stdout.write(f"Syncing every {worker.interval}s with concurrency {worker.concurrency}")
+        try:
+            worker.run_forever()
+        except KeyboardInterrupt:
+            worker.stop()
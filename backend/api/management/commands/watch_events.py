@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.events import EventWatcher
+
+
+class Command(BaseCommand):
+    help = "Follow the Docker events stream of every host and apply changes to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh-interval', type=int, default=60, help="Seconds between checks for added or removed hosts.")
+        parser.add_argument('--host', action='append', dest='hosts', help="Only watch this host id (repeatable).")
+
+    def handle(self, *args, **options):
+        watcher = EventWatcher(refresh_interval=options['refresh_interval'], host_ids=options['hosts'])
+        self.stdout.write("Watching Docker events")
+        try:
+            watcher.run_forever()
+        except KeyboardInterrupt:
+            watcher.stop()
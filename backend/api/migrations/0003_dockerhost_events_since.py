@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dockerhost',
+            name='events_since',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_dockerhost_events_since'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='containerrecord',
+            name='labels',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_containerrecord_labels'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='containerrecord',
+            index=models.Index(fields=['host', 'created_at', 'id'], name='container_host_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='containerrecord',
+            index=models.Index(fields=['host', 'name', 'id'], name='container_host_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='containerrecord',
+            index=models.Index(fields=['host', 'status'], name='container_host_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dockerhost',
+            index=models.Index(fields=['created_at', 'id'], name='host_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['host', 'created_at', 'id'], name='image_host_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['host', 'name', 'id'], name='image_host_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='network',
+            index=models.Index(fields=['host', 'created_at', 'id'], name='network_host_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='network',
+            index=models.Index(fields=['host', 'name', 'id'], name='network_host_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='volume',
+            index=models.Index(fields=['host', 'created_at', 'id'], name='volume_host_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='volume',
+            index=models.Index(fields=['host', 'name', 'id'], name='volume_host_name_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dockerhost',
+            name='circuit_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dockerhost',
+            name='circuit_opened_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dockerhost',
+            name='circuit_state',
+            field=models.CharField(default='closed', max_length=20),
+        ),
+    ]
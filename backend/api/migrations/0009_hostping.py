@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_host_circuit_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostPing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ok', models.BooleanField()),
+                ('latency_ms', models.FloatField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pings', to='api.dockerhost')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['host', '-checked_at'], name='hostping_host_checked_idx'), models.Index(fields=['checked_at'], name='hostping_checked_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_hostping'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='containerrecord',
+            name='cpu_request',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='containerrecord',
+            name='memory_request_mb',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_container_resource_requests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dockerhost',
+            name='inventory_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:43
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_host_inventory_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('exec_id', models.CharField(max_length=64, unique=True)),
+                ('command', models.CharField(default='/bin/sh', max_length=255)),
+                ('status', models.CharField(choices=[('created', 'Created'), ('attached', 'Attached'), ('detached', 'Detached'), ('closed', 'Closed')], default='created', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_activity_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('close_reason', models.CharField(blank=True, max_length=20)),
+                ('exit_code', models.IntegerField(blank=True, null=True)),
+                ('container', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exec_sessions', to='api.containerrecord')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exec_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['container', 'status'], name='execsession_container_idx'), models.Index(fields=['user', 'status'], name='execsession_user_idx'), models.Index(fields=['status', 'heartbeat_at'], name='execsession_status_hb_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_exec_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='network',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='volume',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='image',
+            constraint=models.UniqueConstraint(fields=('host', 'image_id'), name='image_host_image_id_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='network',
+            constraint=models.UniqueConstraint(fields=('host', 'name'), name='network_host_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='volume',
+            constraint=models.UniqueConstraint(fields=('host', 'name'), name='volume_host_name_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_per_host_uniqueness'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='execsession',
+            name='exec_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_exec_session_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContainerStatsPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(default=0)),
+                ('at', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=1)),
+                ('cpu_percent', models.FloatField(blank=True, null=True)),
+                ('memory_usage_mb', models.FloatField(blank=True, null=True)),
+                ('memory_cache_mb', models.FloatField(blank=True, null=True)),
+                ('memory_limit_mb', models.FloatField(blank=True, null=True)),
+                ('network_rx_bytes_per_sec', models.FloatField(blank=True, null=True)),
+                ('network_tx_bytes_per_sec', models.FloatField(blank=True, null=True)),
+                ('block_read_bytes_per_sec', models.FloatField(blank=True, null=True)),
+                ('block_write_bytes_per_sec', models.FloatField(blank=True, null=True)),
+                ('pids', models.FloatField(blank=True, null=True)),
+                ('container', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats_points', to='api.containerrecord')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'at'], name='statspoint_res_at_idx')],
+                'constraints': [models.UniqueConstraint(fields=('container', 'resolution', 'at'), name='statspoint_container_res_at_uniq')],
+            },
+        ),
+    ]
@@ -1,22 +1,60 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 import docker
 from rest_framework.response import Response
 import uuid
 
+from .circuit_breaker import HostUnavailable
+from .docker_clients import get_client, registry as docker_clients
+from .stats import normalize_stats
+from .logs import open_log_stream
+
+def role_cache_key(user_id):
+    return f"user_roles:{user_id}"
+
+
 class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+    def get_roles(self):
+        """
+        Names of the user's groups. Loaded at most once per instance (and
+        request.user is one instance per request), optionally shared across
+        requests through the cache for USER_ROLE_CACHE_TTL seconds.
+        """
+        roles = getattr(self, '_roles', None)
+        if roles is not None:
+            return roles
+
+        ttl = getattr(settings, 'USER_ROLE_CACHE_TTL', 0)
+        if ttl and self.pk:
+            roles = cache.get(role_cache_key(self.pk))
+        if roles is None:
+            roles = frozenset(self.groups.values_list('name', flat=True))
+            if ttl and self.pk:
+                cache.set(role_cache_key(self.pk), roles, ttl)
+        self._roles = roles
+        return roles
+
+    def set_roles(self, roles):
+        self._roles = frozenset(roles)
+
+    def clear_role_cache(self):
+        self._roles = None
+        cache.delete(role_cache_key(self.pk))
+
     def is_admin(self):
-        return self.groups.filter(name='admin').exists()
+        return 'admin' in self.get_roles()
 
     def is_developer(self):
-        return self.groups.filter(name='developer').exists()
+        return 'developer' in self.get_roles()
 
     def is_viewer(self):
-        return self.groups.filter(name='viewer').exists()
+        return 'viewer' in self.get_roles()
 
 class ContainerRecord(models.Model):
     container_id = models.CharField(max_length=64, unique=True)
@@ -31,6 +69,11 @@ class ContainerRecord(models.Model):
     internal_ports = models.JSONField(blank=True, null=True)  # {"80/tcp": {}}
     port_bindings = models.JSONField(blank=True, null=True)   # {"80/tcp": [{"HostPort": "8080"}]}
 
+    labels = models.JSONField(blank=True, default=dict)       # Docker labels, kept in sync from the daemon
+    # Resources asked for when the container was placed (api/placement.py); null when unknown
+    cpu_request = models.FloatField(blank=True, null=True)            # cores
+    memory_request_mb = models.PositiveIntegerField(blank=True, null=True)
+
     host = models.ForeignKey('DockerHost', on_delete=models.CASCADE, related_name='containers', to_field='id', db_column='host_id')
 
     volumes = models.ManyToManyField('Volume', related_name='containers', blank=True)
@@ -49,39 +92,50 @@ class ContainerRecord(models.Model):
     last_updated = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        # Keyset pagination and filters of the per-host container list.
+        indexes = [
+            models.Index(fields=['host', 'created_at', 'id'], name='container_host_created_idx'),
+            models.Index(fields=['host', 'name', 'id'], name='container_host_name_idx'),
+            models.Index(fields=['host', 'status'], name='container_host_status_idx'),
+        ]
+
     def start(self):
         try:
-            client = docker.DockerClient(base_url=self.host.docker_api_url)
+            client = get_client(self.host)
             container = client.containers.get(self.container_id)
             container.start()
             self.status = 'running'
             self.save()
+        except HostUnavailable:
+            raise
         except Exception as e:
             raise Exception(f"Failed to start container: {e}")
         
     def stop(self):
         try:
-            client = docker.DockerClient(base_url=self.host.docker_api_url)
+            client = get_client(self.host)
             container = client.containers.get(self.container_id)
             container.stop()
             self.status = 'stopped'
             self.save()
+        except HostUnavailable:
+            raise
         except Exception as e:
             raise Exception(f"Failed to stop container: {e}")
         
-    def get_logs(self):
+    def stream_logs(self, query):
         try:
-            client = docker.DockerClient(base_url=self.host.docker_api_url)
-            container = client.containers.get(self.container_id)
-            logs = container.logs()
-            return logs
+            client = get_client(self.host)
+            return open_log_stream(client, self.container_id, query)
+        except (docker.errors.NotFound, HostUnavailable):
+            raise
         except Exception as e:
             raise Exception(f"Failed to get logs: {e}")
 
     def stats(self, stream=False):
         try:
-            import docker
-            client = docker.DockerClient(base_url=self.host.docker_api_url)
+            client = get_client(self.host)
             container = client.containers.get(self.container_id)
 
             # Always stream once to get valid stats
@@ -90,43 +144,12 @@ class ContainerRecord(models.Model):
             if raw_stats["read"].startswith("0001-01-01"):
                 raise Exception("Container stats not ready or container is not running.")
 
-            # === CPU TIME (user + kernel) ===
-            cpu_stats = raw_stats["cpu_stats"]
-            cpu_user = cpu_stats["cpu_usage"]["usage_in_usermode"]
-            cpu_kernel = cpu_stats["cpu_usage"]["usage_in_kernelmode"]
-            cpu_total_time_sec = (cpu_user + cpu_kernel) / 1e9  # Convert nanoseconds to seconds
-
-            # === MEMORY ===
-            mem_usage = raw_stats["memory_stats"]["usage"]
-            mem_limit = raw_stats["memory_stats"]["limit"]
-
-            # === NETWORK ===
-            net = raw_stats["networks"]["eth0"]
-            rx_bytes = net["rx_bytes"]
-            tx_bytes = net["tx_bytes"]
-            network_rx_mb = round(rx_bytes / (1024 ** 2), 2)
-            network_tx_mb = round(tx_bytes / (1024 ** 2), 2)
-
-            # === PIDs ===
-            pids = raw_stats["pids_stats"]["current"]
-
-            # === Final Structured Result ===
-            result = {
-                "container_id": raw_stats["id"][:12],
-                "name": raw_stats["name"].lstrip("/"),
-                "cpu_total_time_sec": round(cpu_total_time_sec, 2),
-                "memory_usage_mb": round(mem_usage / (1024 ** 2), 2),
-                "memory_limit_mb": round(mem_limit / (1024 ** 2), 2),
-                "pids": pids,
-                "network_rx_mb": network_rx_mb,
-                "network_tx_mb": network_tx_mb,
-                "timestamp": raw_stats["read"]
-            }
-
-            return result
+            return normalize_stats(raw_stats)
 
         except KeyError as ke:
             raise Exception(f"Missing expected stat field: {ke}")
+        except HostUnavailable:
+            raise
         except Exception as e:
             raise Exception(f"Failed to get stats: {e}")
 
@@ -181,16 +204,29 @@ class DockerHost(models.Model):
     status = models.CharField(max_length=50, default='inactive')
     last_seen_at = models.DateTimeField(blank=True, null=True)
 
+    # Circuit breaker of the Docker API client (api/circuit_breaker.py): closed, open or half_open
+    circuit_state = models.CharField(max_length=20, default='closed')
+    circuit_failures = models.PositiveIntegerField(default=0)
+    circuit_opened_at = models.DateTimeField(blank=True, null=True)
+
     total_cpu_cores = models.PositiveIntegerField(blank=True, null=True)
     total_memory_mb = models.PositiveIntegerField(blank=True, null=True)
     running_containers_count = models.PositiveIntegerField(blank=True, null=True)
     total_images_count = models.PositiveIntegerField(blank=True, null=True)
 
+    # timeNano of the last Docker event applied, used to resume the events stream
+    events_since = models.BigIntegerField(blank=True, null=True)
+    # Bumped whenever the stored containers, networks, volumes or images change (api/inventory.py)
+    inventory_version = models.PositiveBigIntegerField(default=0, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('owner', 'host_ip', 'port')
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='host_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # Auto-generate docker_api_url if not provided
@@ -198,12 +234,20 @@ class DockerHost(models.Model):
             self.docker_api_url = f"{self.connection_protocol}://{self.host_ip}:{self.port}"
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        docker_clients.invalidate(self.id)
+        return super().delete(*args, **kwargs)
+
     def test_connection(self):
         try:
-            client = docker.DockerClient(base_url=self.docker_api_url)
+            client = get_client(self)
             client.ping()
             self.status = 'active'
             return True
+        except HostUnavailable:
+            # Its circuit breaker is open: fail fast instead of waiting on the host again.
+            self.status = 'inactive'
+            raise
         except Exception:
             self.status = 'inactive'
             return False
@@ -221,7 +265,7 @@ class Network(models.Model):
     ]
 
     id = models.CharField(primary_key=True, max_length=64)  # Docker network ID
-    name = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=100)
     driver = models.CharField(max_length=20, choices=NETWORK_DRIVER_CHOICES, default='bridge')
     scope = models.CharField(max_length=50, default='local')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -230,28 +274,218 @@ class Network(models.Model):
     ingress = models.BooleanField(default=False)
     host = models.ForeignKey(DockerHost, on_delete=models.CASCADE, related_name='networks', to_field='id', db_column='host_id')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', 'created_at', 'id'], name='network_host_created_idx'),
+            models.Index(fields=['host', 'name', 'id'], name='network_host_name_idx'),
+        ]
+        constraints = [
+            # Every daemon has its own bridge/host/none.
+            models.UniqueConstraint(fields=['host', 'name'], name='network_host_name_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.driver})"
     
 class Volume(models.Model):
-    name = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255)
     driver = models.CharField(max_length=100, default='local')
     mountpoint = models.CharField(max_length=255, blank=True, null=True)
     host = models.ForeignKey('DockerHost', on_delete=models.CASCADE, related_name='volumes', to_field='id', db_column='host_id')
     created_at = models.DateTimeField(auto_now_add=True)
     labels = models.JSONField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', 'created_at', 'id'], name='volume_host_created_idx'),
+            models.Index(fields=['host', 'name', 'id'], name='volume_host_name_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['host', 'name'], name='volume_host_name_uniq'),
+        ]
+
     def __str__(self):
         return self.name
 
 class Image(models.Model):
     name = models.CharField(max_length=255)  # e.g. nginx:latest
     tag = models.CharField(max_length=100, default='latest')
-    image_id = models.CharField(max_length=255, unique=True)  # SHA or digest
+    image_id = models.CharField(max_length=255)  # SHA or digest, unique per host
     size = models.BigIntegerField(null=True, blank=True)  # in bytes
     created_at = models.DateTimeField(auto_now_add=True)
 
     host = models.ForeignKey('DockerHost', on_delete=models.CASCADE, related_name='images', to_field='id', db_column='host_id')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', 'created_at', 'id'], name='image_host_created_idx'),
+            models.Index(fields=['host', 'name', 'id'], name='image_host_name_idx'),
+        ]
+        constraints = [
+            # The same image is usually pulled on several hosts.
+            models.UniqueConstraint(fields=['host', 'image_id'], name='image_host_image_id_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}:{self.tag} ({self.host.host_name})"
+
+
+class ImagePull(models.Model):
+    """
+    One `docker pull` of `reference` on a host, run in the background.
+    At most one pull per (host, reference) can be pending or running, so
+    concurrent requests for the same image share it.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    host = models.ForeignKey('DockerHost', on_delete=models.CASCADE, related_name='image_pulls')
+    reference = models.CharField(max_length=255)  # e.g. nginx:latest
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    progress = models.JSONField(blank=True, default=dict)
+    error = models.TextField(blank=True)
+    image = models.ForeignKey('Image', on_delete=models.SET_NULL, null=True, blank=True, related_name='pulls')
+    requested_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='image_pulls')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['host', 'reference'],
+                condition=models.Q(status='running'),
+                name='unique_running_image_pull',
+            ),
+        ]
+
+    def __str__(self):
+        return f"pull {self.reference} on {self.host_id} ({self.status})"
+
+class Job(models.Model):
+    """
+    A Docker operation run by the `run_jobs` worker instead of inside a
+    request. See api.jobs.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)  # e.g. "container.create"
+    params = models.JSONField(blank=True, default=dict)
+    host = models.ForeignKey('DockerHost', on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    progress = models.JSONField(blank=True, null=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.id} ({self.status})"
+
+class HostPing(models.Model):
+    """One health check of a Docker host by the `monitor_hosts` command (api/health.py)."""
+    host = models.ForeignKey('DockerHost', on_delete=models.CASCADE, related_name='pings')
+    checked_at = models.DateTimeField(default=timezone.now)
+    ok = models.BooleanField()
+    latency_ms = models.FloatField(null=True, blank=True)  # round trip of GET /_ping
+    error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', '-checked_at'], name='hostping_host_checked_idx'),
+            models.Index(fields=['checked_at'], name='hostping_checked_idx'),
+        ]
+
+    def __str__(self):
+        return f"ping {self.host_id} at {self.checked_at} ({'ok' if self.ok else 'failed'})"
+
+class ContainerStatsPoint(models.Model):
+    """
+    A stats sample recorded by the `record_stats` command, or the average
+    of the samples of one bucket for rollups (api/stats_history.py).
+    """
+    container = models.ForeignKey('ContainerRecord', on_delete=models.CASCADE, related_name='stats_points')
+    resolution = models.PositiveIntegerField(default=0)  # 0 for samples, else the bucket width in seconds
+    at = models.DateTimeField()  # sample time, or bucket start
+    samples = models.PositiveIntegerField(default=1)  # samples averaged into this point
+    cpu_percent = models.FloatField(null=True, blank=True)
+    memory_usage_mb = models.FloatField(null=True, blank=True)
+    memory_cache_mb = models.FloatField(null=True, blank=True)
+    memory_limit_mb = models.FloatField(null=True, blank=True)
+    network_rx_bytes_per_sec = models.FloatField(null=True, blank=True)
+    network_tx_bytes_per_sec = models.FloatField(null=True, blank=True)
+    block_read_bytes_per_sec = models.FloatField(null=True, blank=True)
+    block_write_bytes_per_sec = models.FloatField(null=True, blank=True)
+    pids = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['container', 'resolution', 'at'], name='statspoint_container_res_at_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'at'], name='statspoint_res_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"stats {self.container_id} at {self.at} ({self.resolution or 'sample'})"
+
+class ExecSession(models.Model):
+    """
+    An interactive exec (`/bin/sh` with a TTY) opened in a container through
+    create_exec_session. See api.exec_sessions.
+    """
+    STATUS_CHOICES = [
+        ('created', 'Created'),    # exec created (or being created), no terminal socket yet
+        ('attached', 'Attached'),  # a terminal socket is relaying it
+        ('detached', 'Detached'),  # socket gone, kept for a reattach
+        ('closed', 'Closed'),
+    ]
+    ACTIVE_STATUSES = ('created', 'attached', 'detached')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    container = models.ForeignKey('ContainerRecord', on_delete=models.CASCADE, related_name='exec_sessions')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='exec_sessions')
+    exec_id = models.CharField(max_length=64, unique=True, null=True, blank=True)  # null while open_session creates it
+    command = models.CharField(max_length=255, default='/bin/sh')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='created')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_activity_at = models.DateTimeField(default=timezone.now)  # last input or output
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # written by the process holding the socket
+    closed_at = models.DateTimeField(null=True, blank=True)
+    close_reason = models.CharField(max_length=20, blank=True)  # exited, closed, idle, abandoned...
+    exit_code = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['container', 'status'], name='execsession_container_idx'),
+            models.Index(fields=['user', 'status'], name='execsession_user_idx'),
+            models.Index(fields=['status', 'heartbeat_at'], name='execsession_status_hb_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.name}:{self.tag} ({self.host.host_name})"
\ No newline at end of file
+        return f"exec {(self.exec_id or 'pending')[:12]} in {self.container_id} ({self.status})"
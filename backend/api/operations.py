@@ -0,0 +1,217 @@
+"""
+Docker operations shared by the API views and the background jobs that
+run them with `async=true` (see api.jobs).
+
+Each operation raises OperationError for failures that carry their own
+HTTP status; Docker errors are left to the caller, so a job can retry the
+transient ones.
+"""
+import time
+from datetime import timedelta
+
+import docker.errors
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .docker_clients import get_client
+from .image_pulls import image_reference, serialize_pull, start_pull
+from .jobs import job_handler
+from .models import ContainerRecord, CustomUser, DockerHost, Image, ImagePull, Volume
+from .serializers import ContainerRecordSerializer
+
+
+class OperationError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class ImagePullPending(Exception):
+    """The image is being pulled; the operation can be retried once `pull` finishes."""
+
+    def __init__(self, pull):
+        super().__init__(f"Pulling image {pull.reference}")
+        self.pull = pull
+
+
+def check_host_connection(host):
+    is_connected = host.test_connection()
+    # Only `status`: a full save would overwrite the circuit state recorded during the test.
+    host.save(update_fields=['status', 'updated_at'])
+    return {'reachable': is_connected, 'status': host.status}
+
+
+def provision_container(host, data, user, wait_for_pull=None):
+    """
+    Create (and optionally start) a container from request `data`.
+    Optional `cpus` / `memory_mb` become the container's CPU and memory
+    limits and are recorded for placement (see api.placement).
+
+    When the image is missing a background pull is started. Without
+    `wait_for_pull` that raises ImagePullPending; otherwise
+    `wait_for_pull(pull)` is called and must return once the image is there.
+    Returns the serialized ContainerRecord.
+    """
+    volumes_qs = Volume.objects.filter(id__in=data.get('volumes', []), host=host)
+    # For Docker SDK, mount at /mnt/{volume_name}
+    docker_volumes = {v.name: {'bind': f'/mnt/{v.name}', 'mode': 'rw'} for v in volumes_qs}
+    container_config = {
+        'name': data['name'],
+        'image': data['image'],
+        'ports': data.get('ports', {}),
+        'environment': data.get('environment', {}),
+        'volumes': docker_volumes,
+        'command': data.get('command', None)
+    }
+    cpus = float(data['cpus']) if data.get('cpus') else None
+    memory_mb = int(data['memory_mb']) if data.get('memory_mb') else None
+    if cpus:
+        container_config['nano_cpus'] = int(cpus * 1e9)
+    if memory_mb:
+        container_config['mem_limit'] = f'{memory_mb}m'
+
+    client = get_client(host)
+    try:
+        img = client.images.get(data['image'])
+    except docker.errors.NotFound:
+        pull, _ = start_pull(host, image_reference(data['image']), user)
+        if wait_for_pull is None:
+            raise ImagePullPending(pull)
+        wait_for_pull(pull)
+        img = client.images.get(data['image'])
+
+    image_id = img.id.split(':')[-1]
+    tags = img.tags or ['<none>:<none>']
+    tag = tags[0].split(':')[-1] if ':' in tags[0] else 'latest'
+    if not Image.objects.filter(image_id=image_id, host=host).exists():
+        Image.objects.create(host=host, image_id=image_id, tag=tag, created_at=timezone.now())
+
+    try:
+        docker_container = client.containers.create(**container_config)
+    except docker.errors.APIError as e:
+        if 'port is already allocated' in str(e).lower():
+            raise OperationError(
+                'Port conflict: A container on this host is already using one of the requested ports.', status=409,
+            )
+        raise
+
+    with transaction.atomic():
+        container = ContainerRecord.objects.create(
+            container_id=docker_container.id,
+            name=data['name'],
+            image=data['image'],
+            status='created',
+            created_at=timezone.now(),
+            labels=docker_container.labels,
+            port_bindings=port_bindings(container_config['ports']),
+            cpu_request=cpus,
+            memory_request_mb=memory_mb,
+            host=host,
+            created_by=user
+        )
+        container.volumes.set(volumes_qs)
+        if 'viewable_by' in data:
+            container.viewable_by.add(*data['viewable_by'])
+        if 'editable_by' in data:
+            container.editable_by.add(*data['editable_by'])
+
+    if data.get('start', False):
+        docker_container.start()
+        container.status = 'running'
+        container.save()
+    return ContainerRecordSerializer(container).data
+
+
+def port_bindings(ports):
+    """A docker-py `ports` mapping in the ContainerRecord.port_bindings shape."""
+    bindings = {}
+    for key, value in (ports or {}).items():
+        key = str(key) if '/' in str(key) else f'{key}/tcp'
+        for binding in (value if isinstance(value, list) else [value]):
+            if binding in (None, ''):
+                continue
+            host_ip, host_port = binding if isinstance(binding, tuple) else ('', binding)
+            bindings.setdefault(key, []).append({'HostIp': host_ip, 'HostPort': str(host_port)})
+    return bindings
+
+
+def find_stale_networks(host, container_id):
+    """
+    Split a container's network references into networks that still exist
+    and ones that no longer exist in Docker. Stale references cannot be
+    disconnected; they clear when the container or daemon restarts.
+    """
+    client = get_client(host)
+    container = client.containers.get(container_id)
+    networks = container.attrs['NetworkSettings']['Networks']
+    cleaned_networks = []
+    removed_networks = []
+    for name in networks.keys():
+        try:
+            network = client.networks.get(name)
+            cleaned_networks.append({'id': network.id, 'name': name, 'details': networks[name]})
+        except docker.errors.NotFound:
+            removed_networks.append(name)
+    return {
+        'message': f'Network cleanup completed. Found {len(removed_networks)} invalid network references. Container restart may be needed to fully clear references.',
+        'removed_networks': removed_networks,
+        'cleaned_networks': cleaned_networks,
+        'requires_restart': len(removed_networks) > 0
+    }
+
+
+def remove_volume(volume):
+    try:
+        get_client(volume.host).volumes.get(volume.name).remove()
+        message = 'Docker volume deleted successfully.'
+    except docker.errors.NotFound:
+        message = 'Docker volume not found. Removed from DB.'
+    volume.delete()
+    return {'message': message}
+
+
+# Background job handlers. Parameters are IDs so a job can be retried
+# against the current state of the database.
+
+@job_handler('host.test_connection')
+def test_connection_job(context, host_id):
+    return check_host_connection(DockerHost.objects.get(pk=host_id))
+
+
+@job_handler('container.create')
+def create_container_job(context, host_id, user_id, data):
+    host = DockerHost.objects.get(pk=host_id)
+    user = CustomUser.objects.filter(pk=user_id).first()
+    interval = getattr(settings, 'JOBS_PULL_POLL_INTERVAL', 1)
+    stale_after = timedelta(seconds=getattr(settings, 'IMAGE_PULL_STALE_AFTER', 300))
+
+    def wait_for_pull(pull):
+        while pull.status == 'running':
+            context.check_cancelled()
+            context.report({'stage': 'pulling', 'pull': serialize_pull(pull)})
+            time.sleep(interval)
+            pull = ImagePull.objects.get(pk=pull.pk)
+            if pull.status == 'running' and pull.updated_at < timezone.now() - stale_after:
+                # Whoever was pulling died; start_pull replaces the abandoned pull.
+                pull, _ = start_pull(host, pull.reference, user)
+        if pull.status != 'succeeded':
+            raise OperationError(f"Could not pull {pull.reference}: {pull.error}")
+        context.check_cancelled()
+        context.report({'stage': 'creating', 'pull': serialize_pull(pull)})
+
+    return provision_container(host, data, user, wait_for_pull=wait_for_pull)
+
+
+@job_handler('network.cleanup')
+def cleanup_networks_job(context, host_id, container_id):
+    return find_stale_networks(DockerHost.objects.get(pk=host_id), container_id)
+
+
+@job_handler('volume.delete')
+def delete_volume_job(context, volume_id):
+    volume = Volume.objects.select_related('host').filter(pk=volume_id).first()
+    if volume is None:
+        return {'message': 'Volume already removed.'}
+    return remove_volume(volume)
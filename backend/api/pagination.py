@@ -0,0 +1,150 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin: `fields=[...]` keeps only those fields in the
+    output, so unrequested nested or related fields are never evaluated.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def parse_fields(params):
+    """`fields=a,b` from a request, None when not given."""
+    value = params.get('fields')
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def apply_filters(queryset, params, filters):
+    """
+    Apply the request parameters named in `filters` ({param: lookup}).
+    An `__in` lookup takes a comma separated list.
+    """
+    for param, lookup in filters.items():
+        value = params.get(param)
+        if value in (None, ''):
+            continue
+        if lookup.endswith('__in'):
+            value = [v for v in value.split(',') if v]
+        queryset = queryset.filter(**{lookup: value})
+    return queryset
+
+
+def only_requested(queryset, fields, keep=()):
+    """Load only the columns behind the requested `fields` (plus `keep`), or all of them without a selection."""
+    if fields is None:
+        return queryset
+    opts = queryset.model._meta
+    columns = {opts.pk.name, *keep}
+    for name in fields:
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.many_to_many:
+            columns.add(name)
+    return queryset.only(*columns)
+
+
+def _encode_cursor(ordering, values):
+    payload = json.dumps({'o': ordering, 'v': values}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, ordering, model):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if payload['o'] != ordering:
+            raise ValueError
+        names = [name.lstrip('-') for name in ordering]
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(names, payload['v'], strict=True)]
+    except (ValueError, KeyError, TypeError, binascii.Error, ValidationError):
+        raise ValueError("Invalid cursor.")
+
+
+def _after(ordering, values):
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y), per column direction.
+    condition = Q()
+    for i, name in enumerate(ordering):
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        term = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[i]})
+        for previous, value in zip(ordering[:i], values[:i]):
+            term &= Q(**{previous.lstrip('-'): value})
+        condition |= term
+    return condition
+
+
+def paginate_keyset(queryset, params, ordering):
+    """
+    Keyset pagination over `ordering`, which must end in a unique column.
+    Pages start after the row a cursor points at instead of at an offset,
+    so every page costs one index range scan however deep it is.
+
+    Returns (rows, next_cursor, paginated). Without `limit` or `cursor` in
+    `params` the whole queryset is returned, unpaginated.
+    """
+    queryset = queryset.order_by(*ordering)
+    cursor = params.get('cursor')
+    limit = params.get('limit')
+    if not (cursor or limit):
+        return queryset, None, False
+
+    max_limit = getattr(settings, 'LIST_MAX_LIMIT', 1000)
+    try:
+        limit = int(limit) if limit else getattr(settings, 'LIST_DEFAULT_LIMIT', 100)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= max_limit:
+        raise ValueError(f"'limit' must be between 1 and {max_limit}.")
+
+    if cursor:
+        queryset = queryset.filter(_after(ordering, _decode_cursor(cursor, list(ordering), queryset.model)))
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        opts = queryset.model._meta
+        values = [opts.get_field(name.lstrip('-')).value_to_string(last) for name in ordering]
+        next_cursor = _encode_cursor(list(ordering), values)
+    return rows, next_cursor, True
+
+
+def list_page(queryset, params, serializer_class, orderings, filters=None, prepare=None):
+    """
+    Filter, order, paginate and serialize a list endpoint's queryset.
+
+    `orderings` maps the accepted `ordering` values to column tuples; the
+    first one is the default. `prepare(queryset, fields)` adds the eager
+    loading the serializer needs for the requested fields.
+    Returns (data, next_cursor, paginated).
+    """
+    fields = parse_fields(params)
+    ordering_name = params.get('ordering') or next(iter(orderings))
+    if ordering_name not in orderings:
+        raise ValueError(f"'ordering' must be one of: {', '.join(orderings)}.")
+    ordering = orderings[ordering_name]
+
+    queryset = apply_filters(queryset, params, filters or {})
+    queryset = only_requested(queryset, fields, keep=[name.lstrip('-') for name in ordering])
+    if prepare is not None:
+        queryset = prepare(queryset, fields)
+    rows, next_cursor, paginated = paginate_keyset(queryset, params, ordering)
+    return serializer_class(rows, many=True, fields=fields).data, next_cursor, paginated
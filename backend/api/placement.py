@@ -0,0 +1,245 @@
+"""
+Capacity-aware placement of new containers across the fleet.
+
+A HostIndex holds, in memory, what placement needs about every eligible
+host: labels, capacity (total_cpu_cores / total_memory_mb, kept fresh by
+the health monitor), the CPU and memory its running containers use, and
+the host ports they bind. A container's usage is its recent mean from the
+stats history when there is one, else what it asked for when placed, else
+PLACEMENT_DEFAULT_CPU / PLACEMENT_DEFAULT_MEMORY_MB.
+
+Hosts are kept sorted by headroom, the smaller of their free CPU and free
+memory fractions. Placing a container walks that order and takes the
+first host that satisfies the label constraints, has the ports free and
+fits the request, so the least loaded feasible host wins and a decision
+usually looks at a handful of hosts whatever the fleet size. Label
+constraints are answered from an inverted index first when they are
+selective. Each placement is reserved in the index at once, so placements
+made before the next rebuild (PLACEMENT_INDEX_TTL) see each other.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import ContainerRecord, DockerHost
+from .stats_history import history as stats_history
+
+
+def parse_host_labels(value):
+    """DockerHost.labels ("gpu, zone=eu") -> {"gpu": None, "zone": "eu"}."""
+    labels = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, val = item.partition('=')
+        labels[key.strip()] = val.strip() if sep else None
+    return labels
+
+
+def host_ports(ports):
+    """Host ports bound by a docker-py `ports` mapping ({"80/tcp": 8080, ...})."""
+    bound = set()
+    for value in (ports or {}).values():
+        for binding in (value if isinstance(value, list) else [value]):
+            if isinstance(binding, tuple):
+                binding = binding[-1]
+            if binding not in (None, ''):
+                bound.add(int(binding))
+    return bound
+
+
+class PlacementRequest:
+    """What a new container needs: cores, memory, label constraints and host ports."""
+
+    def __init__(self, cpus=0, memory_mb=0, constraints=None, ports=()):
+        self.cpus = float(cpus or 0)
+        self.memory_mb = float(memory_mb or 0)
+        if self.cpus < 0 or self.memory_mb < 0:
+            raise ValueError("'cpus' and 'memory_mb' must not be negative.")
+        if isinstance(constraints, str):
+            constraints = [constraints]
+        self.constraints = parse_host_labels(','.join(constraints or []))
+        self.ports = frozenset(ports)
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(
+            cpus=data.get('cpus'),
+            memory_mb=data.get('memory_mb'),
+            constraints=data.get('constraints'),
+            ports=host_ports(data.get('ports')),
+        )
+
+
+class HostState:
+    __slots__ = ('host_id', 'owner_id', 'name', 'labels', 'cpu_total', 'memory_total', 'cpu_used', 'memory_used', 'ports', 'key')
+
+    def __init__(self, host_id, owner_id, name, labels, cpu_total, memory_total, cpu_used=0.0, memory_used=0.0, ports=()):
+        self.host_id = host_id
+        self.owner_id = owner_id
+        self.name = name
+        self.labels = labels
+        self.cpu_total = float(cpu_total)
+        self.memory_total = float(memory_total)
+        self.cpu_used = cpu_used
+        self.memory_used = memory_used
+        self.ports = set(ports)
+        self.key = None
+
+    def headroom(self):
+        return min(
+            (self.cpu_total - self.cpu_used) / self.cpu_total,
+            (self.memory_total - self.memory_used) / self.memory_total,
+        )
+
+    def fits(self, request):
+        return (
+            self.cpu_used + request.cpus <= self.cpu_total
+            and self.memory_used + request.memory_mb <= self.memory_total
+            and not (request.ports & self.ports)
+            and all(
+                key in self.labels and (value is None or self.labels[key] == value)
+                for key, value in request.constraints.items()
+            )
+        )
+
+    def describe(self):
+        return {
+            'host_id': str(self.host_id),
+            'host_name': self.name,
+            'cpu': {'total': self.cpu_total, 'used': round(self.cpu_used, 3)},
+            'memory_mb': {'total': self.memory_total, 'used': round(self.memory_used, 1)},
+            'headroom': round(self.headroom(), 4),
+        }
+
+
+class HostIndex:
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'PLACEMENT_INDEX_TTL', 30)
+        self.built_at = None
+        self._hosts = {}            # str(host_id) -> HostState
+        self._order = []            # sorted (-headroom, str(host_id)) keys
+        self._by_label = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def load(self, states):
+        """Replace the index with `states` (HostState objects)."""
+        hosts = {}
+        by_label = defaultdict(set)
+        for state in states:
+            host_id = str(state.host_id)
+            state.key = (-state.headroom(), host_id)
+            hosts[host_id] = state
+            for key, value in state.labels.items():
+                by_label[key].add(host_id)
+                if value is not None:
+                    by_label[f"{key}={value}"].add(host_id)
+        with self._lock:
+            self._hosts = hosts
+            self._by_label = by_label
+            self._order = sorted(state.key for state in hosts.values())
+            self.built_at = time.monotonic()
+
+    def refresh(self, force=False):
+        if not force and self.built_at is not None and time.monotonic() - self.built_at < self.ttl:
+            return
+        self.load(self._read_states())
+
+    def _read_states(self):
+        default_cpu = getattr(settings, 'PLACEMENT_DEFAULT_CPU', 0.1)
+        default_memory = getattr(settings, 'PLACEMENT_DEFAULT_MEMORY_MB', 128)
+        window = getattr(settings, 'PLACEMENT_STATS_WINDOW', 300)
+        hosts = (
+            DockerHost.objects.filter(status='active', total_cpu_cores__gt=0, total_memory_mb__gt=0)
+            .exclude(circuit_state='open')
+            .only('id', 'owner_id', 'host_name', 'labels', 'total_cpu_cores', 'total_memory_mb')
+        )
+        states = {
+            host.id: HostState(host.id, host.owner_id, host.host_name, parse_host_labels(host.labels),
+                               host.total_cpu_cores, host.total_memory_mb)
+            for host in hosts
+        }
+        containers = ContainerRecord.objects.filter(
+            Q(status='running') | Q(status='created'), is_active=True, host_id__in=list(states),
+        ).values_list('host_id', 'container_id', 'cpu_request', 'memory_request_mb', 'port_bindings')
+        containers = list(containers)
+        usages = stats_history.recent_many([row[1] for row in containers], window)
+        for host_id, container_id, cpu_request, memory_request, bindings in containers:
+            state = states[host_id]
+            usage = usages.get(container_id) or {}
+            cpu = usage.get('cpu_percent')
+            memory = usage.get('memory_usage_mb')
+            state.cpu_used += cpu / 100 if cpu is not None else (cpu_request if cpu_request is not None else default_cpu)
+            state.memory_used += memory if memory is not None else (memory_request if memory_request is not None else default_memory)
+            for port_bindings in (bindings or {}).values():
+                for binding in port_bindings or ():
+                    if binding.get('HostPort'):
+                        state.ports.add(int(binding['HostPort']))
+        return states.values()
+
+    def place(self, request, allowed=None, reserve=True):
+        """
+        The least loaded host that can take `request`, or None. `allowed(state)`
+        narrows the hosts the caller may use. With `reserve` the request is
+        counted against the chosen host until the next rebuild.
+        """
+        with self._lock:
+            candidates = None
+            for key, value in request.constraints.items():
+                posting = self._by_label.get(key if value is None else f"{key}={value}", set())
+                candidates = posting if candidates is None else candidates & posting
+            if candidates is not None and len(candidates) * 8 < len(self._order):
+                ranked = sorted(self._hosts[host_id].key for host_id in candidates)
+            else:
+                ranked = self._order
+            for _, host_id in ranked:
+                state = self._hosts[host_id]
+                if state.fits(request) and (allowed is None or allowed(state)):
+                    if reserve:
+                        self._apply(state, request.cpus, request.memory_mb, add_ports=request.ports)
+                    return state
+            return None
+
+    def release(self, host_id, request):
+        """Undo the reservation of a placement that did not happen."""
+        with self._lock:
+            state = self._hosts.get(str(host_id))
+            if state is not None:
+                self._apply(state, -request.cpus, -request.memory_mb, remove_ports=request.ports)
+
+    def ranking(self, request, allowed=None, limit=5):
+        """The best `limit` hosts for `request`, without reserving anything."""
+        with self._lock:
+            result = []
+            for _, host_id in self._order:
+                state = self._hosts[host_id]
+                if state.fits(request) and (allowed is None or allowed(state)):
+                    result.append(state)
+                    if len(result) >= limit:
+                        break
+            return result
+
+    def states(self):
+        with self._lock:
+            return list(self._hosts.values())
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def _apply(self, state, cpus, memory_mb, add_ports=frozenset(), remove_ports=frozenset()):
+        index = bisect.bisect_left(self._order, state.key)
+        del self._order[index]
+        state.cpu_used += cpus
+        state.memory_used += memory_mb
+        state.ports |= add_ports
+        state.ports -= remove_ports
+        state.key = (-state.headroom(), state.key[1])
+        bisect.insort(self._order, state.key)
+
+
+host_index = HostIndex()
@@ -4,5 +4,8 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r'ws/socket-server/', consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/stats/', consumers.StatsConsumer.as_asgi()),
+    re_path(r'ws/hosts/(?P<host_id>[0-9a-f-]+)/events/$', consumers.HostEventsConsumer.as_asgi()),
+    re_path(r'ws/images/pulls/(?P<pull_id>[0-9a-f-]+)/$', consumers.ImagePullConsumer.as_asgi()),
+    re_path(r'ws/jobs/(?P<job_id>[0-9a-f-]+)/$', consumers.JobConsumer.as_asgi()),
     re_path(r'ws/terminal/(?P<container_id>[^/]+)/(?P<exec_id>[^/]+)/$', consumers.TerminalConsumer.as_asgi()),
 ]
@@ -1,10 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
+from django.db.models import Prefetch
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 import docker
 
 from api.models import ContainerRecord, DockerHost, Network, Volume, Image
+from api.pagination import SparseFieldsMixin
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -55,17 +57,21 @@ class UserLoginSerializer(serializers.Serializer):
         
         return data
     
-class DockerHostSerializer(serializers.ModelSerializer):
+class DockerHostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = DockerHost
         fields = [
             'id', 'host_name', 'host_ip', 'docker_api_url', 'port',
-            'connection_protocol', 'auth_type', 'status', 'description',
+            'connection_protocol', 'auth_type', 'status', 'last_seen_at',
+            'circuit_state', 'circuit_failures', 'circuit_opened_at', 'description',
             'operating_system', 'docker_version', 'total_cpu_cores',
             'total_memory_mb', 'running_containers_count', 'total_images_count',
             'created_at', 'updated_at', 'labels'
         ]
-        read_only_fields = ['created_at', 'updated_at', 'connection_protocol', 'status']
+        read_only_fields = [
+            'created_at', 'updated_at', 'connection_protocol', 'status', 'last_seen_at',
+            'circuit_state', 'circuit_failures', 'circuit_opened_at',
+        ]
 
     def create(self, validated_data):
         # user = self.context['request'].user
@@ -84,7 +90,7 @@ class DockerHostSerializer(serializers.ModelSerializer):
 
         return data
 
-class VolumeSerializer(serializers.ModelSerializer):
+class VolumeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Volume
         fields = ['id', 'name', 'driver', 'mountpoint', 'labels', 'created_at', 'host']
@@ -132,8 +138,67 @@ class ContainerRecordSerializer(serializers.ModelSerializer):
 
     def get_viewable_by(self, obj):
         return [user.username for user in obj.viewable_by.all()]
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # Load everything the serializer touches up front so a page of
+        # containers costs a fixed number of queries instead of 4 per row.
+        usernames = get_user_model().objects.only('id', 'username')
+        return queryset.select_related('host', 'created_by').prefetch_related(
+            Prefetch('editable_by', queryset=usernames),
+            Prefetch('viewable_by', queryset=usernames),
+            'volumes',
+        )
+
+class ContainerRecordListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact container representation for list endpoints: the host is
+    referenced by id (it is returned once alongside the list) and
+    volumes by id.
+    """
+    created_by = serializers.SlugRelatedField(slug_field='username', read_only=True)
+    editable_by = serializers.SlugRelatedField(slug_field='username', many=True, read_only=True)
+    viewable_by = serializers.SlugRelatedField(slug_field='username', many=True, read_only=True)
+
+    class Meta:
+        model = ContainerRecord
+        fields = [
+            'id',
+            'container_id',
+            'name',
+            'image',
+            'status',
+            'state',
+            'created_at',
+            'restarted_count',
+            'internal_ports',
+            'port_bindings',
+            'host',
+            'created_by',
+            'editable_by',
+            'viewable_by',
+            'last_updated',
+            'is_active',
+            'volumes',
+        ]
+        read_only_fields = fields
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        # Only join and prefetch the relations that are going to be serialized.
+        usernames = get_user_model().objects.only('id', 'username')
+        prefetches = {
+            'editable_by': Prefetch('editable_by', queryset=usernames),
+            'viewable_by': Prefetch('viewable_by', queryset=usernames),
+            'volumes': Prefetch('volumes', queryset=Volume.objects.only('id')),
+        }
+        if fields is None or 'created_by' in fields:
+            queryset = queryset.select_related('created_by')
+        return queryset.prefetch_related(*(
+            prefetch for name, prefetch in prefetches.items() if fields is None or name in fields
+        ))
     
-class NetworkSerializer(serializers.ModelSerializer):
+class NetworkSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     host = DockerHostSerializer(read_only=True)
     host_id = serializers.PrimaryKeyRelatedField(
         queryset=DockerHost.objects.all(),
@@ -157,7 +222,7 @@ class NetworkSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'host']
 
-class ImageSerializer(serializers.ModelSerializer):
+class ImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = '__all__'
\ No newline at end of file
@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .inventory import bump_inventory
+from .models import ContainerRecord, Image, Network, Volume, role_cache_key
+
+
+def _forget_roles(user_ids):
+    cache.delete_many([role_cache_key(user_id) for user_id in user_ids])
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_roles_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups.add(...) / remove(...) / clear()
+        instance._roles = None
+        _forget_roles([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear(): pk_set is empty, so collect members first.
+        _forget_roles(instance.user_set.values_list('pk', flat=True))
+    elif pk_set:
+        # group.user_set.add(...) / remove(...)
+        _forget_roles(pk_set)
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_roles_on_group_delete(sender, instance, **kwargs):
+    _forget_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=ContainerRecord)
+@receiver(post_save, sender=Network)
+@receiver(post_save, sender=Volume)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=ContainerRecord)
+@receiver(post_delete, sender=Network)
+@receiver(post_delete, sender=Volume)
+@receiver(post_delete, sender=Image)
+def bump_inventory_on_change(sender, instance, **kwargs):
+    bump_inventory(instance.host_id)
+
+
+@receiver(m2m_changed, sender=ContainerRecord.volumes.through)
+@receiver(m2m_changed, sender=ContainerRecord.viewable_by.through)
+@receiver(m2m_changed, sender=ContainerRecord.editable_by.through)
+def bump_inventory_on_container_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        bump_inventory(instance.host_id)
+    elif action == 'pre_clear':
+        # volume.containers.clear() / user.viewable_containers.clear(): pk_set is empty,
+        # so look the containers up through the other foreign key of the m2m table.
+        field = next(f for f in sender._meta.fields if f.is_relation and f.related_model is not ContainerRecord)
+        bump_inventory(*sender.objects.filter(**{field.name: instance.pk})
+                       .values_list('containerrecord__host_id', flat=True).distinct())
+    elif pk_set:
+        bump_inventory(*ContainerRecord.objects.filter(pk__in=pk_set).values_list('host_id', flat=True).distinct())
@@ -0,0 +1,145 @@
+from datetime import datetime, timezone
+
+MB = 1024 ** 2
+
+
+def read_time(value):
+    """Epoch seconds from the daemon's `read` field (RFC 3339 with nanoseconds)."""
+    value = value.rstrip('Z')
+    base, _, fraction = value.partition('.')
+    seconds = datetime.fromisoformat(base).replace(tzinfo=timezone.utc).timestamp()
+    digits = fraction[:9].split('+')[0].split('-')[0]
+    return seconds + (int(digits) / 10 ** len(digits) if digits.isdigit() else 0.0)
+
+
+def cpu_percent(cpu_stats, precpu_stats):
+    """
+    CPU usage over the daemon's sampling window, the way `docker stats`
+    computes it: container delta over host delta, scaled by online CPUs.
+    """
+    if not precpu_stats.get('system_cpu_usage'):
+        # First sample of a stream or a one-shot read: no window to compare with.
+        return 0.0
+    cpu_delta = cpu_stats['cpu_usage']['total_usage'] - precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats['cpu_usage'].get('percpu_usage') or ()) or 1
+    return cpu_delta / system_delta * online_cpus * 100.0
+
+
+def memory_cache(memory_stats):
+    """
+    Reclaimable page cache included in `usage`: total_inactive_file on
+    cgroup v1, inactive_file on cgroup v2, `cache` on old daemons.
+    """
+    stats = memory_stats.get('stats') or {}
+    usage = memory_stats.get('usage', 0)
+    for key in ('total_inactive_file', 'inactive_file', 'cache'):
+        value = stats.get(key)
+        if value is not None and value < usage:
+            return value
+    return 0
+
+
+def block_io(blkio_stats):
+    read = write = 0
+    for entry in (blkio_stats or {}).get('io_service_bytes_recursive') or ():
+        op = entry['op'].lower()
+        if op == 'read':
+            read += entry['value']
+        elif op == 'write':
+            write += entry['value']
+    return read, write
+
+
+def _rate(current, previous, elapsed):
+    if previous is None or elapsed <= 0 or current < previous:
+        return None
+    return round((current - previous) / elapsed, 1)
+
+
+class StatsNormalizer:
+    """
+    Turns raw daemon stats into the flat dict served by the API and the
+    stats socket.
+
+    CPU% comes from the `precpu_stats` the daemon embeds in every sample.
+    Network and block I/O rates need the previous sample, so keep one
+    normalizer per stream; the first sample has `None` rates.
+    """
+    __slots__ = ('_read', '_networks', '_block')
+
+    def __init__(self):
+        self._read = None
+        self._networks = None
+        self._block = None
+
+    def normalize(self, raw_stats):
+        read = read_time(raw_stats['read'])
+        elapsed = read - self._read if self._read is not None else 0
+        previous_networks = self._networks or {}
+
+        cpu_stats = raw_stats['cpu_stats']
+        cpu_usage = cpu_stats['cpu_usage']
+        memory_stats = raw_stats.get('memory_stats') or {}
+        memory_usage = memory_stats.get('usage', 0)
+        memory_limit = memory_stats.get('limit', 0)
+        cache = memory_cache(memory_stats)
+        working_set = memory_usage - cache
+
+        networks = {}
+        counters = {}
+        rx_total = tx_total = 0
+        rx_rate_total = tx_rate_total = None
+        for name, interface in (raw_stats.get('networks') or {}).items():
+            rx, tx = interface['rx_bytes'], interface['tx_bytes']
+            counters[name] = (rx, tx)
+            rx_total += rx
+            tx_total += tx
+            previous_rx, previous_tx = previous_networks.get(name, (None, None))
+            rx_rate = _rate(rx, previous_rx, elapsed)
+            tx_rate = _rate(tx, previous_tx, elapsed)
+            if rx_rate is not None and tx_rate is not None:
+                rx_rate_total = (rx_rate_total or 0) + rx_rate
+                tx_rate_total = (tx_rate_total or 0) + tx_rate
+            networks[name] = {
+                'rx_mb': round(rx / MB, 2),
+                'tx_mb': round(tx / MB, 2),
+                'rx_bytes_per_sec': rx_rate,
+                'tx_bytes_per_sec': tx_rate,
+            }
+
+        block_read, block_write = block_io(raw_stats.get('blkio_stats'))
+        previous_read, previous_write = self._block or (None, None)
+
+        self._read = read
+        self._networks = counters
+        self._block = (block_read, block_write)
+
+        return {
+            'container_id': raw_stats['id'][:12],
+            'name': raw_stats['name'].lstrip('/'),
+            'cpu_percent': round(cpu_percent(cpu_stats, raw_stats.get('precpu_stats') or {}), 2),
+            'cpu_total_time_sec': round((cpu_usage.get('usage_in_usermode', 0) + cpu_usage.get('usage_in_kernelmode', 0)) / 1e9, 2),
+            'memory_usage_mb': round(working_set / MB, 2),
+            'memory_cache_mb': round(cache / MB, 2),
+            'memory_limit_mb': round(memory_limit / MB, 2),
+            'memory_percent': round(working_set / memory_limit * 100, 2) if memory_limit else 0.0,
+            'pids': (raw_stats.get('pids_stats') or {}).get('current', 0),
+            'network_rx_mb': round(rx_total / MB, 2),
+            'network_tx_mb': round(tx_total / MB, 2),
+            'network_rx_bytes_per_sec': rx_rate_total,
+            'network_tx_bytes_per_sec': tx_rate_total,
+            'networks': networks,
+            'block_read_mb': round(block_read / MB, 2),
+            'block_write_mb': round(block_write / MB, 2),
+            'block_read_bytes_per_sec': _rate(block_read, previous_read, elapsed),
+            'block_write_bytes_per_sec': _rate(block_write, previous_write, elapsed),
+            'timestamp': raw_stats['read'],
+        }
+
+
+def normalize_stats(raw_stats):
+    """Normalize a single sample; rates are `None` without a previous one."""
+    return StatsNormalizer().normalize(raw_stats)
@@ -0,0 +1,296 @@
+"""
+Container stats history (python manage.py record_stats).
+
+The recorder samples every running container every STATS_RECORD_INTERVAL
+seconds, whether or not anyone is watching it, on a bounded thread pool,
+and writes the samples in bulk as ContainerStatsPoint rows, so every
+backend process reads the same history. After each sweep closed buckets
+are rolled up (samples -> 1m -> 1h averages) and each resolution is
+trimmed to its retention.
+
+Reads go to the coarsest resolution fine enough for the requested step,
+then to the finer ones for the time after its last bucket, so the bucket
+still open (not rolled up yet) is always included.
+"""
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, Count, F, FloatField, Max, Min, Sum, When
+from django.db.models.functions import TruncHour, TruncMinute
+from django.utils import timezone
+
+from .circuit_breaker import call_budget
+from .docker_clients import get_client
+from .models import ContainerRecord, ContainerStatsPoint
+from .stats import StatsNormalizer, read_time
+
+logger = logging.getLogger(__name__)
+
+
+# Numeric fields of a parsed stats sample that are kept as series.
+SERIES_FIELDS = (
+    'cpu_percent',
+    'memory_usage_mb',
+    'memory_cache_mb',
+    'memory_limit_mb',
+    'network_rx_bytes_per_sec',
+    'network_tx_bytes_per_sec',
+    'block_read_bytes_per_sec',
+    'block_write_bytes_per_sec',
+    'pids',
+)
+
+TRUNCATE = {60: TruncMinute, 3600: TruncHour}
+
+
+def weighted_avg(field):
+    """
+    Mean of `field` over the samples behind the rows: a rollup row stands
+    for `samples` samples, so a minute with 2 samples weighs a third of
+    one with 6. Rows where the field is null do not count.
+    """
+    return (
+        Sum(F(field) * F('samples'), output_field=FloatField())
+        / Sum(Case(When(**{f'{field}__isnull': False}, then=F('samples'))), output_field=FloatField())
+    )
+
+
+def _point(container_pk, sample):
+    values = {
+        field: float(sample[field]) if isinstance(sample.get(field), (int, float)) else None
+        for field in SERIES_FIELDS
+    }
+    at = datetime.fromtimestamp(read_time(sample['timestamp']), tz=dt_timezone.utc)
+    return ContainerStatsPoint(container_id=container_pk, resolution=0, at=at, **values)
+
+
+class StatsHistory:
+    """
+    Stats series of every container, stored in the database with raw ->
+    1m -> 1h rollups. Written by StatsRecorder, read by the history
+    endpoint and by placement.
+    """
+
+    def __init__(self, tiers=None):
+        self.tiers = tiers or (
+            (0, getattr(settings, 'STATS_HISTORY_RAW_RETENTION', 1800)),
+            (60, getattr(settings, 'STATS_HISTORY_MINUTE_RETENTION', 86400)),
+            (3600, getattr(settings, 'STATS_HISTORY_HOUR_RETENTION', 30 * 86400)),
+        )
+        self._rolled_until = {}
+
+    def record(self, points):
+        ContainerStatsPoint.objects.bulk_create(points, batch_size=1000, ignore_conflicts=True)
+
+    def rollup(self, closed_before=None):
+        """
+        Average the buckets of each rollup tier that end before
+        `closed_before` (default: now) from the tier below it, weighted by
+        the samples behind each row. Buckets are only written once they are
+        closed; reads cover the open ones.
+        """
+        closed_before = closed_before or timezone.now()
+        written = 0
+        for (source, _), (step, _) in zip(self.tiers, self.tiers[1:]):
+            until = datetime.fromtimestamp(closed_before.timestamp() // step * step, tz=dt_timezone.utc)
+            since = self._rolled_until.get(step)
+            if since is None:
+                latest = ContainerStatsPoint.objects.filter(resolution=step).aggregate(latest=Max('at'))['latest']
+                since = latest + timedelta(seconds=step) if latest else None
+            rows = ContainerStatsPoint.objects.filter(resolution=source, at__lt=until)
+            if since is not None:
+                if since >= until:
+                    continue
+                rows = rows.filter(at__gte=since)
+            buckets = (
+                rows.annotate(bucket=TRUNCATE[step]('at', tzinfo=dt_timezone.utc))
+                .values('container_id', 'bucket')
+                .annotate(n=Sum('samples'), **{field: weighted_avg(field) for field in SERIES_FIELDS})
+                .order_by()
+            )
+            points = [
+                ContainerStatsPoint(
+                    container_id=row['container_id'], resolution=step, at=row['bucket'], samples=row['n'],
+                    **{field: row[field] for field in SERIES_FIELDS},
+                )
+                for row in buckets.iterator(chunk_size=5000)
+            ]
+            self.record(points)
+            written += len(points)
+            self._rolled_until[step] = until
+        return written
+
+    def enforce_retention(self, now=None):
+        now = now or timezone.now()
+        for step, retention in self.tiers:
+            ContainerStatsPoint.objects.filter(resolution=step, at__lt=now - timedelta(seconds=retention)).delete()
+
+    def pick_tier(self, ranges, start, step):
+        # Coarsest tier that is still at least as fine as the requested
+        # step and reaches back to `start`; otherwise whatever goes furthest back.
+        populated = [tier for tier in self.tiers if tier[0] in ranges]
+        if not populated:
+            return None
+        covering = [t for t in populated if ranges[t[0]].timestamp() <= start] or populated
+        fine_enough = [t for t in covering if t[0] <= step]
+        if fine_enough:
+            return max(fine_enough, key=lambda t: t[0])
+        return min(covering, key=lambda t: t[0])
+
+    def query(self, container_id, start, end, step):
+        points = ContainerStatsPoint.objects.filter(container__container_id=container_id)
+        ranges = dict(points.values_list('resolution').annotate(oldest=Min('at')).order_by())
+        tier = self.pick_tier(ranges, start, step)
+        if tier is None:
+            return None
+
+        buckets = OrderedDict()
+        since = datetime.fromtimestamp(start, tz=dt_timezone.utc)
+        until = datetime.fromtimestamp(end, tz=dt_timezone.utc)
+        # The chosen tier, then each finer one from the end of the last
+        # bucket read: rollups lag behind the samples by up to a bucket.
+        for resolution in sorted((t[0] for t in self.tiers if t[0] <= tier[0]), reverse=True):
+            last = None
+            rows = (
+                points.filter(resolution=resolution, at__gte=since, at__lte=until)
+                .order_by('at').values_list('at', 'samples', *SERIES_FIELDS)
+            )
+            for at, samples, *values in rows.iterator(chunk_size=2000):
+                timestamp = at.timestamp()
+                bucket = start + (timestamp - start) // step * step
+                sums, counts = buckets.setdefault(bucket, ({}, {}))
+                for field, value in zip(SERIES_FIELDS, values):
+                    if value is not None:
+                        sums[field] = sums.get(field, 0.0) + value * samples
+                        counts[field] = counts.get(field, 0) + samples
+                last = at
+            if last is not None and resolution:
+                since = last + timedelta(seconds=resolution)
+
+        series = {field: [] for field in SERIES_FIELDS}
+        for sums, counts in buckets.values():
+            for field in SERIES_FIELDS:
+                series[field].append(round(sums[field] / counts[field], 3) if counts.get(field) else None)
+        return {
+            'resolution': tier[0],
+            'timestamps': list(buckets),
+            'series': series,
+        }
+
+    def recent(self, container_id, window=300):
+        """Mean of each field over the last `window` seconds, or None without samples."""
+        return self.recent_many([container_id], window).get(container_id)
+
+    def recent_many(self, container_ids, window=300):
+        """{container_id: mean of each field over the last `window` seconds} for those with samples."""
+        # The finest tier that keeps `window` seconds, open buckets included.
+        resolution = min((step for step, retention in self.tiers if retention >= window), default=self.tiers[-1][0])
+        rows = (
+            ContainerStatsPoint.objects
+            .filter(resolution=resolution, at__gte=timezone.now() - timedelta(seconds=window))
+            .values('container__container_id')
+            .annotate(**{field: weighted_avg(field) for field in SERIES_FIELDS})
+            .order_by()
+        )
+        container_ids = list(container_ids)
+        result = {}
+        for i in range(0, len(container_ids), 1000):
+            for row in rows.filter(container__container_id__in=container_ids[i:i + 1000]):
+                result[row.pop('container__container_id')] = row
+        return result
+
+    def metrics(self):
+        interval = getattr(settings, 'STATS_RECORD_INTERVAL', 10)
+        recent = ContainerStatsPoint.objects.filter(
+            resolution=0, at__gte=timezone.now() - timedelta(seconds=interval * 3),
+        ).aggregate(containers=Count('container', distinct=True), latest=Max('at'))
+        return {
+            'recorded_containers': recent['containers'],
+            'latest_sample_at': recent['latest'],
+            'record_interval': interval,
+        }
+
+
+class StatsRecorder:
+    """
+    Samples every running container (of `host_ids`, if given) every
+    `interval` seconds with at most `concurrency` stats calls in flight,
+    and stores the samples through `store` (default: `history`). Keeps one
+    StatsNormalizer per container across sweeps, so I/O rates are over the
+    interval between sweeps.
+    """
+
+    def __init__(self, interval=None, concurrency=None, host_ids=None, store=None):
+        self.interval = interval or getattr(settings, 'STATS_RECORD_INTERVAL', 10)
+        self.concurrency = concurrency or getattr(settings, 'STATS_RECORD_CONCURRENCY', 16)
+        self.timeout = getattr(settings, 'STATS_RECORD_TIMEOUT', 10)
+        self.retention_interval = getattr(settings, 'STATS_HISTORY_RETENTION_INTERVAL', 300)
+        self.host_ids = host_ids
+        self.history = store or history
+        self.normalizers = {}
+        self._retention_at = 0
+        self._stopped = False
+
+    def sweep(self, containers=None):
+        """Sample `containers` (default: all running ones) and store the results. Returns a summary."""
+        started = time.monotonic()
+        if containers is None:
+            containers = ContainerRecord.objects.select_related('host').filter(is_active=True, status='running')
+            if self.host_ids:
+                containers = containers.filter(host_id__in=self.host_ids)
+            containers = list(containers)
+        self.normalizers = {c.pk: self.normalizers.get(c.pk) or StatsNormalizer() for c in containers}
+        points = []
+        if containers:
+            workers = min(self.concurrency, len(containers))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stats') as pool:
+                points = [point for point in pool.map(self._sample, containers) if point is not None]
+        self.history.record(points)
+        rolled = self.history.rollup()
+        if time.monotonic() - self._retention_at >= self.retention_interval:
+            self.history.enforce_retention()
+            self._retention_at = time.monotonic()
+
+        summary = {
+            'containers': len(containers),
+            'recorded': len(points),
+            'rolled_up': rolled,
+            'seconds': round(time.monotonic() - started, 2),
+        }
+        logger.info("Stats sweep: %s", summary)
+        return summary
+
+    def _sample(self, container):
+        try:
+            with call_budget(self.timeout):
+                raw_stats = get_client(container.host).api.stats(container.container_id, stream=False)
+            if raw_stats['read'].startswith('0001-01-01'):
+                return None  # Stopped since the sweep started
+            return _point(container.pk, self.normalizers[container.pk].normalize(raw_stats))
+        except Exception as e:
+            logger.debug("No stats for %s: %s", container.container_id[:12], e)
+            return None
+        finally:
+            # A circuit breaker changing state writes to the database from this thread.
+            close_old_connections()
+
+    def run_forever(self):
+        while not self._stopped:
+            started = time.monotonic()
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.exception("Stats sweep failed: %s", e)
+            close_old_connections()
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def stop(self):
+        self._stopped = True
+
+
+history = StatsHistory()
@@ -0,0 +1,155 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+
+from .docker_clients import HeldStream, get_client
+from .stats import StatsNormalizer
+from .streams import DockerStreamReader
+
+
+# Each process runs its own upstreams, so its stats groups must stay private
+# to it: with a shared (Redis) layer a global group would deliver every
+# replica's samples to every replica's sockets.
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+
+def stats_group_name(container_id):
+    return f"stats_{container_id}.{INSTANCE_ID}"
+
+
+class _Upstream:
+    def __init__(self, container_id, host):
+        self.container_id = container_id
+        self.host = host
+        self.subscribers = set()
+        self.task = None
+        self.teardown = None
+        self.last_sample = None
+        self.last_sample_at = None
+        self.normalizer = StatsNormalizer()
+
+
+class StatsHub:
+    """
+    Keeps a single `container.stats(stream=True)` per container for the
+    whole process and publishes each parsed sample to the
+    `stats_<container_id>.<instance>` channel group. Upstreams are reference-counted by
+    subscribed channels and closed `grace_period` seconds after the last one
+    leaves, so a page refresh does not reopen the daemon stream. When an
+    upstream ends on its own, its subscribers get a `stats.ended` event.
+    """
+
+    def __init__(self, publish_interval=None, grace_period=None):
+        self.publish_interval = publish_interval or getattr(settings, 'STATS_HUB_PUBLISH_INTERVAL', 2)
+        self.grace_period = grace_period or getattr(settings, 'STATS_HUB_GRACE_PERIOD', 10)
+        self.upstreams = {}
+        self.samples_published = 0
+        self.started_at = time.monotonic()
+        self._window = deque()
+
+    async def subscribe(self, container_id, host, channel_layer, channel_name):
+        await channel_layer.group_add(stats_group_name(container_id), channel_name)
+        upstream = self.upstreams.get(container_id)
+        if upstream is None:
+            upstream = _Upstream(container_id, host)
+            self.upstreams[container_id] = upstream
+            upstream.task = asyncio.create_task(self._run(upstream, channel_layer))
+        if upstream.teardown is not None:
+            upstream.teardown.cancel()
+            upstream.teardown = None
+        upstream.subscribers.add(channel_name)
+        if upstream.last_sample is not None:
+            # Late joiners get the latest sample right away.
+            await channel_layer.send(channel_name, {'type': 'stats.sample', 'data': upstream.last_sample})
+
+    async def unsubscribe(self, container_id, channel_layer, channel_name):
+        await channel_layer.group_discard(stats_group_name(container_id), channel_name)
+        upstream = self.upstreams.get(container_id)
+        if upstream is None:
+            return
+        upstream.subscribers.discard(channel_name)
+        if not upstream.subscribers and upstream.teardown is None:
+            upstream.teardown = asyncio.get_running_loop().call_later(
+                self.grace_period, self._stop, container_id
+            )
+
+    def _stop(self, container_id):
+        upstream = self.upstreams.get(container_id)
+        if upstream is not None and not upstream.subscribers:
+            del self.upstreams[container_id]
+            upstream.task.cancel()
+
+    async def _run(self, upstream, channel_layer):
+        group = stats_group_name(upstream.container_id)
+
+        def open_stream():
+            client = get_client(upstream.host)
+            container = client.containers.get(upstream.container_id)
+            return HeldStream(client, container.stats(stream=True, decode=True))
+
+        try:
+            last_published = 0
+            async with DockerStreamReader(open_stream) as samples:
+                async for raw_stats in samples:
+                    if raw_stats["read"].startswith("0001-01-01"):
+                        continue  # Skip invalid stats
+                    now = time.monotonic()
+                    if now - last_published < self.publish_interval:
+                        continue
+                    sample = upstream.normalizer.normalize(raw_stats)
+                    upstream.last_sample = sample
+                    upstream.last_sample_at = now
+                    last_published = now
+                    self._count_sample(now)
+                    await channel_layer.group_send(group, {'type': 'stats.sample', 'data': sample})
+        except asyncio.CancelledError:
+            raise
+        except KeyError as ke:
+            await channel_layer.group_send(group, {'type': 'stats.error', 'message': f'Missing expected stat field: {ke}'})
+        except Exception as e:
+            await channel_layer.group_send(group, {'type': 'stats.error', 'message': str(e)})
+        finally:
+            if self.upstreams.get(upstream.container_id) is upstream:
+                del self.upstreams[upstream.container_id]
+        # The stream ended by itself (container stopped, daemon error): tell
+        # the subscribers, so a later subscribe opens a new upstream.
+        await channel_layer.group_send(group, {'type': 'stats.ended', 'container_id': upstream.container_id})
+
+    def is_subscribed(self, container_id, channel_name):
+        upstream = self.upstreams.get(container_id)
+        return upstream is not None and channel_name in upstream.subscribers
+
+    def _count_sample(self, now):
+        self.samples_published += 1
+        self._window.append(now)
+        cutoff = now - 60
+        while self._window and self._window[0] < cutoff:
+            self._window.popleft()
+
+    def latest(self, container_id, max_age=None):
+        upstream = self.upstreams.get(container_id)
+        if upstream is None or upstream.last_sample is None:
+            return None
+        if time.monotonic() - upstream.last_sample_at > (max_age or self.publish_interval * 2):
+            return None
+        return upstream.last_sample
+
+    def metrics(self):
+        # Called from sync views on another thread: take snapshots first.
+        now = time.monotonic()
+        window = list(self._window)
+        upstreams = list(self.upstreams.items())
+        recent = sum(1 for t in window if t >= now - 60)
+        return {
+            'upstreams': len(upstreams),
+            'subscribers': sum(len(upstream.subscribers) for _, upstream in upstreams),
+            'samples_published': self.samples_published,
+            'samples_per_second': round(recent / min(60, max(now - self.started_at, 1)), 2),
+            'containers': {container_id: len(upstream.subscribers) for container_id, upstream in upstreams},
+        }
+
+
+hub = StatsHub()
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class StreamLimitExceeded(Exception):
+    pass
+
+
+_END = object()
+
+_max_streams = getattr(settings, 'DOCKER_STREAM_MAX_PER_PROCESS', 256)
+# docker-py only offers blocking iterators, so each live stream parks one
+# thread in a socket read. Capping the pool at the stream limit bounds both
+# threads and memory per process no matter how many sockets are open.
+_executor = ThreadPoolExecutor(max_workers=_max_streams, thread_name_prefix='docker-stream')
+_slots = threading.BoundedSemaphore(_max_streams)
+_active_lock = threading.Lock()
+_active = 0
+
+
+def active_streams():
+    return _active
+
+
+class DockerStreamReader:
+    """
+    Async iterator over a blocking Docker stream (logs, stats, events, an
+    exec socket...).
+
+    `open_stream` is called on a worker thread and must return an iterable.
+    Items are handed to the event loop through a bounded queue, so a slow
+    consumer pauses the Docker read instead of growing a buffer. `close()`
+    closes the underlying stream, which unblocks the worker thread.
+    """
+
+    def __init__(self, open_stream, buffer_size=None):
+        self.open_stream = open_stream
+        self.buffer_size = buffer_size or getattr(settings, 'DOCKER_STREAM_BUFFER_SIZE', 64)
+        self._queue = None
+        self._loop = None
+        self._stream = None
+        self._future = None
+        self._closed = threading.Event()
+
+    def start(self):
+        global _active
+        if not _slots.acquire(blocking=False):
+            raise StreamLimitExceeded("Too many Docker streams open in this process.")
+        with _active_lock:
+            _active += 1
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.buffer_size)
+        self._future = _executor.submit(self._pump)
+        return self
+
+    def _put(self, item):
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        # Wait for room in the queue, checking now and then whether we were closed.
+        while True:
+            try:
+                return future.result(timeout=1)
+            except TimeoutError:
+                if self._closed.is_set():
+                    future.cancel()
+                    return
+
+    def _pump(self):
+        global _active
+        try:
+            self._stream = self.open_stream()
+            if self._closed.is_set():
+                return
+            for item in self._stream:
+                if self._closed.is_set():
+                    break
+                self._put(item)
+        except Exception as e:
+            if not self._closed.is_set():
+                self._put(e)
+        finally:
+            self._close_stream()
+            close_old_connections()
+            if not self._closed.is_set():
+                self._put(_END)
+            with _active_lock:
+                _active -= 1
+            _slots.release()
+
+    def _close_stream(self):
+        stream = self._stream
+        self._stream = None
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._close_stream()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._queue is None:
+            self.start()
+        item = await self._queue.get()
+        if item is _END:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def aclose(self):
+        # Lets the reader be used as StreamingHttpResponse content.
+        self.close()
+
+
+class SocketStream:
+    """Iterate over raw chunks of a socket (e.g. an exec attach) until EOF."""
+
+    def __init__(self, sock, chunk_size=4096):
+        self.sock = sock
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        while True:
+            data = self.sock.recv(self.chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.sock.close()
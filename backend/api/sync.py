@@ -0,0 +1,288 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .docker_clients import get_client
+from .inventory import batched_bumps, bump_inventory
+from .models import ContainerRecord, DockerHost, Image, Network, Volume
+
+logger = logging.getLogger(__name__)
+
+
+def _from_epoch(value):
+    if not value:
+        return timezone.now()
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def _ports_from_summary(ports):
+    """
+    Convert the `Ports` list of a container summary into the
+    internal_ports / port_bindings shapes stored on ContainerRecord.
+    """
+    internal_ports = {}
+    port_bindings = {}
+    for port in ports or []:
+        key = f"{port['PrivatePort']}/{port.get('Type', 'tcp')}"
+        internal_ports[key] = {}
+        if port.get('PublicPort'):
+            port_bindings.setdefault(key, []).append({
+                'HostIp': port.get('IP', ''),
+                'HostPort': str(port['PublicPort']),
+            })
+    return internal_ports, port_bindings
+
+
+def _strip_digest(image_id):
+    return image_id.split(':')[-1] if image_id else image_id
+
+
+def _split_repo_tag(repo_tags):
+    repo_tag = (repo_tags or ['<none>:<none>'])[0]
+    name, _, tag = repo_tag.rpartition(':')
+    if not name or '/' in tag:
+        # No tag present (e.g. "registry:5000/app"), rpartition split on the port.
+        return repo_tag, 'latest'
+    return name, tag
+
+
+def _apply(model, existing, incoming, fields, make, prune=True):
+    """
+    Diff `incoming` (key -> docker summary) against `existing`
+    (key -> model instance) and return (to_create, to_update, missing_keys).
+    `make(summary)` returns a dict of field values for a summary.
+    """
+    to_create = []
+    to_update = []
+    for key, summary in incoming.items():
+        values = make(summary)
+        instance = existing.get(key)
+        if instance is None:
+            to_create.append(model(**values))
+            continue
+        changed = False
+        for field in fields:
+            if getattr(instance, field) != values[field]:
+                setattr(instance, field, values[field])
+                changed = True
+        if changed:
+            to_update.append(instance)
+    missing = [key for key in existing if key not in incoming] if prune else []
+    return to_create, to_update, missing
+
+
+def _create(model, host, rows, key):
+    """
+    Insert `rows` for `host` and return the `key` values that could not
+    be stored: a row with the same primary key (a swarm network ID) exists
+    for another host. Rows another writer inserted for this host meanwhile
+    are not conflicts.
+    """
+    if not rows:
+        return []
+    model.objects.bulk_create(rows, ignore_conflicts=True)
+    wanted = {getattr(row, key) for row in rows}
+    stored = set(model.objects.filter(host=host, **{f'{key}__in': wanted}).values_list(key, flat=True))
+    conflicts = sorted(wanted - stored)
+    if conflicts:
+        logger.warning("%s rows of host %s conflict with rows of other hosts: %s",
+                       model.__name__, host.id, ', '.join(conflicts))
+    return conflicts
+
+
+def sync_containers(host, summaries, prune=True):
+    """
+    Upsert the given container summaries for `host`. With prune=True the
+    summaries are the full listing and anything else is marked removed.
+    """
+    incoming = {c['Id']: c for c in summaries}
+    records = ContainerRecord.objects.filter(host=host).exclude(container_id='')
+    if not prune:
+        records = records.filter(container_id__in=incoming)
+    existing = {record.container_id: record for record in records}
+
+    def make(summary):
+        internal_ports, port_bindings = _ports_from_summary(summary.get('Ports'))
+        return {
+            'container_id': summary['Id'],
+            'name': (summary.get('Names') or ['/'])[0].lstrip('/'),
+            'image': summary.get('Image', ''),
+            'status': summary.get('State', ''),
+            'state': summary.get('Status', ''),
+            'created_at': _from_epoch(summary.get('Created')),
+            'internal_ports': internal_ports,
+            'port_bindings': port_bindings,
+            'labels': summary.get('Labels') or {},
+            'is_active': True,
+            'host': host,
+            'created_by_id': host.owner_id,
+        }
+
+    fields = ['name', 'image', 'status', 'state', 'internal_ports', 'port_bindings', 'labels', 'is_active']
+    to_create, to_update, missing = _apply(ContainerRecord, existing, incoming, fields, make, prune)
+
+    # Containers removed behind our back are kept for their history but
+    # flagged inactive, the same way a soft delete would look.
+    removed = [existing[key] for key in missing if existing[key].is_active]
+    for record in removed:
+        record.is_active = False
+        record.status = 'removed'
+
+    ContainerRecord.objects.bulk_create(to_create, ignore_conflicts=True)
+    ContainerRecord.objects.bulk_update(to_update + removed, fields)
+    return {'created': len(to_create), 'updated': len(to_update), 'removed': len(removed)}
+
+
+def sync_networks(host, summaries, prune=True):
+    incoming = {n['Id']: n for n in summaries}
+    networks = Network.objects.filter(host=host)
+    if not prune:
+        networks = networks.filter(id__in=incoming)
+    existing = {network.id: network for network in networks}
+
+    def make(summary):
+        return {
+            'id': summary['Id'],
+            'name': summary['Name'],
+            'driver': summary.get('Driver') or 'bridge',
+            'scope': summary.get('Scope') or 'local',
+            'internal': bool(summary.get('Internal')),
+            'attachable': bool(summary.get('Attachable')),
+            'ingress': bool(summary.get('Ingress')),
+            'host': host,
+        }
+
+    fields = ['name', 'driver', 'scope', 'internal', 'attachable', 'ingress']
+    to_create, to_update, missing = _apply(Network, existing, incoming, fields, make, prune)
+    conflicts = _create(Network, host, to_create, 'id')
+    Network.objects.bulk_update(to_update, fields)
+    Network.objects.filter(host=host, id__in=missing).delete()
+    return {'created': len(to_create) - len(conflicts), 'updated': len(to_update), 'removed': len(missing),
+            'conflicts': conflicts}
+
+
+def sync_volumes(host, summaries, prune=True):
+    incoming = {v['Name']: v for v in summaries}
+    volumes = Volume.objects.filter(host=host)
+    if not prune:
+        volumes = volumes.filter(name__in=incoming)
+    existing = {volume.name: volume for volume in volumes}
+
+    def make(summary):
+        return {
+            'name': summary['Name'],
+            'driver': summary.get('Driver') or 'local',
+            'mountpoint': summary.get('Mountpoint'),
+            'labels': summary.get('Labels') or {},
+            'host': host,
+        }
+
+    fields = ['driver', 'mountpoint', 'labels']
+    to_create, to_update, missing = _apply(Volume, existing, incoming, fields, make, prune)
+    conflicts = _create(Volume, host, to_create, 'name')
+    Volume.objects.bulk_update(to_update, fields)
+    Volume.objects.filter(host=host, name__in=missing).delete()
+    return {'created': len(to_create) - len(conflicts), 'updated': len(to_update), 'removed': len(missing),
+            'conflicts': conflicts}
+
+
+def sync_images(host, summaries, prune=True):
+    # Rows written by create_container store the bare hex digest while
+    # create_image stores "sha256:<hex>", so match on the bare digest.
+    incoming = {_strip_digest(i['Id']): i for i in summaries}
+    existing = {_strip_digest(image.image_id): image for image in Image.objects.filter(host=host)}
+
+    def make(summary):
+        name, tag = _split_repo_tag(summary.get('RepoTags'))
+        return {
+            'image_id': summary['Id'],
+            'name': name,
+            'tag': tag,
+            'size': summary.get('Size'),
+            'host': host,
+        }
+
+    fields = ['name', 'tag', 'size']
+    to_create, to_update, missing = _apply(Image, existing, incoming, fields, make, prune)
+    conflicts = _create(Image, host, to_create, 'image_id')
+    Image.objects.bulk_update(to_update, fields)
+    Image.objects.filter(host=host, pk__in=[existing[key].pk for key in missing]).delete()
+    return {'created': len(to_create) - len(conflicts), 'updated': len(to_update), 'removed': len(missing),
+            'conflicts': conflicts}
+
+
+def sync_host(host):
+    """
+    Mirror the containers, networks, volumes and images of one Docker host
+    into the database. Uses one list call per resource type, never a
+    per-object inspect.
+    """
+    client = get_client(host)
+    containers = client.api.containers(all=True)
+    networks = client.api.networks()
+    volumes = client.api.volumes().get('Volumes') or []
+    images = client.api.images()
+
+    with transaction.atomic(), batched_bumps():
+        result = {
+            'containers': sync_containers(host, containers),
+            'networks': sync_networks(host, networks),
+            'volumes': sync_volumes(host, volumes),
+            'images': sync_images(host, images),
+        }
+        DockerHost.objects.filter(pk=host.pk).update(
+            status='active',
+            last_seen_at=timezone.now(),
+            running_containers_count=sum(1 for c in containers if c.get('State') == 'running'),
+            total_images_count=len(images),
+        )
+        if any(counts['created'] or counts['updated'] or counts['removed'] for counts in result.values()):
+            # bulk_create / bulk_update send no signals (see api.inventory).
+            bump_inventory(host.pk)
+    return result
+
+
+class InventorySyncWorker:
+    """
+    Polls every DockerHost on a fixed interval, syncing up to
+    `concurrency` hosts at a time.
+    """
+
+    def __init__(self, interval=None, concurrency=None):
+        self.interval = interval or getattr(settings, 'INVENTORY_SYNC_INTERVAL', 30)
+        self.concurrency = concurrency or getattr(settings, 'INVENTORY_SYNC_CONCURRENCY', 8)
+        self._stopped = False
+
+    def _sync_one(self, host):
+        started = time.monotonic()
+        try:
+            result = sync_host(host)
+            logger.info("Synced host %s in %.2fs: %s", host.id, time.monotonic() - started, result)
+            return host.id, result
+        except Exception as e:
+            logger.warning("Failed to sync host %s: %s", host.id, e)
+            DockerHost.objects.filter(pk=host.pk).update(status='inactive')
+            return host.id, {'error': str(e)}
+        finally:
+            close_old_connections()
+
+    def run_once(self, hosts=None):
+        if hosts is None:
+            hosts = list(DockerHost.objects.all())
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='inventory-sync') as pool:
+            return dict(pool.map(self._sync_one, hosts))
+
+    def run_forever(self):
+        while not self._stopped:
+            started = time.monotonic()
+            self.run_once()
+            close_old_connections()
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def stop(self):
+        self._stopped = True
@@ -1,11 +1,1224 @@
-import docker
+import copy
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Connect to Docker daemon
-client = docker.from_env()
+import docker.errors
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-# Get the container (by name or ID)
-container = client.containers.get('e257e9edfd8a2ac23730096e79e8efc3ba24823d74368778cf7de191483b2955')
+from home.asgi import application
 
-# Stream logs
-for line in container.logs(stream=True):
-    print(line.decode('utf-8').strip())
\ No newline at end of file
+from .bulk import BulkAction
+from .circuit_breaker import BudgetExceeded, CircuitBreaker, HostUnavailable, call_budget, request_timeout
+from .consumers import StatsConsumer
+from .docker_clients import DockerClientRegistry, HeldStream, registry as docker_clients
+from .events import HostEventSubscriber
+from .exec_sessions import SESSION_ENV, _sweep, open_session
+from .image_pulls import _run_pull
+from .logs import LogQuery, open_log_stream, parse_timestamp
+from .models import (
+    ContainerRecord, ContainerStatsPoint, CustomUser, DockerHost, ExecSession, ImagePull, Job, Volume,
+)
+from .operations import OperationError
+from .placement import HostIndex, HostState, PlacementRequest, parse_host_labels
+from .stats import StatsNormalizer, normalize_stats
+from .stats_history import StatsHistory, StatsRecorder
+from .views import create_default_groups, get_tokens_for_user
+
+
+class HostListingQueryCountTests(TestCase):
+    """
+    The host listings must cost the same number of queries whether the host
+    runs one container or hundreds (see ContainerRecordListSerializer).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_groups()
+        cls.admin = CustomUser.objects.create_user('admin', password='x')
+        cls.admin.groups.add(Group.objects.get(name='admin'))
+        cls.developer = CustomUser.objects.create_user('developer', password='x')
+        cls.developer.groups.add(Group.objects.get(name='developer'))
+        cls.viewer = CustomUser.objects.create_user('viewer', password='x')
+        cls.viewer.groups.add(Group.objects.get(name='viewer'))
+
+    def setUp(self):
+        cache.clear()
+
+    def make_host(self, n_containers):
+        host = DockerHost.objects.create(
+            owner=self.admin, host_name=f'host-{n_containers}', host_ip='127.0.0.1',
+            docker_api_url='tcp://127.0.0.1:2375',
+        )
+        volume = Volume.objects.create(name=f'data-{n_containers}', host=host)
+        now = timezone.now()
+        containers = ContainerRecord.objects.bulk_create(
+            ContainerRecord(
+                container_id=uuid.uuid4().hex, name=f'c{i}', image='nginx:latest',
+                created_at=now, host=host, created_by=self.developer,
+            )
+            for i in range(n_containers)
+        )
+        for container in containers:
+            container.volumes.add(volume)
+            container.editable_by.add(self.developer)
+            container.viewable_by.add(self.viewer)
+        return host
+
+    def get(self, user, url):
+        # Listings are cached per user; count a cold render every time.
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(user=CustomUser.objects.get(pk=user.pk))
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertConstantQueries(self, user, path):
+        small, large = self.make_host(1), self.make_host(500)
+        with CaptureQueriesContext(connection) as baseline:
+            self.get(user, f'/api/hosts/{small.id}/{path}/')
+        with self.assertNumQueries(len(baseline)):
+            response = self.get(user, f'/api/hosts/{large.id}/{path}/')
+        return response
+
+    def test_container_listing_admin(self):
+        response = self.assertConstantQueries(self.admin, 'containers')
+        self.assertEqual(len(response.json()['containers']), 500)
+
+    def test_container_listing_developer(self):
+        response = self.assertConstantQueries(self.developer, 'containers')
+        self.assertEqual(len(response.json()['containers']), 500)
+
+    def test_container_listing_viewer(self):
+        response = self.assertConstantQueries(self.viewer, 'containers')
+        self.assertEqual(len(response.json()['containers']), 500)
+
+    def test_host_details_admin(self):
+        response = self.assertConstantQueries(self.admin, 'details')
+        self.assertEqual(response.json()['stats']['containers'], 500)
+
+    def test_host_details_non_admin(self):
+        response = self.assertConstantQueries(self.developer, 'details')
+        self.assertEqual(response.json()['stats']['containers'], 500)
+
+
+class InventoryETagTests(TestCase):
+    """Polled listings keep their ETag across health sweeps and change with what they return."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', password='x')
+        cls.host = DockerHost.objects.create(
+            owner=cls.owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def etag(self):
+        return self.client.get(f'/api/hosts/{self.host.id}/networks/').headers['ETag']
+
+    def test_heartbeat_keeps_etag(self):
+        # A sweep of a host that stays up only moves last_seen_at.
+        etag = self.etag()
+        DockerHost.objects.filter(pk=self.host.pk).update(status=self.host.status, last_seen_at=timezone.now())
+        self.assertEqual(self.etag(), etag)
+        response = self.client.get(f'/api/hosts/{self.host.id}/networks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_returned_fields_change_etag(self):
+        etag = self.etag()
+        DockerHost.objects.filter(pk=self.host.pk).update(circuit_failures=2)
+        self.assertNotEqual(self.etag(), etag)
+
+
+class RecordedLogDaemon:
+    """
+    Serves a recorded container log the way the daemon does: `tail` is
+    taken from the whole log first, then `since` and `until` (both
+    inclusive) filter what is left. Stands in for a docker client.
+    """
+
+    def __init__(self, lines, created):
+        self.lines = lines
+        self.created = created
+        self.api = self
+        self.requests = []
+
+    def inspect_container(self, container_id):
+        return {'Config': {'Tty': False}, 'Created': self.created}
+
+    def _url(self, path, *args):
+        return path.format(*args)
+
+    def _raise_for_status(self, response):
+        pass
+
+    def _get(self, url, params=None, stream=False, **kwargs):
+        self.requests.append(params)
+        lines = self.lines
+        if params['tail'] != 'all':
+            lines = lines[-params['tail']:] if params['tail'] else []
+        since = parse_timestamp_param(params.get('since'))
+        until = parse_timestamp_param(params.get('until'))
+        body = bytearray()
+        for stamp, message in lines:
+            point = parse_timestamp(stamp)
+            if (since and point < since) or (until and point > until):
+                continue
+            payload = f'{stamp} {message}\n'.encode()
+            body += bytes([1, 0, 0, 0]) + len(payload).to_bytes(4, 'big') + payload
+        return RecordedResponse(bytes(body))
+
+
+class RecordedResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size=1):
+        # Odd chunk sizes split frames and lines across reads.
+        for offset in range(0, len(self.body), 1000):
+            yield self.body[offset:offset + 1000]
+
+    def close(self):
+        pass
+
+
+def parse_timestamp_param(value):
+    if not value:
+        return None
+    seconds, _, nanos = value.partition('.')
+    return int(seconds), int(nanos or 0)
+
+
+class LogPagingTests(TestCase):
+    """Paging backwards through a container log with the cursor of each page's end record."""
+
+    def setUp(self):
+        start = datetime(2024, 5, 1, 10, 0, tzinfo=dt_timezone.utc)
+        # 250 lines over ~10 minutes, three lines per timestamp so page
+        # boundaries fall between lines sharing a timestamp.
+        self.lines = [
+            ((start + timedelta(seconds=(i // 3) * 7, microseconds=250)).strftime('%Y-%m-%dT%H:%M:%S.%f000Z'), f'line {i}')
+            for i in range(250)
+        ]
+        self.daemon = RecordedLogDaemon(self.lines, (start - timedelta(seconds=1)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    def read_page(self, params):
+        stream = open_log_stream(self.daemon, 'c' * 64, LogQuery.from_params(params))
+        records = [json.loads(line) for line in b''.join(stream).splitlines()]
+        end = records.pop()
+        self.assertEqual(end['type'], 'end')
+        self.assertEqual(end['count'], len(records))
+        return [record['message'] for record in records], end['cursor']
+
+    def test_pages_backwards_through_whole_log(self):
+        messages, cursor = self.read_page({'tail': '40'})
+        pages = [messages]
+        while cursor:
+            messages, cursor = self.read_page({'tail': '40', 'cursor': cursor})
+            pages.append(messages)
+
+        self.assertEqual([len(page) for page in pages], [40] * 6 + [10])
+        self.assertEqual([m for page in reversed(pages) for m in page], [m for _, m in self.lines])
+
+    def test_until_without_cursor(self):
+        # Lines 99-101 share a timestamp, the next one is 7s later.
+        until = parse_timestamp(self.lines[99][0])[0] + 1
+        messages, cursor = self.read_page({'tail': '20', 'until': str(until)})
+        self.assertEqual(messages, [m for _, m in self.lines[82:102]])
+        self.assertIsNotNone(cursor)
+
+    def test_window_respects_since(self):
+        since = parse_timestamp(self.lines[30][0])[0]
+        until = parse_timestamp(self.lines[59][0])[0] + 1
+        messages, _ = self.read_page({'tail': '100', 'since': str(since), 'until': str(until)})
+        self.assertEqual(messages, [m for _, m in self.lines[30:60]])
+        # Never asked the daemon for anything before `since`.
+        self.assertTrue(all(parse_timestamp_param(r.get('since')) >= (since, 0) for r in self.daemon.requests))
+
+
+
+def socket_path(path, user=None):
+    """`path` with the access token of `user`, as the frontend opens sockets."""
+    if user is None:
+        return path
+    return path + '?token=' + get_tokens_for_user(user)['access']
+
+
+class WebSocketAuthTests(TestCase):
+    """Sockets authenticated with the access token in the `token` query parameter."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_groups()
+        cls.owner = CustomUser.objects.create_user('owner', password='x')
+        cls.owner.groups.add(Group.objects.get(name='developer'))
+        host = DockerHost.objects.create(owner=cls.owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375')
+        cls.containers = [
+            ContainerRecord.objects.create(
+                container_id=letter * 64, name=f'web-{letter}', image='nginx', created_at=timezone.now(),
+                host=host, created_by=cls.owner,
+            )
+            for letter in 'ab'
+        ]
+
+    def merge(self, user):
+        path = socket_path('/ws/socket-server/', user)
+
+        async def run():
+            socket = WebsocketCommunicator(application, path)
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            await socket.receive_json_from()
+            await socket.send_json_to({'containers': [c.container_id for c in self.containers], 'tail': 2})
+            frames = []
+            while not frames or frames[-1]['type'] not in ('end', 'error'):
+                frames.append(await socket.receive_json_from(timeout=5))
+            await socket.disconnect()
+            return frames
+
+        start = datetime(2024, 5, 1, 10, 0, tzinfo=dt_timezone.utc)
+        lines = [((start + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%S.%f000Z'), f'line {i}') for i in range(3)]
+        daemon = RecordedLogDaemon(lines, start.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        with mock.patch('api.log_merge.get_client', return_value=daemon):
+            return async_to_sync(run)()
+
+    def test_merge_with_token(self):
+        frames = self.merge(self.owner)
+        self.assertEqual(frames[-1]['type'], 'end')
+        lines = [line for frame in frames if frame['type'] == 'logs' for line in frame['lines']]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual({line['container'] for line in lines}, {'web-a', 'web-b'})
+
+    def test_merge_without_token(self):
+        self.assertEqual(self.merge(None), [{'type': 'error', 'message': 'Authentication required to merge logs'}])
+
+    def test_invalid_token(self):
+        async def run():
+            socket = WebsocketCommunicator(application, '/ws/socket-server/?token=invalid')
+            await socket.connect()
+            await socket.receive_json_from()
+            await socket.send_json_to({'containers': [self.containers[0].container_id]})
+            frame = await socket.receive_json_from(timeout=5)
+            await socket.disconnect()
+            return frame
+
+        self.assertEqual(async_to_sync(run)()['message'], 'Authentication required to merge logs')
+
+
+
+class JobSocketTests(TestCase):
+    """ws/jobs/<job_id>/ is limited to the job's creator and admins, like GET jobs/<job_id>/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_groups()
+        cls.creator = CustomUser.objects.create_user('creator', password='x')
+        cls.creator.groups.add(Group.objects.get(name='developer'))
+        cls.other = CustomUser.objects.create_user('other', password='x')
+        cls.other.groups.add(Group.objects.get(name='developer'))
+        cls.admin = CustomUser.objects.create_user('admin', password='x')
+        cls.admin.groups.add(Group.objects.get(name='admin'))
+        cls.job = Job.objects.create(
+            kind='container.create', status='succeeded', result={'container_id': 'c' * 64}, created_by=cls.creator,
+        )
+
+    def follow(self, user):
+        path = socket_path(f'/ws/jobs/{self.job.pk}/', user)
+
+        async def run():
+            socket = WebsocketCommunicator(application, path)
+            await socket.connect()
+            frame = await socket.receive_json_from(timeout=5)
+            await socket.disconnect()
+            return frame
+
+        return async_to_sync(run)()
+
+    def test_creator(self):
+        frame = self.follow(self.creator)
+        self.assertEqual((frame['type'], frame['result']), ('job', {'container_id': 'c' * 64}))
+
+    def test_admin(self):
+        self.assertEqual(self.follow(self.admin)['type'], 'job')
+
+    def test_other_user(self):
+        self.assertEqual(self.follow(self.other), {'type': 'error', 'message': 'Job not found'})
+
+    def test_anonymous(self):
+        self.assertEqual(self.follow(None), {'type': 'error', 'message': 'Job not found'})
+
+
+
+class ImagePullSocketTests(TestCase):
+    """ws/images/pulls/<pull_id>/ is limited to the host owner, admins and the requester."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_groups()
+        cls.owner = CustomUser.objects.create_user('owner', password='x')
+        cls.requester = CustomUser.objects.create_user('requester', password='x')
+        cls.other = CustomUser.objects.create_user('other', password='x')
+        for user in (cls.owner, cls.requester, cls.other):
+            user.groups.add(Group.objects.get(name='developer'))
+        host = DockerHost.objects.create(owner=cls.owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375')
+        cls.pull = ImagePull.objects.create(host=host, reference='nginx:latest', status='succeeded', requested_by=cls.requester)
+
+    def follow(self, user):
+        path = socket_path(f'/ws/images/pulls/{self.pull.pk}/', user)
+
+        async def run():
+            socket = WebsocketCommunicator(application, path)
+            await socket.connect()
+            frame = await socket.receive_json_from(timeout=5)
+            await socket.disconnect()
+            return frame
+
+        return async_to_sync(run)()
+
+    def test_owner_and_requester(self):
+        self.assertEqual(self.follow(self.owner)['status'], 'succeeded')
+        self.assertEqual(self.follow(self.requester)['status'], 'succeeded')
+
+    def test_other_user(self):
+        self.assertEqual(self.follow(self.other), {'type': 'error', 'message': 'Pull not found'})
+        self.assertEqual(self.follow(None), {'type': 'error', 'message': 'Pull not found'})
+
+
+
+class ImagePullFinishTests(TestCase):
+    """The pulling thread records the outcome only while the pull is still running."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', password='x')
+        cls.host = DockerHost.objects.create(owner=owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375')
+
+    def run_pull(self, pull, abandoned=False):
+        def events(*args, **kwargs):
+            yield {'status': 'Pulling fs layer', 'id': 'layer'}
+            if abandoned:
+                ImagePull.objects.filter(pk=pull.pk).update(status='failed', error='Pull abandoned: no progress reported.')
+            yield {'status': 'Pull complete', 'id': 'layer'}
+
+        client = mock.Mock()
+        client.api.pull.side_effect = events
+        client.api.inspect_image.return_value = {'Id': 'sha256:' + 'd' * 64, 'Size': 1000}
+        with mock.patch('api.image_pulls.get_client', return_value=client):
+            _run_pull(pull.pk)
+        pull.refresh_from_db()
+        return pull
+
+    def test_succeeds(self):
+        pull = self.run_pull(ImagePull.objects.create(host=self.host, reference='nginx:latest'))
+        self.assertEqual(pull.status, 'succeeded')
+        self.assertIsNotNone(pull.image)
+
+    def test_keeps_abandoned_status(self):
+        pull = self.run_pull(ImagePull.objects.create(host=self.host, reference='nginx:latest'), abandoned=True)
+        self.assertEqual((pull.status, pull.error), ('failed', 'Pull abandoned: no progress reported.'))
+
+
+
+class StatsSocketTests(TestCase):
+    """A stats subscription goes away with its upstream, so the container can be subscribed again."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', password='x')
+        host = DockerHost.objects.create(owner=owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375')
+        cls.container = ContainerRecord.objects.create(
+            container_id='c' * 64, name='web', image='nginx', created_at=timezone.now(), host=host, created_by=owner,
+        )
+
+    def test_resubscribe_after_upstream_ends(self):
+        client = mock.Mock()
+        # Each upstream gets one sample, then the daemon ends the stream.
+        client.containers.get.return_value.stats.side_effect = lambda **kwargs: iter([dict(STATS_CGROUP_V1)])
+        container_id = self.container.container_id
+
+        async def run():
+            socket = WebsocketCommunicator(StatsConsumer.as_asgi(), '/ws/stats/')
+            await socket.connect()
+            await socket.receive_json_from()
+            frames = []
+            for _ in range(2):
+                await socket.send_json_to({'container_id': container_id})
+                frames.append((await socket.receive_json_from(timeout=5))['type'])
+                frames.append(await socket.receive_json_from(timeout=5))
+            await socket.disconnect()
+            return frames
+
+        with mock.patch('api.stats_hub.get_client', return_value=client):
+            frames = async_to_sync(run)()
+        ended = {'type': 'ended', 'container_id': container_id}
+        self.assertEqual(frames, ['stats', ended, 'stats', ended])
+        self.assertEqual(client.containers.get.return_value.stats.call_count, 2)
+
+
+
+class EventApplyRetryTests(SimpleTestCase):
+    """A batch of Docker events that fails to apply is retried, not dropped."""
+
+    def test_failed_batch_is_retried(self):
+        host = mock.Mock(id='h', pk='h')
+        subscriber = HostEventSubscriber(host, batch_window=0.01, reconnect_delay=0.01)
+        applied = []
+
+        def apply(host, batch):
+            applied.append(dict(batch.container_status))
+            if len(applied) == 1:
+                # Arrives while the first attempt fails.
+                subscriber._queue.put({'Type': 'container', 'Action': 'start', 'Actor': {'ID': 'b' * 64}, 'timeNano': 2})
+                raise ConnectionError('database went away')
+            subscriber.stop()
+            return []
+
+        subscriber._queue.put({'Type': 'container', 'Action': 'die', 'Actor': {'ID': 'a' * 64}, 'timeNano': 1})
+        with mock.patch('api.events.apply_event_batch', side_effect=apply), \
+                mock.patch('api.events.publish_host_changes'), mock.patch('api.events.close_old_connections'):
+            subscriber._apply_loop()
+
+        self.assertEqual(len(applied), 2)
+        self.assertEqual(applied[1], {'a' * 64: ('exited', 'Exited'), 'b' * 64: ('running', 'Up')})
+
+
+
+class CircuitBreakerTests(TestCase):
+    """closed -> open -> half_open per host, call budgets, and the 503 for an open circuit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_groups()
+        cls.admin = CustomUser.objects.create_user('admin', password='x')
+        cls.admin.groups.add(Group.objects.get(name='admin'))
+        cls.host = DockerHost.objects.create(
+            owner=cls.admin, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375',
+        )
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('api.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logger = mock.patch('api.circuit_breaker.logger')
+        logger.start()
+        self.addCleanup(logger.stop)
+        self.breaker = CircuitBreaker(self.host.pk, failure_threshold=2, reset_timeout=30)
+
+    def open_circuit(self):
+        for _ in range(2):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(DockerHost.objects.get(pk=self.host.pk).circuit_state, 'open')
+
+        self.now += 10
+        with self.assertRaises(HostUnavailable) as raised:
+            self.breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 20)
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_probe(self):
+        self.open_circuit()
+        self.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, 'half_open')
+        # One probe at a time.
+        with self.assertRaises(HostUnavailable):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(DockerHost.objects.get(pk=self.host.pk).circuit_state, 'closed')
+
+    def test_failed_probe_reopens(self):
+        self.open_circuit()
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.snapshot(), {'state': 'open', 'failures': 3, 'retry_after': 30})
+
+    def test_released_probe(self):
+        self.open_circuit()
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.release()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, 'half_open')
+
+    def test_call_budget(self):
+        self.assertEqual(request_timeout(60, False), (3, 60))
+        with call_budget(5):
+            self.assertEqual(request_timeout(60, False), (3, 5))
+            self.assertEqual(request_timeout((10, 2), False), (3, 2))
+            # Streams keep their read timeout; the budget is for request/response calls.
+            self.assertEqual(request_timeout(None, True), (3, None))
+            # Budgets belong to the thread (context) that set them.
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                self.assertEqual(pool.submit(request_timeout, 60, False).result(), (3, 60))
+            self.now += 4
+            self.assertEqual(request_timeout(60, False), (1, 1))
+            self.now += 1
+            with self.assertRaises(BudgetExceeded):
+                request_timeout(60, False)
+        self.assertEqual(request_timeout(60, False), (3, 60))
+
+    def test_open_circuit_is_503(self):
+        container = ContainerRecord.objects.create(
+            container_id='c' * 64, name='web', image='nginx', created_at=timezone.now(), host=self.host, created_by=self.admin,
+        )
+        self.addCleanup(docker_clients.invalidate, self.host.pk)
+        docker_clients._breakers[self.host.pk] = self.breaker
+        self.open_circuit()
+
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        response = client.post(f'/api/{self.host.pk}/{container.container_id}/start/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertEqual(response.json()['host_id'], str(self.host.pk))
+
+
+
+class DockerClientRegistryTests(SimpleTestCase):
+    """One cached client per host, rebuilt when its connection changes and kept while a stream holds it."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('api.docker_clients.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = DockerClientRegistry(idle_timeout=300)
+        build = mock.patch.object(self.registry, '_build', side_effect=lambda host: mock.Mock(name=host.docker_api_url))
+        build.start()
+        self.addCleanup(build.stop)
+
+    def host(self, name='h1', url='tcp://10.0.0.1:2375'):
+        return SimpleNamespace(id=name, docker_api_url=url)
+
+    def test_reuses_client(self):
+        client = self.registry.get(self.host())
+        self.assertIs(self.registry.get(self.host()), client)
+        self.assertIsNot(self.registry.get(self.host('h2')), client)
+        stats = self.registry.stats()
+        self.assertEqual((stats['created'], stats['reused']), (2, 1))
+
+    def test_connection_change_rebuilds(self):
+        client = self.registry.get(self.host())
+        rebuilt = self.registry.get(self.host(url='tcp://10.0.0.2:2375'))
+        self.assertIsNot(rebuilt, client)
+        client.close.assert_called_once()
+        self.assertEqual(self.registry.stats()['invalidated'], 1)
+
+    def test_evicts_idle_clients(self):
+        idle = self.registry.get(self.host('h1'))
+        self.now += 200
+        busy = self.registry.get(self.host('h2'))
+        self.now += 150
+        self.assertEqual(self.registry.evict_idle(), 1)
+        idle.close.assert_called_once()
+        busy.close.assert_not_called()
+        self.assertIsNot(self.registry.get(self.host('h1')), idle)
+
+    def test_held_client_is_not_evicted(self):
+        client = self.registry.get(self.host())
+        release = self.registry.hold(client)
+        self.now += 1000
+        self.assertEqual(self.registry.evict_idle(), 0)
+        self.assertEqual(self.registry.stats()['hosts']['h1']['holds'], 1)
+
+        release()
+        release()  # Releasing twice counts once.
+        self.assertEqual(self.registry.stats()['hosts']['h1']['holds'], 0)
+        # Idle time counts from the release.
+        self.assertEqual(self.registry.evict_idle(), 0)
+        self.now += 301
+        self.assertEqual(self.registry.evict_idle(), 1)
+        client.close.assert_called_once()
+
+    def test_hold_of_unknown_client(self):
+        self.registry.hold(mock.Mock())()
+        self.assertEqual(self.registry.stats()['clients'], 0)
+
+    def test_held_stream_releases_when_done(self):
+        client = self.registry.get(self.host())
+        with mock.patch('api.docker_clients.registry', self.registry):
+            stream = HeldStream(client, iter([b'a', b'b']))
+            self.assertEqual(self.registry.stats()['hosts']['h1']['holds'], 1)
+            self.assertEqual(list(stream), [b'a', b'b'])
+        self.assertEqual(self.registry.stats()['hosts']['h1']['holds'], 0)
+
+
+
+class BulkActionTests(SimpleTestCase):
+    """Bulk actions stay within the overall and per-host caps and report each container."""
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = defaultdict(int)
+        self.peaks = defaultdict(int)
+        self.started = []
+        self.budgets = []
+
+    def container(self, host_id, i, name='web'):
+        return SimpleNamespace(pk=f'{host_id}{i}', host_id=host_id, container_id=f'{host_id}{i}', name=name, status='exited')
+
+    def run_action(self, container, action, timeout):
+        with self.lock:
+            self.started.append(container.host_id)
+            self.budgets.append(request_timeout(60, False)[1])
+            self.running[container.host_id] += 1
+            self.running['all'] += 1
+            for key in (container.host_id, 'all'):
+                self.peaks[key] = max(self.peaks[key], self.running[key])
+        time.sleep(0.01)
+        with self.lock:
+            self.running[container.host_id] -= 1
+            self.running['all'] -= 1
+        if container.name == 'broken':
+            raise docker.errors.APIError('No such image')
+
+    def run_bulk(self, containers, **kwargs):
+        with mock.patch('api.bulk._run_action', side_effect=self.run_action), \
+                mock.patch.object(BulkAction, '_save') as save:
+            results = BulkAction('start', containers, **kwargs).run()
+        return results, save
+
+    def test_caps(self):
+        containers = (
+            [self.container('a', i) for i in range(20)]
+            + [self.container('b', i) for i in range(5)]
+            + [self.container('c', 0)]
+        )
+        results, _ = self.run_bulk(containers, max_workers=4, per_host=2)
+        self.assertEqual([r['container_id'] for r in results], [c.container_id for c in containers])
+        self.assertTrue(all(r['ok'] for r in results))
+        self.assertEqual(self.peaks['a'], 2)
+        self.assertLessEqual(self.peaks['b'], 2)
+        self.assertLessEqual(self.peaks['all'], 4)
+        # Round-robin: the host with one container does not wait behind the big one.
+        self.assertEqual(self.started[:3], ['a', 'b', 'c'])
+
+    def test_failures_are_reported_per_container(self):
+        containers = [self.container('a', 0), self.container('a', 1, name='broken')]
+        results, save = self.run_bulk(containers)
+        self.assertEqual([r['ok'] for r in results], [True, False])
+        self.assertIn('No such image', results[1]['error'])
+        save.assert_called_once_with([containers[0]])
+
+    def test_calls_share_the_callers_budget(self):
+        with call_budget(30):
+            self.run_bulk([self.container('a', i) for i in range(3)])
+        self.assertEqual(len(self.budgets), 3)
+        self.assertTrue(all(budget <= 30 for budget in self.budgets))
+
+
+
+class HostIndexTests(TestCase):
+    """Placement picks the least loaded host that fits, and sees its own reservations."""
+
+    def state(self, name, cpu_used=0.0, memory_used=0.0, labels='', ports=(), cpus=4, memory_mb=4096):
+        return HostState(name, 1, name, parse_host_labels(labels), cpus, memory_mb, cpu_used, memory_used, ports)
+
+    def index(self, *states):
+        index = HostIndex(ttl=60)
+        index.load(states)
+        return index
+
+    def test_least_loaded_first(self):
+        index = self.index(self.state('busy', cpu_used=3), self.state('idle', cpu_used=1), self.state('half', memory_used=2048))
+        self.assertEqual([s.name for s in index.ranking(PlacementRequest())], ['idle', 'half', 'busy'])
+        # Headroom is the smaller of free CPU and free memory.
+        self.assertEqual(index.ranking(PlacementRequest())[1].headroom(), 0.5)
+
+    def test_reservations_spread_placements(self):
+        index = self.index(self.state('a'), self.state('b', cpu_used=0.5))
+        placed = [index.place(PlacementRequest(cpus=1)).name for _ in range(3)]
+        self.assertEqual(placed, ['a', 'b', 'a'])
+        index.release('a', PlacementRequest(cpus=1))
+        self.assertEqual(index.states()[0].cpu_used, 1)
+
+    def test_fit(self):
+        index = self.index(self.state('small', cpus=1, memory_mb=512), self.state('large', cpu_used=3.5, cpus=8))
+        self.assertEqual(index.place(PlacementRequest(cpus=2), reserve=False).name, 'large')
+        self.assertEqual(index.place(PlacementRequest(memory_mb=1024), reserve=False).name, 'large')
+        self.assertIsNone(index.place(PlacementRequest(cpus=5)))
+
+    def test_ports(self):
+        index = self.index(self.state('a', ports={8080}), self.state('b', cpu_used=2))
+        self.assertEqual(index.place(PlacementRequest(ports={8080})).name, 'b')
+        self.assertIsNone(index.place(PlacementRequest(ports={8080})))
+
+    def test_label_constraints(self):
+        states = [self.state(f'plain-{i}') for i in range(20)]
+        states += [self.state('gpu-eu', cpu_used=3, labels='gpu, zone=eu'), self.state('gpu-us', cpu_used=2, labels='gpu,zone=us')]
+        index = self.index(*states)
+        self.assertEqual(index.place(PlacementRequest(constraints=['gpu']), reserve=False).name, 'gpu-us')
+        self.assertEqual(index.place(PlacementRequest(constraints='gpu,zone=eu'), reserve=False).name, 'gpu-eu')
+        self.assertIsNone(index.place(PlacementRequest(constraints=['zone=ap'])))
+        self.assertEqual(index.place(PlacementRequest(), allowed=lambda s: s.name == 'gpu-eu').name, 'gpu-eu')
+
+    def test_usage_from_stats_then_requests(self):
+        owner = CustomUser.objects.create_user('owner', password='x')
+        host = DockerHost.objects.create(
+            owner=owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375',
+            status='active', total_cpu_cores=4, total_memory_mb=4096,
+        )
+        measured, requested, default = (
+            ContainerRecord.objects.create(
+                container_id=letter * 64, name=letter, image='nginx', created_at=timezone.now(), host=host,
+                created_by=owner, status='running', cpu_request=cpu, memory_request_mb=memory,
+                port_bindings={'80/tcp': [{'HostPort': port}]} if port else None,
+            )
+            for letter, cpu, memory, port in (('a', 2, 2048, '8080'), ('b', 0.5, 256, None), ('c', None, None, None))
+        )
+        ContainerStatsPoint.objects.create(container=measured, at=timezone.now(), cpu_percent=25.0, memory_usage_mb=100.0)
+
+        index = HostIndex()
+        index.refresh()
+        state, = index.states()
+        self.assertAlmostEqual(state.cpu_used, 0.25 + 0.5 + 0.1)
+        self.assertAlmostEqual(state.memory_used, 100 + 256 + 128)
+        self.assertEqual(state.ports, {8080})
+
+
+class ExecSessionTests(TestCase):
+    """Terminal session limits, reuse of a session not attached anywhere, and the orphan sweep."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', password='x')
+        cls.other = CustomUser.objects.create_user('other', password='x')
+        host = DockerHost.objects.create(
+            owner=cls.owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375',
+        )
+        cls.first, cls.second = (
+            ContainerRecord.objects.create(
+                container_id=letter * 64, name=letter, image='nginx', created_at=timezone.now(), host=host,
+                created_by=cls.owner, status='running',
+            )
+            for letter in 'ab'
+        )
+
+    def setUp(self):
+        self.api = mock.Mock()
+        self.api.exec_create.side_effect = lambda **kwargs: {'Id': uuid.uuid4().hex}
+        self.api.exec_inspect.return_value = {'Running': False, 'ExitCode': 0}
+        patcher = mock.patch('api.exec_sessions.get_client', return_value=SimpleNamespace(api=self.api))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_open_creates_an_exec_with_the_session_marker(self):
+        session, reattached = open_session(self.first, self.owner)
+        self.assertFalse(reattached)
+        kwargs = self.api.exec_create.call_args.kwargs
+        self.assertEqual(kwargs['container'], self.first.container_id)
+        self.assertEqual(kwargs['environment'], {SESSION_ENV: str(session.id)})
+        self.assertEqual(ExecSession.objects.get(pk=session.pk).exec_id, session.exec_id)
+
+    def test_reuses_detached_before_created(self):
+        created, _ = open_session(self.first, self.owner, new=True)
+        detached, _ = open_session(self.first, self.owner, new=True)
+        ExecSession.objects.filter(pk=detached.pk).update(status='detached')
+        ExecSession.objects.create(container=self.first, user=self.owner, status='attached', exec_id='attached')
+
+        session, reattached = open_session(self.first, self.owner)
+        self.assertTrue(reattached)
+        self.assertEqual(session.pk, detached.pk)
+        ExecSession.objects.filter(pk=detached.pk).update(status='closed')
+        self.assertEqual(open_session(self.first, self.owner)[0].pk, created.pk)
+        # Another user's shell is never handed out.
+        self.assertFalse(open_session(self.first, self.other)[1])
+        self.assertEqual(self.api.exec_create.call_count, 3)
+
+    def test_failed_create_releases_the_slot(self):
+        self.api.exec_create.side_effect = docker.errors.APIError('container is not running')
+        with self.assertRaises(docker.errors.APIError):
+            open_session(self.first, self.owner)
+        self.assertFalse(ExecSession.objects.exists())
+
+    @override_settings(EXEC_MAX_PER_CONTAINER=2, EXEC_MAX_PER_USER=3)
+    def test_session_limits(self):
+        open_session(self.first, self.owner, new=True)
+        open_session(self.first, self.other, new=True)
+        with self.assertRaises(OperationError) as raised:
+            open_session(self.first, self.owner, new=True)
+        self.assertEqual(raised.exception.status, 429)
+        self.assertIn('per container', str(raised.exception))
+
+        open_session(self.second, self.owner, new=True)
+        open_session(self.second, self.owner, new=True)
+        with self.assertRaises(OperationError) as raised:
+            open_session(ContainerRecord.objects.create(
+                container_id='c' * 64, name='c', image='nginx', created_at=timezone.now(),
+                host=self.first.host, created_by=self.owner,
+            ), self.owner, new=True)
+        self.assertIn('per user', str(raised.exception))
+
+        # Closed sessions do not count.
+        ExecSession.objects.filter(container=self.first, user=self.other).update(status='closed')
+        open_session(self.first, self.other, new=True)
+
+    def test_sweep_closes_orphans(self):
+        now = timezone.now()
+        old = now - timedelta(minutes=10)
+
+        def session(status, heartbeat_at=None, created_at=now):
+            row = ExecSession.objects.create(
+                container=self.first, user=self.owner, status=status, exec_id=uuid.uuid4().hex,
+                heartbeat_at=heartbeat_at,
+            )
+            ExecSession.objects.filter(pk=row.pk).update(created_at=created_at)
+            return row.pk
+
+        stale = session('detached', heartbeat_at=old)
+        never_attached = session('created', created_at=old)
+        fresh = session('attached', heartbeat_at=now)
+        just_created = session('created')
+        held_here = session('attached', heartbeat_at=old)
+
+        reaped = _sweep({held_here: now}, now - timedelta(minutes=1), now - timedelta(minutes=2))
+
+        self.assertEqual(reaped, 2)
+        statuses = dict(ExecSession.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[stale], 'closed')
+        self.assertEqual(statuses[never_attached], 'closed')
+        self.assertEqual(statuses[fresh], 'attached')
+        self.assertEqual(statuses[just_created], 'created')
+        self.assertEqual(statuses[held_here], 'attached')
+        self.assertGreater(ExecSession.objects.get(pk=held_here).heartbeat_at, old)
+        self.assertEqual(ExecSession.objects.get(pk=stale).close_reason, 'abandoned')
+
+    def test_sweep_stops_running_shells(self):
+        self.api.exec_inspect.side_effect = [{'Running': True}, {'Running': False, 'ExitCode': 129}]
+        row = ExecSession.objects.create(
+            container=self.first, user=self.owner, status='detached', exec_id='e' * 64,
+            heartbeat_at=timezone.now() - timedelta(minutes=10),
+        )
+
+        self.assertEqual(_sweep({}, timezone.now(), timezone.now()), 1)
+
+        kill = self.api.exec_create.call_args.kwargs
+        self.assertEqual(kill['cmd'][-1], f'{SESSION_ENV}={row.id}')
+        self.api.exec_start.assert_called_once()
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.exit_code), ('closed', 129))
+
+    def test_sweep_closes_sessions_of_unreachable_hosts(self):
+        self.api.exec_inspect.side_effect = HostUnavailable(self.first.host_id, 30)
+        row = ExecSession.objects.create(
+            container=self.first, user=self.owner, status='created', exec_id='e' * 64,
+        )
+        ExecSession.objects.filter(pk=row.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(_sweep({}, timezone.now(), timezone.now()), 1)
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.exit_code), ('closed', None))
+
+
+# Stats samples recorded from `GET /containers/{id}/stats` (API 1.43),
+# trimmed to the fields the normalizer reads plus a few neighbours.
+STATS_CGROUP_V1 = {
+    'read': '2024-05-01T10:00:01.500000000Z',
+    'preread': '2024-05-01T10:00:00.500000000Z',
+    'pids_stats': {'current': 3},
+    'blkio_stats': {
+        'io_service_bytes_recursive': [
+            {'major': 8, 'minor': 0, 'op': 'Read', 'value': 4194304},
+            {'major': 8, 'minor': 0, 'op': 'Write', 'value': 1048576},
+            {'major': 8, 'minor': 0, 'op': 'Sync', 'value': 5242880},
+            {'major': 8, 'minor': 0, 'op': 'Async', 'value': 0},
+            {'major': 8, 'minor': 0, 'op': 'Discard', 'value': 0},
+            {'major': 8, 'minor': 0, 'op': 'Total', 'value': 5242880},
+        ],
+        'io_serviced_recursive': [],
+        'sectors_recursive': [],
+    },
+    'cpu_stats': {
+        'cpu_usage': {
+            'total_usage': 2400000000,
+            'percpu_usage': [700000000, 500000000, 600000000, 600000000],
+            'usage_in_kernelmode': 300000000,
+            'usage_in_usermode': 1900000000,
+        },
+        'system_cpu_usage': 1000004000000000,
+        'online_cpus': 4,
+        'throttling_data': {'periods': 0, 'throttled_periods': 0, 'throttled_time': 0},
+    },
+    'precpu_stats': {
+        'cpu_usage': {
+            'total_usage': 2000000000,
+            'percpu_usage': [600000000, 400000000, 500000000, 500000000],
+            'usage_in_kernelmode': 250000000,
+            'usage_in_usermode': 1600000000,
+        },
+        'system_cpu_usage': 1000000000000000,
+        'online_cpus': 4,
+        'throttling_data': {'periods': 0, 'throttled_periods': 0, 'throttled_time': 0},
+    },
+    'memory_stats': {
+        'usage': 104857600,
+        'max_usage': 125829120,
+        'stats': {
+            'active_anon': 62914560, 'active_file': 10485760, 'cache': 31457280,
+            'inactive_anon': 0, 'inactive_file': 20971520, 'mapped_file': 4194304,
+            'rss': 62914560, 'total_cache': 31457280, 'total_inactive_file': 20971520,
+            'total_rss': 62914560, 'hierarchical_memory_limit': 2147483648,
+        },
+        'failcnt': 0,
+        'limit': 2147483648,
+    },
+    'name': '/web',
+    'id': '3f2a9c1d7e5b4a6f8c0d2e4f6a8b0c1d3e5f7a9b1c3d5e7f9a1b3c5d7e9f1a3b',
+    'networks': {
+        'eth0': {
+            'rx_bytes': 1048576, 'rx_packets': 900, 'rx_errors': 0, 'rx_dropped': 0,
+            'tx_bytes': 524288, 'tx_packets': 600, 'tx_errors': 0, 'tx_dropped': 0,
+        },
+    },
+}
+
+STATS_CGROUP_V2 = {
+    'read': '2024-05-01T10:00:01.000000000Z',
+    'preread': '2024-05-01T10:00:00.000000000Z',
+    'pids_stats': {'current': 7, 'limit': 18446744073709551615},
+    'blkio_stats': {
+        'io_service_bytes_recursive': [
+            {'major': 259, 'minor': 0, 'op': 'read', 'value': 8388608},
+            {'major': 259, 'minor': 0, 'op': 'write', 'value': 2097152},
+        ],
+        'io_serviced_recursive': None,
+        'sectors_recursive': None,
+    },
+    'cpu_stats': {
+        'cpu_usage': {'total_usage': 150000000, 'usage_in_kernelmode': 40000000, 'usage_in_usermode': 110000000},
+        'system_cpu_usage': 2000001000000000,
+        'online_cpus': 2,
+        'throttling_data': {'periods': 0, 'throttled_periods': 0, 'throttled_time': 0},
+    },
+    'precpu_stats': {
+        'cpu_usage': {'total_usage': 100000000, 'usage_in_kernelmode': 30000000, 'usage_in_usermode': 70000000},
+        'system_cpu_usage': 2000000000000000,
+        'online_cpus': 2,
+        'throttling_data': {'periods': 0, 'throttled_periods': 0, 'throttled_time': 0},
+    },
+    'memory_stats': {
+        'usage': 52428800,
+        'stats': {
+            'active_anon': 0, 'active_file': 5242880, 'anon': 31457280, 'file': 20971520,
+            'inactive_anon': 31457280, 'inactive_file': 10485760, 'kernel_stack': 65536,
+            'shmem': 0, 'slab': 1048576, 'sock': 0,
+        },
+        'limit': 8589934592,
+    },
+    'name': '/worker',
+    'id': '9b8a7c6d5e4f3a2b1c0d9e8f7a6b5c4d3e2f1a0b9c8d7e6f5a4b3c2d1e0f9a8b',
+    'networks': {
+        'eth0': {
+            'rx_bytes': 20000, 'rx_packets': 40, 'rx_errors': 0, 'rx_dropped': 0,
+            'tx_bytes': 10000, 'tx_packets': 30, 'tx_errors': 0, 'tx_dropped': 0,
+        },
+        'eth1': {
+            'rx_bytes': 5000, 'rx_packets': 10, 'rx_errors': 0, 'rx_dropped': 0,
+            'tx_bytes': 8000, 'tx_packets': 12, 'tx_errors': 0, 'tx_dropped': 0,
+        },
+    },
+}
+
+
+def later_sample(sample, seconds, **changes):
+    """A copy of `sample` read `seconds` later, with counters advanced as in `changes`."""
+    sample = copy.deepcopy(sample)
+    base, _, fraction = sample['read'].rstrip('Z').partition('.')
+    read = datetime.fromisoformat(base) + timedelta(seconds=seconds)
+    sample['read'] = f"{read.isoformat()}.{fraction}Z"
+    for name, (rx, tx) in changes.get('networks', {}).items():
+        sample['networks'][name]['rx_bytes'] += rx
+        sample['networks'][name]['tx_bytes'] += tx
+    for entry in sample['blkio_stats']['io_service_bytes_recursive']:
+        entry['value'] += changes.get('block', {}).get(entry['op'].lower(), 0)
+    return sample
+
+
+class StatsNormalizerTests(SimpleTestCase):
+
+    def test_cgroup_v1(self):
+        stats = normalize_stats(STATS_CGROUP_V1)
+        self.assertEqual(stats['container_id'], '3f2a9c1d7e5b')
+        self.assertEqual(stats['name'], 'web')
+        # 0.4s of CPU over 4s of host time on 4 CPUs.
+        self.assertEqual(stats['cpu_percent'], 40.0)
+        self.assertEqual(stats['cpu_total_time_sec'], 2.2)
+        # total_inactive_file is reclaimable and left out of the working set.
+        self.assertEqual(stats['memory_cache_mb'], 20.0)
+        self.assertEqual(stats['memory_usage_mb'], 80.0)
+        self.assertEqual(stats['memory_limit_mb'], 2048.0)
+        self.assertEqual(stats['memory_percent'], 3.91)
+        self.assertEqual(stats['pids'], 3)
+        # Sync/Async/Total repeat Read and Write and are not added again.
+        self.assertEqual((stats['block_read_mb'], stats['block_write_mb']), (4.0, 1.0))
+
+    def test_cgroup_v2(self):
+        stats = normalize_stats(STATS_CGROUP_V2)
+        self.assertEqual(stats['cpu_percent'], 10.0)
+        self.assertEqual(stats['memory_cache_mb'], 10.0)
+        self.assertEqual(stats['memory_usage_mb'], 40.0)
+        self.assertEqual(stats['memory_percent'], 0.49)
+        self.assertEqual((stats['block_read_mb'], stats['block_write_mb']), (8.0, 2.0))
+
+    def test_multiple_network_interfaces(self):
+        normalizer = StatsNormalizer()
+        first = normalizer.normalize(STATS_CGROUP_V2)
+        self.assertEqual(set(first['networks']), {'eth0', 'eth1'})
+        self.assertIsNone(first['network_rx_bytes_per_sec'])
+        self.assertIsNone(first['networks']['eth1']['tx_bytes_per_sec'])
+
+        second = normalizer.normalize(later_sample(
+            STATS_CGROUP_V2, 2, networks={'eth0': (2048, 0), 'eth1': (0, 4096)}, block={'write': 1024 * 1024},
+        ))
+        self.assertEqual(second['networks']['eth0']['rx_bytes_per_sec'], 1024.0)
+        self.assertEqual(second['networks']['eth0']['tx_bytes_per_sec'], 0.0)
+        self.assertEqual(second['networks']['eth1']['tx_bytes_per_sec'], 2048.0)
+        self.assertEqual(second['network_rx_bytes_per_sec'], 1024.0)
+        self.assertEqual(second['network_tx_bytes_per_sec'], 2048.0)
+        self.assertEqual(second['block_write_bytes_per_sec'], 524288.0)
+        self.assertEqual(second['block_read_bytes_per_sec'], 0.0)
+
+    def test_no_networks(self):
+        sample = copy.deepcopy(STATS_CGROUP_V2)
+        del sample['networks']  # --network none
+        stats = normalize_stats(sample)
+        self.assertEqual(stats['networks'], {})
+        self.assertEqual(stats['network_rx_mb'], 0.0)
+        self.assertIsNone(stats['network_rx_bytes_per_sec'])
+
+    def test_missing_precpu_stats(self):
+        # The first sample of a stream (or a one-shot read) has an empty
+        # precpu_stats; comparing with it would give a lifetime average.
+        sample = copy.deepcopy(STATS_CGROUP_V1)
+        sample['precpu_stats'] = {
+            'cpu_usage': {'total_usage': 0, 'usage_in_kernelmode': 0, 'usage_in_usermode': 0},
+            'throttling_data': {'periods': 0, 'throttled_periods': 0, 'throttled_time': 0},
+        }
+        self.assertEqual(normalize_stats(sample)['cpu_percent'], 0.0)
+        del sample['precpu_stats']
+        self.assertEqual(normalize_stats(sample)['cpu_percent'], 0.0)
+
+    def test_online_cpus_absent(self):
+        # Older daemons: the CPU count comes from percpu_usage (cgroup v1)...
+        sample = copy.deepcopy(STATS_CGROUP_V1)
+        del sample['cpu_stats']['online_cpus']
+        self.assertEqual(normalize_stats(sample)['cpu_percent'], 40.0)
+        # ...and without it either (cgroup v2) one CPU is assumed.
+        sample = copy.deepcopy(STATS_CGROUP_V2)
+        del sample['cpu_stats']['online_cpus']
+        self.assertEqual(normalize_stats(sample)['cpu_percent'], 5.0)
+
+
+class StatsHistoryTests(TestCase):
+    """History kept in the database by the recorder, with rollups and the open bucket."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', password='x')
+        host = DockerHost.objects.create(owner=owner, host_name='h', host_ip='127.0.0.1', docker_api_url='tcp://127.0.0.1:2375')
+        cls.container = ContainerRecord.objects.create(
+            container_id='c' * 64, name='web', image='nginx', created_at=timezone.now(), host=host, created_by=owner,
+        )
+
+    def setUp(self):
+        self.history = StatsHistory()
+        # 16 samples 10s apart from a minute boundary; cpu_percent is the sample's index.
+        self.t0 = (int(time.time()) // 60 - 5) * 60
+        self.history.record([
+            ContainerStatsPoint(
+                container=self.container, at=datetime.fromtimestamp(self.t0 + i * 10, tz=dt_timezone.utc),
+                cpu_percent=float(i), memory_usage_mb=100.0,
+            )
+            for i in range(16)
+        ])
+
+    def test_rollup_and_open_bucket(self):
+        closed_before = datetime.fromtimestamp(self.t0 + 155, tz=dt_timezone.utc)
+        self.assertEqual(self.history.rollup(closed_before), 2)
+        minutes = ContainerStatsPoint.objects.filter(resolution=60).order_by('at')
+        self.assertEqual([(p.samples, p.cpu_percent) for p in minutes], [(6, 2.5), (6, 8.5)])
+
+        result = self.history.query(self.container.container_id, self.t0, self.t0 + 155, 60)
+        self.assertEqual(result['resolution'], 60)
+        self.assertEqual(result['timestamps'], [self.t0, self.t0 + 60, self.t0 + 120])
+        # The third minute is not rolled up yet and comes from the samples.
+        self.assertEqual(result['series']['cpu_percent'], [2.5, 8.5, 13.5])
+
+        # Rolling up again only writes newly closed buckets.
+        self.assertEqual(self.history.rollup(closed_before), 0)
+
+    def test_hour_rollup_weighs_samples(self):
+        ContainerStatsPoint.objects.all().delete()
+        hour = (int(time.time()) // 3600 - 2) * 3600
+        self.history.record([
+            ContainerStatsPoint(
+                container=self.container, resolution=60, at=datetime.fromtimestamp(hour + i * 60, tz=dt_timezone.utc),
+                samples=samples, cpu_percent=cpu,
+            )
+            for i, (samples, cpu) in enumerate([(6, 10.0), (2, 50.0), (4, None)])
+        ])
+        self.assertEqual(self.history.rollup(), 1)
+        point = ContainerStatsPoint.objects.get(resolution=3600)
+        self.assertEqual((point.samples, point.cpu_percent), (12, 20.0))
+
+    def test_raw_query(self):
+        result = self.history.query(self.container.container_id, self.t0, self.t0 + 155, 20)
+        self.assertEqual(result['resolution'], 0)
+        self.assertEqual(len(result['timestamps']), 8)
+        self.assertEqual(result['series']['cpu_percent'][:2], [0.5, 2.5])
+
+    def test_recent(self):
+        self.assertEqual(self.history.recent(self.container.container_id, window=600)['cpu_percent'], 7.5)
+        self.assertEqual(self.history.recent_many(['unknown'], window=600), {})
+
+    def test_retention(self):
+        self.history.enforce_retention(now=datetime.fromtimestamp(self.t0 + 1800 + 75, tz=dt_timezone.utc))
+        self.assertEqual(ContainerStatsPoint.objects.filter(resolution=0).count(), 8)
+
+    def test_recorder_samples_without_viewers(self):
+        ContainerStatsPoint.objects.all().delete()
+        sample = dict(STATS_CGROUP_V1, id=self.container.container_id, read=timezone.now().strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+        client = mock.Mock()
+        client.api.stats.return_value = sample
+        with mock.patch('api.stats_history.get_client', return_value=client):
+            summary = StatsRecorder(store=self.history).sweep([self.container])
+        self.assertEqual(summary['recorded'], 1)
+        client.api.stats.assert_called_once_with(self.container.container_id, stream=False)
+        point = ContainerStatsPoint.objects.get()
+        self.assertEqual((point.cpu_percent, point.memory_usage_mb), (40.0, 80.0))
@@ -1,6 +1,6 @@
 from django.urls import path
-from .views import viewer_only_view, developer_only_view, admin_only_view, register_user, login_user, root_view, connect_to_host, start_container, stop_container, get_container_logs, get_container_details,create_host, create_container, get_container_stats, create_network, delete_network, connect_container_to_network, disconnect_container_from_network, host_detail_view, get_networks_by_host
-from .views import container_connected_networks, create_exec_session, get_volumes_by_host, create_volume, delete_volume, delete_container, get_container_volume_bindings, cleanup_container_networks, host_details, get_images_by_host, create_image, delete_image
+from .views import viewer_only_view, developer_only_view, admin_only_view, register_user, login_user, root_view, connect_to_host, start_container, stop_container, get_container_logs, search_container_logs, get_merged_logs, get_container_details,create_host, create_container, get_container_stats, get_container_stats_history, create_network, delete_network, connect_container_to_network, disconnect_container_from_network, host_detail_view, get_networks_by_host
+from .views import bulk_container_action, container_connected_networks, create_exec_session, get_volumes_by_host, create_volume, delete_volume, delete_container, get_container_volume_bindings, cleanup_container_networks, host_details, get_images_by_host, create_image, get_image_pull, delete_image, stats_hub_metrics, get_job, cancel_job, host_health, place_container, fleet_summary, list_exec_sessions, close_exec_session
 from .consumers import TerminalConsumer
 
 urlpatterns = [
@@ -10,12 +10,23 @@ urlpatterns = [
     path('register/', register_user, name='register'),
     path('login/', login_user, name='login'),
     path('', root_view, name='root'),
+    path('logs/merged/', get_merged_logs, name='merged-logs'),
+    path('fleet/summary/', fleet_summary, name='fleet-summary'),
+    path('containers/bulk/', bulk_container_action, name='bulk-container-action'),
+    path('containers/place/', place_container, name='place-container'),
+    path('jobs/<uuid:job_id>/', get_job, name='job'),
+    path('jobs/<uuid:job_id>/cancel/', cancel_job, name='cancel-job'),
+    path('exec-sessions/', list_exec_sessions, name='exec-sessions'),
+    path('exec-sessions/<uuid:session_id>/close/', close_exec_session, name='close-exec-session'),
     path('<uuid:host_id>/connect', connect_to_host, name='connect'),
     path('<uuid:host_id>/<str:container_id>/start/', start_container, name='start'),
     path('<uuid:host_id>/<str:container_id>/stop/', stop_container, name='stop'),
     path('<uuid:host_id>/<str:container_id>/logs/', get_container_logs, name='logs'),
+    path('<uuid:host_id>/<str:container_id>/logs/search/', search_container_logs, name='logs-search'),
     path('<uuid:host_id>/<str:container_id>/', get_container_details, name='details'),
     path('<uuid:host_id>/<str:container_id>/stats/', get_container_stats, name='stats'),
+    path('<uuid:host_id>/<str:container_id>/stats/history/', get_container_stats_history, name='stats-history'),
+    path('stats/hub/', stats_hub_metrics, name='stats-hub-metrics'),
     path('<uuid:host_id>/<str:container_id>/volumes/', get_container_volume_bindings, name='container-volume-bindings'),
     path('hosts/create/', create_host, name='create-host'),
     path('hosts/<uuid:host_id>/containers/', host_detail_view, name='view-containers'), 
@@ -33,7 +44,9 @@ urlpatterns = [
     path('hosts/<uuid:host_id>/volumes/create/', create_volume, name='create-volume'),
     path('volumes/<str:volume_id>/delete/', delete_volume, name='delete-volume'),
     path('hosts/<uuid:host_id>/details/', host_details, name='host-details'), 
+    path('hosts/<uuid:host_id>/health/', host_health, name='host-health'),
     path('hosts/<uuid:host_id>/images/', get_images_by_host, name='list-images-by-host'),
     path('hosts/<uuid:host_id>/images/create/', create_image, name='create-image'),
+    path('hosts/<uuid:host_id>/images/pulls/<uuid:pull_id>/', get_image_pull, name='image-pull'),
     path('hosts/<uuid:host_id>/images/<int:image_id>/delete/', delete_image, name='delete-image'),
 ]
\ No newline at end of file
@@ -2,19 +2,90 @@ import docker.errors
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, BasePermission
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import RoleClaimJWTAuthentication
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework import status
-from .serializers import UserRegistrationSerializer, UserLoginSerializer, CustomTokenObtainPairSerializer, ContainerRecordSerializer, DockerHostSerializer, NetworkSerializer, VolumeSerializer, ImageSerializer
-from .models import ContainerRecord, DockerHost, Network, Volume, Image
+from .serializers import UserRegistrationSerializer, UserLoginSerializer, CustomTokenObtainPairSerializer, ContainerRecordSerializer, ContainerRecordListSerializer, DockerHostSerializer, NetworkSerializer, VolumeSerializer, ImageSerializer
+from .models import ContainerRecord, DockerHost, ExecSession, HostPing, Network, Volume, Image, ImagePull, Job
+from .docker_clients import get_client
+from .stats_hub import hub as stats_hub
+from .stats_history import history as stats_history
+from .logs import LogQuery, decode_cursor, parse_query_time
+from .log_archive import archive_container, container_directory, format_timestamp, read_meta, search_archive
+from .log_merge import filter_by_labels, merged_ndjson
+from .streams import DockerStreamReader
+from .pagination import list_page
+from .circuit_breaker import HostUnavailable, docker_budget
+from .bulk import BulkAction, can_manage
+from .image_pulls import image_reference, serialize_pull, start_pull
+from .jobs import cancel as cancel_job_run, enqueue, serialize_job
+from .operations import ImagePullPending, OperationError, check_host_connection, find_stale_networks, provision_container, remove_volume
+from .placement import PlacementRequest, host_index
+from .fleet import summarize, with_counts
+from .inventory import conditional_response
+from .exec_sessions import close_session, open_session, serialize_session, session_counts, manager as exec_session_manager
 from django.contrib.auth.models import Group, Permission
 from rest_framework_simplejwt.tokens import RefreshToken
 import docker
 from django.db.models import Q
-from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.db import transaction
-from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
+from django.conf import settings
+from django.http import StreamingHttpResponse
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+logger = logging.getLogger(__name__)
+
+
+# List endpoints: accepted `ordering` values (the first is the default)
+# and filter parameters. Orderings end in a unique column so keyset
+# cursors are stable; see api.pagination.
+HOST_ORDERINGS = {'created_at': ('created_at', 'id'), 'name': ('host_name', 'id')}
+HOST_FILTERS = {'status': 'status__in', 'name': 'host_name__startswith', 'owner': 'owner__username'}
+CONTAINER_ORDERINGS = {
+    'created_at': ('created_at', 'id'),
+    '-created_at': ('-created_at', '-id'),
+    'name': ('name', 'id'),
+}
+CONTAINER_FILTERS = {
+    'status': 'status__in',
+    'image': 'image',
+    'name': 'name__startswith',
+    'created_by': 'created_by__username',
+}
+HOST_RESOURCE_ORDERINGS = {'created_at': ('created_at', 'id'), 'name': ('name', 'id')}
+NETWORK_FILTERS = {'name': 'name__startswith', 'driver': 'driver'}
+VOLUME_FILTERS = {'name': 'name__startswith', 'driver': 'driver'}
+IMAGE_FILTERS = {'name': 'name__startswith', 'tag': 'tag'}
+
+
+def visible_containers(user, containers):
+    """Narrow a ContainerRecord queryset to what `user` may see."""
+    if user.is_admin():
+        return containers
+    if user.is_developer():
+        return containers.filter(Q(created_by=user) | Q(editable_by=user)).distinct()
+    return containers.filter(Q(viewable_by=user)).distinct()
+
+def wants_async(request):
+    """`async=true` in the query string or body: run the operation as a background job."""
+    value = request.query_params.get('async', request.data.get('async') if isinstance(request.data, dict) else None)
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def host_unavailable(e):
+    """503 for a host whose circuit breaker is open (see api.circuit_breaker)."""
+    return Response({
+        'message': str(e.detail),
+        'host_id': str(e.host_id),
+        'retry_after': e.retry_after,
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
+
+
+def job_accepted(job):
+    return Response({'job': serialize_job(job)}, status=status.HTTP_202_ACCEPTED)
 
 
 def create_default_groups():
@@ -23,33 +94,38 @@ def create_default_groups():
 
 class IsAdmin(BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='admin').exists()
+        return bool(request.user and request.user.is_authenticated and request.user.is_admin())
 
 class IsDeveloper(BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='developer').exists()
+        return bool(request.user and request.user.is_authenticated and request.user.is_developer())
 
 class IsViewer(BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='viewer').exists()
+        return bool(request.user and request.user.is_authenticated and request.user.is_viewer())
     
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def root_view(request):
     return Response({"message": f"Welcome {request.user.username}"})
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated, IsAdmin])
 def admin_only_view(request):
     # Admin can see all hosts
-    hosts = DockerHost.objects.all()
-    serializer = DockerHostSerializer(hosts, many=True)
-    return Response(serializer.data)
+    try:
+        data, next_cursor, paginated = list_page(
+            DockerHost.objects.all(), request.query_params, DockerHostSerializer,
+            orderings=HOST_ORDERINGS, filters=HOST_FILTERS,
+        )
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'results': data, 'next_cursor': next_cursor} if paginated else data)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated, IsDeveloper])
 def developer_only_view(request):
     # Developer can see hosts they own
@@ -58,7 +134,7 @@ def developer_only_view(request):
     return Response(serializer.data)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated, IsViewer])
 def viewer_only_view(request):
     # Viewer can see hosts they own
@@ -77,80 +153,322 @@ def get_tokens_for_user(user):
     }
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def start_container(request, host_id,container_id):
     try:
         container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
         container.start()
         return Response({"message": "Container started successfully."}, status=status.HTTP_200_OK)
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def stop_container(request, host_id,container_id):
     try:
         container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
         container.stop()
         return Response({"message": "Container stopped successfully."}, status=status.HTTP_200_OK)
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
+def bulk_container_action(request):
+    """
+    Run `action` (start, stop, restart or remove) on every container in
+    `containers` (container IDs, on any hosts) in parallel, with at most
+    BULK_ACTION_PER_HOST calls per host and BULK_ACTION_MAX_WORKERS in
+    total. `timeout` is the stop grace period in seconds. Returns one result
+    per container; a failure does not stop the others.
+    """
+    action = request.data.get('action')
+    container_ids = request.data.get('containers')
+    if not isinstance(container_ids, list) or not container_ids:
+        return Response({"message": "'containers' must be a non-empty list of container IDs."}, status=status.HTTP_400_BAD_REQUEST)
+    max_containers = getattr(settings, 'BULK_ACTION_MAX_CONTAINERS', 1000)
+    if len(container_ids) > max_containers:
+        return Response({"message": f"At most {max_containers} containers per request."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        timeout = int(request.data.get('timeout', 10))
+        records = {
+            record.container_id: record
+            for record in ContainerRecord.objects.select_related('host').prefetch_related('editable_by').filter(container_id__in=container_ids)
+        }
+        allowed = []
+        results = {}
+        for container_id in dict.fromkeys(container_ids):
+            record = records.get(container_id)
+            if record is None:
+                results[container_id] = {'container_id': container_id, 'ok': False, 'error': 'Container not found.'}
+            elif not can_manage(request.user, record):
+                results[container_id] = {'container_id': container_id, 'host_id': str(record.host_id), 'ok': False, 'error': 'Permission denied'}
+            else:
+                allowed.append(record)
+
+        for result in BulkAction(action, allowed, timeout=timeout).run():
+            results[result['container_id']] = result
+        results = [results[container_id] for container_id in dict.fromkeys(container_ids)]
+        succeeded = sum(result['ok'] for result in results)
+        return Response({
+            'action': action,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results,
+        }, status=status.HTTP_200_OK)
+    except (TypeError, ValueError) as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET', 'POST'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@docker_budget('read')
 def get_container_logs(request, host_id,container_id):
+    """
+    Container log as chunked NDJSON, see api.logs.LogStream.
+
+    Query parameters: tail (default CONTAINER_LOGS_DEFAULT_TAIL, or 'all'),
+    since, until (epoch seconds or ISO 8601), timestamps, stdout, stderr,
+    and cursor (from the previous page's end record) to page backwards.
+    """
     try:
-        container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
-        logs = container.get_logs()
-        return Response({"logs": logs.decode('utf-8')}, status=status.HTTP_200_OK)
+        query = LogQuery.from_params(request.query_params)
+        container = ContainerRecord.objects.select_related('host').get(container_id=container_id, host_id=host_id)
+        log_stream = container.stream_logs(query)
+        return StreamingHttpResponse(DockerStreamReader(lambda: log_stream), content_type='application/x-ndjson')
+    except HostUnavailable as e:
+        return host_unavailable(e)
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except ContainerRecord.DoesNotExist:
+        return Response({"message": "Container not found."}, status=status.HTTP_404_NOT_FOUND)
+    except docker.errors.NotFound:
+        return Response({"message": f"Container with ID {container_id} not found"}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_merged_logs(request):
+    """
+    Logs of several containers, on any hosts, merged by timestamp into one
+    NDJSON stream. Select containers with `containers` (comma separated
+    IDs) and/or `selector` ("key=value,key"); the other parameters are
+    those of the single-container logs endpoint, minus `cursor`.
+    """
+    try:
+        params = request.query_params.dict()
+        params.pop('cursor', None)
+        query = LogQuery.from_params(params)
+        container_ids = [c for c in params.get('containers', '').split(',') if c]
+        selector = params.get('selector')
+        if not (container_ids or selector):
+            return Response({"message": "Provide 'containers' or 'selector'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        records = visible_containers(request.user, ContainerRecord.objects.select_related('host').filter(is_active=True))
+        if container_ids:
+            records = records.filter(container_id__in=container_ids)
+        if selector:
+            records = filter_by_labels(records, selector)
+        records = list(records.order_by('host_id', 'name'))
+        if not records:
+            return Response({"message": "No containers match."}, status=status.HTTP_404_NOT_FOUND)
+        max_containers = getattr(settings, 'LOG_MERGE_MAX_CONTAINERS', 200)
+        if len(records) > max_containers:
+            return Response({"message": f"At most {max_containers} containers can be merged."}, status=status.HTTP_400_BAD_REQUEST)
+        return StreamingHttpResponse(merged_ndjson(records, query), content_type='application/x-ndjson')
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def search_container_logs(request, host_id, container_id):
+    """
+    Search the log archive of a container, including one that has been
+    deleted. Lines containing every word of `q` (all lines if `q` is
+    empty), oldest first, optionally between `from` and `to` (epoch seconds
+    or ISO 8601) and for one `stream`. `cursor` continues from the previous
+    page.
+    """
+    if not getattr(settings, 'LOG_ARCHIVE_DIR', None):
+        return Response({"message": "The log archive is not enabled."}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        directory = container_directory(host_id, container_id)
+        meta = read_meta(directory)
+        container = ContainerRecord.objects.filter(container_id=container_id, host_id=host_id).first()
+        if container is not None:
+            allowed = visible_containers(request.user, ContainerRecord.objects.filter(pk=container.pk)).exists()
+        elif meta is not None:
+            allowed = (
+                request.user.is_admin()
+                or request.user.pk == meta.get('created_by')
+                or DockerHost.objects.filter(id=host_id, owner=request.user).exists()
+            )
+        else:
+            return Response({"message": "No archived logs for this container."}, status=status.HTTP_404_NOT_FOUND)
+        if not allowed:
+            return Response({"message": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
+
+        params = request.query_params
+        terms = params.get('q', '').split()
+        if terms and not any(any(c.isalnum() for c in term) for term in terms):
+            return Response({"message": "'q' must contain at least one word."}, status=status.HTTP_400_BAD_REQUEST)
+        start = parse_query_time(params['from']) if params.get('from') else None
+        end = parse_query_time(params['to']) if params.get('to') else None
+        stream = params.get('stream')
+        if stream not in (None, '', 'stdout', 'stderr'):
+            return Response({"message": "'stream' must be 'stdout' or 'stderr'."}, status=status.HTTP_400_BAD_REQUEST)
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        max_results = getattr(settings, 'LOG_ARCHIVE_SEARCH_MAX_RESULTS', 1000)
+        limit = min(int(params.get('limit', max_results)), max_results)
+        if limit < 1:
+            return Response({"message": "'limit' must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches, next_cursor, counts = search_archive(
+            directory, terms, start=start, end=end, streams=(stream,) if stream else None, cursor=cursor, limit=limit,
+        )
+        return Response({
+            'container_id': container_id,
+            'name': container.name if container is not None else meta.get('name'),
+            'results': [
+                {'timestamp': format_timestamp(point), 'stream': line_stream, 'message': message.decode('utf-8', errors='replace')}
+                for point, line_stream, message in matches
+            ],
+            'cursor': next_cursor,
+            **counts,
+        }, status=status.HTTP_200_OK)
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_container_details(request, host_id, container_id):
     try:
-        container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
+        container = ContainerRecordSerializer.setup_eager_loading(ContainerRecord.objects).get(container_id=container_id, host_id=host_id)
         serializer = ContainerRecordSerializer(container)
         return Response(serializer.data, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('read')
 def get_container_stats(request, host_id, container_id):
     try:
-        container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
-        stats = container.stats(stream=False)
+        # A live stats stream for this container already has a fresh sample.
+        stats = stats_hub.latest(container_id)
+        if stats is None:
+            container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
+            stats = container.stats(stream=False)
         return Response(stats, status=status.HTTP_200_OK)
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _parse_time(value, default):
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid time: {value}")
+        return parsed.timestamp()
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_container_stats_history(request, host_id, container_id):
+    """
+    Downsampled stats series for a container, as recorded by the
+    `record_stats` command (see api.stats_history).
+
+    `from` and `to` are epoch seconds or ISO 8601 (default: the last hour),
+    `step` is the bucket width in seconds. The step is widened so at most
+    STATS_HISTORY_MAX_POINTS buckets are returned.
+    """
+    try:
+        if not ContainerRecord.objects.filter(container_id=container_id, host_id=host_id).exists():
+            return Response({"message": "Container not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        end = _parse_time(request.query_params.get('to'), time.time())
+        start = _parse_time(request.query_params.get('from'), end - 3600)
+        if start >= end:
+            return Response({"message": "'from' must be before 'to'."}, status=status.HTTP_400_BAD_REQUEST)
+        max_points = getattr(settings, 'STATS_HISTORY_MAX_POINTS', 500)
+        step = max(float(request.query_params.get('step', 0)), (end - start) / max_points, 1)
+
+        result = stats_history.query(container_id, start, end, step)
+        if result is None:
+            result = {'resolution': None, 'timestamps': [], 'series': {}}
+        return Response({
+            'container_id': container_id,
+            'from': start,
+            'to': end,
+            'step': step,
+            **result,
+        }, status=status.HTTP_200_OK)
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def stats_hub_metrics(request):
+    """
+    Metrics for the shared stats streams of this backend process: open
+    upstream Docker streams, subscribed sockets and publish rate.
+    """
+    return Response({**stats_hub.metrics(), 'history': stats_history.metrics()}, status=status.HTTP_200_OK)
+
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('read')
 def connect_to_host(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id, owner=request.user)
-        is_connected = host.test_connection()
-        host.save()
-        if is_connected:
+        if wants_async(request):
+            return job_accepted(enqueue('host.test_connection', {'host_id': str(host.id)}, host=host, user=request.user))
+        if check_host_connection(host)['reachable']:
             return Response({"message": "Host is reachable and connection is successful."}, status=status.HTTP_200_OK)
         else:
             return Response({"message": "Failed to connect to the Docker host."}, status=status.HTTP_400_BAD_REQUEST)
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except DockerHost.DoesNotExist:
         return Response({"message": "Docker host not found."}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('read')
 def create_host(request):
     serializer = DockerHostSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
@@ -168,6 +486,8 @@ def create_host(request):
                 return Response({
                     'message': 'Could not connect to Docker host'
                 }, status=status.HTTP_400_BAD_REQUEST)
+        except HostUnavailable as e:
+            return host_unavailable(e)
         except Exception as e:
             return Response({
                 'message': str(e)
@@ -175,14 +495,15 @@ def create_host(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('create')
 def create_container(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id)
         
         # Check permissions
-        if not (request.user.is_admin() or request.user == host.owner):
+        if not (request.user.is_admin() or request.user.pk == host.owner_id):
             return Response({
                 'message': 'Permission denied'
             }, status=status.HTTP_403_FORBIDDEN)
@@ -194,67 +515,27 @@ def create_container(request, host_id):
                 'message': 'Missing required fields'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Handle volumes: expect a list of volume IDs
-        volume_ids = request.data.get('volumes', [])
-        volumes_qs = Volume.objects.filter(id__in=volume_ids, host=host)
-        # For Docker SDK, mount at /mnt/{volume_name}
-        docker_volumes = {v.name: {'bind': f'/mnt/{v.name}', 'mode': 'rw'} for v in volumes_qs}
-
-        # Create container record
-        container_data = {
-            'container_id': '',  
-            'name': request.data['name'],
-            'image': request.data['image'],
-            'status': 'creating',
-            'created_at': timezone.now(),
-            'host': host,
-            'created_by': request.user
-        }
-
-        # Optional configuration
-        container_config = {
-            'name': request.data['name'],
-            'image': request.data['image'],
-            'ports': request.data.get('ports', {}),
-            'environment': request.data.get('environment', {}),
-            'volumes': docker_volumes,
-            'command': request.data.get('command', None)
-        }
+        if wants_async(request):
+            # The job waits for a missing image to be pulled and then creates the container.
+            data = {key: value for key, value in request.data.items() if key != 'async'}
+            return job_accepted(enqueue('container.create', {
+                'host_id': str(host.id), 'user_id': request.user.pk, 'data': data,
+            }, host=host, user=request.user))
 
         try:
-            # Create container in Docker
-            client = docker.DockerClient(base_url=f"{host.docker_api_url}")
-
-            # Pull image if not found
-            try:
-                img = client.images.get(request.data['image'])
-            except docker.errors.NotFound:
-                img = client.images.pull(request.data['image'])
-
-            # Parse details from image object
-            image_id = img.id.split(':')[-1]
-            tags = img.tags or ['<none>:<none>']
-            repository, tag = tags[0].split(':') if ':' in tags[0] else (tags[0], 'latest')
-            size_mb = round(img.attrs['Size'] / (1024 * 1024), 2)
-
-            # Save to DB only if not already tracked
-            if not Image.objects.filter(image_id=image_id, host=host).exists():
-                Image.objects.create(
-                    host=host,
-                    image_id=image_id,
-                    # repository=repository,
-                    tag=tag,
-                    # size_mb=size_mb,
-                    created_at=now()
-                )
-
-            docker_container = client.containers.create(**container_config)
-
+            data = provision_container(host, request.data, request.user)
+        except HostUnavailable as e:
+            return host_unavailable(e)
+        except ImagePullPending as e:
+            # The pull runs in the background (shared with anyone else pulling
+            # it); the client retries once it is done.
+            return Response({
+                'message': f"Pulling image {e.pull.reference}; create the container again once the pull has finished.",
+                'pull': serialize_pull(e.pull),
+            }, status=status.HTTP_202_ACCEPTED)
+        except OperationError as e:
+            return Response({'message': e.message}, status=e.status)
         except docker.errors.APIError as e:
-            if 'port is already allocated' in str(e).lower():
-                return Response({
-                    'message': 'Port conflict: A container on this host is already using one of the requested ports.'
-                }, status=status.HTTP_409_CONFLICT)
             return Response({
                 'message': f'Docker API error: {str(e)}'
             }, status=status.HTTP_400_BAD_REQUEST)
@@ -262,60 +543,124 @@ def create_container(request, host_id):
             return Response({
                 'message': f'Error creating container: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    except HostUnavailable as e:
+        return host_unavailable(e)
+    except DockerHost.DoesNotExist:
+        return Response({
+            'message': 'Docker host not found'
+        }, status=status.HTTP_404_NOT_FOUND)
 
-        with transaction.atomic():    
-            container = ContainerRecord.objects.create(
-                container_id=docker_container.id,
-                name=request.data['name'],
-                image=request.data['image'],
-                status='created',
-                created_at=timezone.now(),
-                host=host,
-                created_by=request.user
-            )
-            container.volumes.set(volumes_qs)
 
-            if 'viewable_by' in request.data:
-                container.viewable_by.add(*request.data['viewable_by'])
-            if 'editable_by' in request.data:
-                container.editable_by.add(*request.data['editable_by'])
+@api_view(['POST'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@docker_budget('create')
+def place_container(request):
+    """
+    Create a container on the least loaded host that can take it (see
+    api.placement). Takes the create_container fields plus optional
+    `cpus`, `memory_mb` and `constraints` (host labels such as "gpu" or
+    "zone=eu"). With `dry_run` only the best candidate hosts are returned.
+    """
+    try:
+        placement = PlacementRequest.from_data(request.data)
+    except (TypeError, ValueError) as e:
+        return Response({'message': f'Invalid placement request: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    if not dry_run and not all(field in request.data for field in ['image', 'name']):
+        return Response({'message': 'Missing required fields'}, status=status.HTTP_400_BAD_REQUEST)
 
-            if request.data.get('start', False):
-                docker_container.start()
-                container.status = 'running'
-                container.save()
+    tried = set()
 
-            serializer = ContainerRecordSerializer(container)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+    def allowed(state):
+        return state.host_id not in tried and (request.user.is_admin() or state.owner_id == request.user.pk)
 
-    except DockerHost.DoesNotExist:
+    try:
+        host_index.refresh()
+        if dry_run:
+            return Response({'candidates': [state.describe() for state in host_index.ranking(placement, allowed)]})
+
+        data = {key: value for key, value in request.data.items() if key not in ('async', 'dry_run', 'constraints')}
+        # A host that turns out to be unreachable, or to have one of the ports
+        # taken after all, is skipped and the next best one tried.
+        for _ in range(getattr(settings, 'PLACEMENT_MAX_ATTEMPTS', 3)):
+            state = host_index.place(placement, allowed)
+            if state is None:
+                break
+            tried.add(state.host_id)
+            host = DockerHost.objects.get(pk=state.host_id)
+            if wants_async(request):
+                job = enqueue('container.create', {
+                    'host_id': str(host.id), 'user_id': request.user.pk, 'data': data,
+                }, host=host, user=request.user)
+                return Response({'job': serialize_job(job), 'placement': state.describe()}, status=status.HTTP_202_ACCEPTED)
+            try:
+                container = provision_container(host, data, request.user)
+            except HostUnavailable:
+                host_index.release(state.host_id, placement)
+                continue
+            except OperationError as e:
+                host_index.release(state.host_id, placement)
+                if e.status == status.HTTP_409_CONFLICT:
+                    continue
+                return Response({'message': e.message}, status=e.status)
+            except ImagePullPending as e:
+                host_index.release(state.host_id, placement)
+                return Response({
+                    'message': f"Pulling image {e.pull.reference} on {host.host_name}; create the container there "
+                               f"(hosts/{host.id}/containers/create/) once the pull has finished.",
+                    'pull': serialize_pull(e.pull),
+                    'placement': state.describe(),
+                }, status=status.HTTP_202_ACCEPTED)
+            except Exception:
+                host_index.release(state.host_id, placement)
+                raise
+            return Response({**container, 'placement': state.describe()}, status=status.HTTP_201_CREATED)
         return Response({
-            'message': 'Docker host not found'
-        }, status=status.HTTP_404_NOT_FOUND)
+            'message': 'No host can take this container: none of the hosts you can use has the labels, free ports and capacity it needs.',
+            'hosts_considered': len(host_index),
+        }, status=status.HTTP_409_CONFLICT)
+    except docker.errors.APIError as e:
+        return Response({'message': f'Docker API error: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'message': f'Error placing container: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 
 @api_view(['DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def delete_container(request, host_id, container_id):
     try:
         container = ContainerRecord.objects.get(host__id=host_id, container_id=container_id)
 
-        if not (request.user.is_admin() or request.user == container.created_by or request.user in container.editable_by.all()):
+        if not (request.user.is_admin() or request.user.pk == container.created_by_id or container.editable_by.filter(pk=request.user.pk).exists()):
             return Response({
                 'message': 'Permission denied'
             }, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            client = docker.DockerClient(base_url=container.host.docker_api_url)
+            client = get_client(container.host)
 
             try:
                 docker_container = client.containers.get(container_id)
 
                 if docker_container.status == 'running':
                     docker_container.stop()
+
+                if getattr(settings, 'LOG_ARCHIVE_DIR', None):
+                    # Keep the container's output searchable once it is gone.
+                    try:
+                        archive_container(container, client)
+                    except Exception as e:
+                        logger.warning("Could not archive logs of %s before removal: %s", container_id, e)
                 
                 docker_container.remove()
 
+            except HostUnavailable as e:
+                return host_unavailable(e)
             except docker.errors.NotFound:
                 # Container doesn't exist in Docker — treat as soft-deleted
                 pass
@@ -335,41 +680,39 @@ def delete_container(request, host_id, container_id):
                 'message': 'Docker host not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except ContainerRecord.DoesNotExist:
         return Response({'message': 'Container not found'}, status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def host_detail_view(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id)
-        host_serializer = DockerHostSerializer(host)
-        
-        # Get containers based on user role and permissions
-        if request.user.groups.filter(name='admin').exists():
-            containers = ContainerRecord.objects.filter(host=host)
-        elif request.user.groups.filter(name='developer').exists():
-            containers = ContainerRecord.objects.filter(
-                host=host
-            ).filter(
-                Q(created_by=request.user) |
-                Q(editable_by=request.user)
-            ).distinct()
-        else:
-            containers = ContainerRecord.objects.filter(
-                host=host
-            ).filter(
-                Q(viewable_by=request.user)
-            ).distinct()
 
-        container_serializer = ContainerRecordSerializer(containers, many=True)
+        def render():
+            host_serializer = DockerHostSerializer(host)
 
-        return Response({
-            'host': host_serializer.data,
-            'containers': container_serializer.data
-        }, status=status.HTTP_200_OK)
+            # Get containers based on user role and permissions
+            containers = visible_containers(request.user, ContainerRecord.objects.filter(host=host))
+
+            data, next_cursor, _ = list_page(
+                containers, request.query_params, ContainerRecordListSerializer,
+                orderings=CONTAINER_ORDERINGS, filters=CONTAINER_FILTERS,
+                prepare=ContainerRecordListSerializer.setup_eager_loading,
+            )
+            return {
+                'host': host_serializer.data,
+                'containers': data,
+                'next_cursor': next_cursor,
+            }
+
+        return conditional_response(request, host, 'containers', render, per_user=True)
 
+    except ValueError as e:
+        return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except DockerHost.DoesNotExist:
         return Response({
             'message': 'Host not found'
@@ -419,8 +762,9 @@ def login_user(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def create_network(request):
     serializer = NetworkSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
@@ -429,7 +773,7 @@ def create_network(request):
             host = serializer.validated_data['host']
 
             # Connect to the Docker engine on that host
-            client = docker.DockerClient(base_url=host.docker_api_url)
+            client = get_client(host)
 
             # Create the Docker network via SDK
             docker_network = client.networks.create(
@@ -458,6 +802,8 @@ def create_network(request):
                 'network': NetworkSerializer(network_instance).data
             }, status=status.HTTP_201_CREATED)
 
+        except HostUnavailable as e:
+            return host_unavailable(e)
         except docker.errors.APIError as e:
             return Response({'message': f'Docker error: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -467,15 +813,16 @@ def create_network(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def delete_network(request, network_id):
     try:
         # Get the Network object from the database
         network = Network.objects.get(id=network_id)
 
         # Connect to the Docker host where the network exists
-        client = docker.DockerClient(base_url=network.host.docker_api_url)
+        client = get_client(network.host)
 
         # Get the network object from Docker
         docker_network = client.networks.get(network_id)
@@ -488,6 +835,8 @@ def delete_network(request, network_id):
 
         return Response({'message': 'Docker network deleted successfully.'}, status=status.HTTP_200_OK)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Network.DoesNotExist:
         return Response({'message': 'Network not found.'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -502,8 +851,9 @@ def delete_network(request, network_id):
         return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def connect_container_to_network(request):
     try:
         network_id = request.data.get('network_id')
@@ -528,7 +878,7 @@ def connect_container_to_network(request):
                             status=status.HTTP_400_BAD_REQUEST)
 
         # Connect to Docker host
-        client = docker.DockerClient(base_url=network.host.docker_api_url)
+        client = get_client(network.host)
 
         # Get Docker objects - try by ID first, then by name
         try:
@@ -567,6 +917,8 @@ def connect_container_to_network(request):
         return Response({'message': f'Container {container.name} connected to network {network.name} successfully.'},
                         status=status.HTTP_200_OK)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Network.DoesNotExist:
         print(f"Network not found in DB: {network_id}")
         return Response({'message': 'Network not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -581,8 +933,9 @@ def connect_container_to_network(request):
         return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def disconnect_container_from_network(request):
     try:
         network_id = request.data.get('network_id')
@@ -597,7 +950,7 @@ def disconnect_container_from_network(request):
         host = network.host
 
         # Connect to Docker host
-        client = docker.DockerClient(base_url=host.docker_api_url)
+        client = get_client(host)
 
         # Get Docker network and disconnect container - try by ID first, then by name
         try:
@@ -618,6 +971,8 @@ def disconnect_container_from_network(request):
 
         return Response({'message': f'Container {container.name} disconnected from network {network.name}'}, status=status.HTTP_200_OK)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Network.DoesNotExist:
         return Response({'message': 'Network not found'}, status=status.HTTP_404_NOT_FOUND)
     except ContainerRecord.DoesNotExist:
@@ -628,7 +983,7 @@ def disconnect_container_from_network(request):
         return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_networks_by_host(request, host_id):
     try:
@@ -636,13 +991,23 @@ def get_networks_by_host(request, host_id):
     except DockerHost.DoesNotExist:
         return Response({'message': 'Host not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    networks = Network.objects.filter(host=host)
-    serializer = NetworkSerializer(networks, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    def render():
+        data, next_cursor, paginated = list_page(
+            Network.objects.filter(host=host), request.query_params, NetworkSerializer,
+            orderings=HOST_RESOURCE_ORDERINGS, filters=NETWORK_FILTERS,
+            prepare=lambda networks, fields: networks.select_related('host') if fields is None or 'host' in fields else networks,
+        )
+        return {'results': data, 'next_cursor': next_cursor} if paginated else data
+
+    try:
+        return conditional_response(request, host, 'networks', render)
+    except ValueError as e:
+        return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('read')
 def container_connected_networks(request, host_id, container_id):
     try:
         host = DockerHost.objects.get(id=host_id)
@@ -652,7 +1017,7 @@ def container_connected_networks(request, host_id, container_id):
             return Response({'message': 'Container does not belong to the given host.'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        client = docker.DockerClient(base_url=host.docker_api_url)
+        client = get_client(host)
         container = client.containers.get(container_id)
 
         networks = container.attrs['NetworkSettings']['Networks']
@@ -674,6 +1039,8 @@ def container_connected_networks(request, host_id, container_id):
 
         return Response(connected_networks, status=status.HTTP_200_OK)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except DockerHost.DoesNotExist:
         return Response({'message': 'Host not found.'}, status=status.HTTP_404_NOT_FOUND)
     except ContainerRecord.DoesNotExist:
@@ -684,8 +1051,9 @@ def container_connected_networks(request, host_id, container_id):
         return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('read')
 def cleanup_container_networks(request, host_id, container_id):
     """
     Clean up invalid network references for a container.
@@ -700,36 +1068,12 @@ def cleanup_container_networks(request, host_id, container_id):
             return Response({'message': 'Container does not belong to the given host.'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        client = docker.DockerClient(base_url=host.docker_api_url)
-        container = client.containers.get(container_id)
-
-        networks = container.attrs['NetworkSettings']['Networks']
-        cleaned_networks = []
-        removed_networks = []
-
-        for name in networks.keys():
-            try:
-                # Try to get the network from Docker
-                network = client.networks.get(name)
-                cleaned_networks.append({
-                    'id': network.id,
-                    'name': name,
-                    'details': networks[name]
-                })
-            except docker.errors.NotFound:
-                # Network doesn't exist in Docker, mark for removal
-                removed_networks.append(name)
-                # Note: We can't disconnect from a non-existent network
-                # The container's network settings will still show it until the container is restarted
-                # or the Docker daemon is restarted
-
-        return Response({
-            'message': f'Network cleanup completed. Found {len(removed_networks)} invalid network references. Container restart may be needed to fully clear references.',
-            'removed_networks': removed_networks,
-            'cleaned_networks': cleaned_networks,
-            'requires_restart': len(removed_networks) > 0
-        }, status=status.HTTP_200_OK)
+        if wants_async(request):
+            return job_accepted(enqueue('network.cleanup', {'host_id': str(host.id), 'container_id': container_id}, host=host, user=request.user))
+        return Response(find_stale_networks(host, container_id), status=status.HTTP_200_OK)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except DockerHost.DoesNotExist:
         return Response({'message': 'Host not found.'}, status=status.HTTP_404_NOT_FOUND)
     except ContainerRecord.DoesNotExist:
@@ -740,53 +1084,119 @@ def cleanup_container_networks(request, host_id, container_id):
         return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def create_exec_session(request, host_id, container_id):
+    """
+    Open a terminal session (a /bin/sh exec) in the container. The caller's
+    detached session there, left by a page refresh, is returned instead
+    (200, `reattached`) unless `new` is true. 429 past EXEC_MAX_PER_CONTAINER
+    or EXEC_MAX_PER_USER open sessions.
+    """
     try:
-        container = ContainerRecord.objects.get(container_id=container_id, host_id=host_id)
+        container = ContainerRecord.objects.select_related('host').get(container_id=container_id, host_id=host_id)
         
         # Permission check
-        if not (request.user.is_admin() or request.user == container.created_by):
+        if not (request.user.is_admin() or request.user.pk == container.created_by_id):
             return Response({"error": "Permission denied"}, status=403)
         
-        client = docker.DockerClient(base_url=container.host.docker_api_url)
-        exec_instance = client.api.exec_create(
-            container=container_id,
-            cmd="/bin/sh",
-            tty=True,
-            stdin=True
-        )
-        return Response({"exec_id": exec_instance['Id']}, status=201)
+        new = str(request.data.get('new', '')).lower() in ('1', 'true', 'yes')
+        session, reattached = open_session(container, request.user, new=new)
+        return Response({
+            "exec_id": session.exec_id,
+            "session_id": str(session.id),
+            "reattached": reattached,
+        }, status=200 if reattached else 201)
     
+    except OperationError as e:
+        return Response({'message': e.message}, status=e.status)
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except (ContainerRecord.DoesNotExist, DockerHost.DoesNotExist):
         return Response({"error": "Resource not found"}, status=404)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def list_exec_sessions(request):
+    """
+    Open terminal sessions (all for admins, else the caller's), optionally
+    for one `container_id`, with counts per container and per user, the
+    limits, and the sessions held by this backend process.
+    """
+    sessions = ExecSession.objects.filter(status__in=ExecSession.ACTIVE_STATUSES)
+    if not request.user.is_admin():
+        sessions = sessions.filter(user=request.user)
+    container_id = request.query_params.get('container_id')
+    if container_id:
+        sessions = sessions.filter(container__container_id=container_id)
+    return Response({
+        'sessions': [
+            serialize_session(session)
+            for session in sessions.select_related('container', 'user').order_by('-created_at')
+        ],
+        'counts': session_counts(sessions),
+        'limits': {
+            'per_container': getattr(settings, 'EXEC_MAX_PER_CONTAINER', 4),
+            'per_user': getattr(settings, 'EXEC_MAX_PER_USER', 10),
+            'idle_timeout': getattr(settings, 'EXEC_IDLE_TIMEOUT', 30 * 60),
+            'reattach_grace': getattr(settings, 'EXEC_REATTACH_GRACE', 60),
+        },
+        'process': exec_session_manager.metrics(),
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@docker_budget('write')
+def close_exec_session(request, session_id):
+    """End a terminal session, stopping the shell and everything started from it."""
+    session = ExecSession.objects.select_related('container__host', 'user').filter(pk=session_id).first()
+    if session is None or not (request.user.is_admin() or request.user.pk == session.user_id):
+        return Response({'message': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
+    if session.status == 'closed':
+        return Response({'message': 'Session already closed.'}, status=status.HTTP_409_CONFLICT)
+    try:
+        exit_code = close_session(session, 'closed')
+    except HostUnavailable as e:
+        return host_unavailable(e)
+    session.refresh_from_db()
+    return Response({**serialize_session(session), 'exit_code': exit_code}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_volumes_by_host(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id)
 
         # Check if user has access
-        if not (request.user.is_admin() or request.user == host.owner):
+        if not (request.user.is_admin() or request.user.pk == host.owner_id):
             return Response({'message': 'Permission denied'}, status=403)
 
-        volumes = Volume.objects.filter(host=host)
-        serializer = VolumeSerializer(volumes, many=True)
-        return Response(serializer.data)
+        def render():
+            data, next_cursor, paginated = list_page(
+                Volume.objects.filter(host=host), request.query_params, VolumeSerializer,
+                orderings=HOST_RESOURCE_ORDERINGS, filters=VOLUME_FILTERS,
+            )
+            return {'results': data, 'next_cursor': next_cursor} if paginated else data
+
+        return conditional_response(request, host, 'volumes', render)
+    except ValueError as e:
+        return Response({'message': str(e)}, status=400)
     except DockerHost.DoesNotExist:
         return Response({'message': 'Docker host not found'}, status=404)
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def create_volume(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id)
 
-        if not (request.user.is_admin() or request.user == host.owner):
+        if not (request.user.is_admin() or request.user.pk == host.owner_id):
             return Response({'message': 'Permission denied'}, status=403)
 
         name = request.data.get('name')
@@ -796,7 +1206,7 @@ def create_volume(request, host_id):
         if not name:
             return Response({'message': 'Volume name required'}, status=400)
 
-        client = docker.DockerClient(base_url=host.docker_api_url)
+        client = get_client(host)
         docker_volume = client.volumes.create(name=name, driver=driver, labels=labels)
 
         volume = Volume.objects.create(
@@ -810,6 +1220,8 @@ def create_volume(request, host_id):
         serializer = VolumeSerializer(volume)
         return Response(serializer.data, status=201)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except DockerHost.DoesNotExist:
         return Response({'message': 'Docker host not found'}, status=404)
     except docker.errors.APIError as e:
@@ -818,27 +1230,21 @@ def create_volume(request, host_id):
         return Response({'message': f'Error: {str(e)}'}, status=500)
     
 @api_view(['DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def delete_volume(request, volume_id):
     try:
-        volume = Volume.objects.get(id=volume_id)
-        client = docker.DockerClient(base_url=volume.host.docker_api_url)
-
-        docker_volume= client.volumes.get(volume.name)
-        docker_volume.remove()
-
-        volume.delete()
-
-        return Response({'message': 'Docker volume deleted successfully.'}, status=status.HTTP_200_OK)
+        volume = Volume.objects.select_related('host').get(id=volume_id)
+        if wants_async(request):
+            return job_accepted(enqueue('volume.delete', {'volume_id': volume.id}, host=volume.host, user=request.user))
+        return Response(remove_volume(volume), status=status.HTTP_200_OK)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Volume.DoesNotExist:
         return Response({'message': 'Volume not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    except docker.errors.NotFound:
-        volume.delete()  
-        return Response({'message': 'Docker volume not found. Removed from DB.'}, status=status.HTTP_200_OK)
-
     except docker.errors.APIError as e:
         return Response({'message': f'Docker error: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -846,14 +1252,15 @@ def delete_volume(request, volume_id):
         return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('read')
 def get_container_volume_bindings(request, host_id, container_id):
     try:
         container = ContainerRecord.objects.get(container_id=container_id, host=DockerHost.objects.get(id=host_id))
         
         # Get the Docker container to check its current volume mounts
-        client = docker.DockerClient(base_url=container.host.docker_api_url)
+        client = get_client(container.host)
         docker_container = client.containers.get(container_id)
         
         # Get container's current volume mounts
@@ -885,62 +1292,147 @@ def get_container_volume_bindings(request, host_id, container_id):
             'volume_bindings': volume_info
         }, status=status.HTTP_200_OK)
         
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except Exception as e:
         return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def host_details(request, host_id):
     """
     Returns host details and stats: number of containers, volumes, and networks associated with the host.
     """
     try:
-        host = DockerHost.objects.get(id=host_id)
-        containers_count = ContainerRecord.objects.filter(host=host).count()
-        volumes_count = Volume.objects.filter(host=host).count()
-        networks_count = Network.objects.filter(host=host).count()
-        images_count = Image.objects.filter(host=host).count()
+        host = with_counts(DockerHost.objects.filter(id=host_id)).get()
 
         serializer = DockerHostSerializer(host)
         return Response({
             "host": serializer.data,
             "stats": {
-                "containers": containers_count,
-                "volumes": volumes_count,
-                "networks": networks_count,
-                "images": images_count
+                "containers": host.n_containers,
+                "volumes": host.n_volumes,
+                "networks": host.n_networks,
+                "images": host.n_images
             }
         }, status=200)
     except DockerHost.DoesNotExist:
         return Response({"message": "Host not found"}, status=404)
+
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def fleet_summary(request):
+    """
+    Counts per host and in total over every host the user can see (all of
+    them for admins) in one query. With `live=true` the hosts are also
+    asked for live info (and disk usage with `disk=true`) within `deadline`
+    seconds; hosts that miss it are marked stale instead of failing the
+    request.
+    """
+    params = request.query_params
+    try:
+        deadline = float(params.get('deadline', getattr(settings, 'FLEET_LIVE_DEADLINE', 3)))
+    except ValueError:
+        return Response({'message': "'deadline' must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+    deadline = min(max(deadline, 0.1), getattr(settings, 'FLEET_LIVE_MAX_DEADLINE', 10))
+
+    hosts = DockerHost.objects.all() if request.user.is_admin() else DockerHost.objects.filter(owner=request.user)
+    try:
+        return Response(summarize(
+            hosts,
+            live=params.get('live', '').lower() in ('1', 'true', 'yes'),
+            disk=params.get('disk', '').lower() in ('1', 'true', 'yes'),
+            deadline=deadline,
+        ), status=status.HTTP_200_OK)
+    except Exception as e:
+        return Response({'message': f'Error building fleet summary: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def host_health(request, host_id):
+    """
+    Ping history of a host from the health monitor, newest first, with
+    uptime and latency over the returned checks. `from` and `to` are epoch
+    seconds or ISO 8601 (default: the last 24 hours).
+    """
+    try:
+        host = DockerHost.objects.get(id=host_id)
+        if not (request.user.is_admin() or request.user.pk == host.owner_id):
+            return Response({'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        end = _parse_time(request.query_params.get('to'), time.time())
+        start = _parse_time(request.query_params.get('from'), end - 86400)
+        pings = list(
+            HostPing.objects.filter(
+                host=host,
+                checked_at__gte=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+                checked_at__lte=datetime.fromtimestamp(end, tz=dt_timezone.utc),
+            ).order_by('-checked_at')[:getattr(settings, 'LIST_MAX_LIMIT', 1000)]
+        )
+        latencies = sorted(ping.latency_ms for ping in pings if ping.ok)
+        summary = {
+            'checks': len(pings),
+            'ok': len(latencies),
+            'uptime': round(len(latencies) / len(pings), 4) if pings else None,
+            'latency_ms': {
+                'avg': round(sum(latencies) / len(latencies), 2),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': latencies[-1],
+            } if latencies else None,
+        }
+        return Response({
+            'host_id': str(host.id),
+            'status': host.status,
+            'last_seen_at': host.last_seen_at,
+            'summary': summary,
+            'pings': [
+                {'checked_at': ping.checked_at, 'ok': ping.ok, 'latency_ms': ping.latency_ms, 'error': ping.error or None}
+                for ping in pings
+            ],
+        }, status=status.HTTP_200_OK)
+    except DockerHost.DoesNotExist:
+        return Response({'message': 'Docker host not found'}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_images_by_host(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id)
 
         # Only owner or admin can access
-        if not (request.user == host.owner or request.user.is_admin()):
+        if not (request.user.pk == host.owner_id or request.user.is_admin()):
             return Response({'detail': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        images = Image.objects.filter(host=host)
-        serializer = ImageSerializer(images, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        def render():
+            data, next_cursor, paginated = list_page(
+                Image.objects.filter(host=host), request.query_params, ImageSerializer,
+                orderings=HOST_RESOURCE_ORDERINGS, filters=IMAGE_FILTERS,
+            )
+            return {'results': data, 'next_cursor': next_cursor} if paginated else data
+
+        return conditional_response(request, host, 'images', render)
 
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except DockerHost.DoesNotExist:
         return Response({'detail': 'Docker host not found'}, status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def create_image(request, host_id):
     try:
         host = DockerHost.objects.get(id=host_id)
 
-        if not (request.user == host.owner or request.user.is_admin()):
+        if not (request.user.pk == host.owner_id or request.user.is_admin()):
             return Response({'detail': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
         image_name = request.data.get('name')
@@ -948,45 +1440,45 @@ def create_image(request, host_id):
         if not image_name:
             return Response({'detail': 'Image name required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Connect to Docker and pull the image
-        client = docker.DockerClient(base_url=host.docker_api_url)
-        pulled_image = client.images.pull(f"{image_name}:{tag}")
-
-        # Extract metadata
-        image_id = pulled_image.id
-        size = pulled_image.attrs.get('Size', 0)
-
-        image, created = Image.objects.get_or_create(
-            image_id=image_id,
-            defaults={
-                'name': image_name,
-                'tag': tag,
-                'size': size,
-                'host': host,
-            }
-        )
-
-        serializer = ImageSerializer(image)
-        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+        # Pull in the background; progress is on ws/images/pulls/<id>/ and
+        # the Image row is written when it completes.
+        pull, started = start_pull(host, image_reference(image_name, tag), request.user)
+        return Response({
+            'pull': serialize_pull(pull),
+            'joined_existing': not started,
+        }, status=status.HTTP_202_ACCEPTED)
 
     except DockerHost.DoesNotExist:
         return Response({'detail': 'Host not found'}, status=status.HTTP_404_NOT_FOUND)
-    except docker.errors.APIError as e:
-        return Response({'detail': f'Docker error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_image_pull(request, host_id, pull_id):
+    try:
+        pull = ImagePull.objects.select_related('host').get(id=pull_id, host_id=host_id)
+        if not (request.user.pk == pull.host.owner_id or request.user.is_admin() or request.user.pk == pull.requested_by_id):
+            return Response({'detail': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(serialize_pull(pull), status=status.HTTP_200_OK)
+    except ImagePull.DoesNotExist:
+        return Response({'detail': 'Pull not found'}, status=status.HTTP_404_NOT_FOUND)
+
 @api_view(['DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([RoleClaimJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@docker_budget('write')
 def delete_image(request, host_id, image_id):
     try:
         host = DockerHost.objects.get(id=host_id)
         image = Image.objects.get(id=image_id, host=host)
 
-        if not (request.user == host.owner or request.user.is_admin()):
+        if not (request.user.pk == host.owner_id or request.user.is_admin()):
             return Response({'detail': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
         # Attempt to remove from Docker engine
-        client = docker.DockerClient(base_url=host.docker_api_url)
+        client = get_client(host)
         try:
             client.images.remove(image.image_id, force=True)
         except docker.errors.ImageNotFound:
@@ -995,7 +1487,37 @@ def delete_image(request, host_id, image_id):
         image.delete()
         return Response({'detail': 'Image deleted'}, status=status.HTTP_204_NO_CONTENT)
 
+    except HostUnavailable as e:
+        return host_unavailable(e)
     except DockerHost.DoesNotExist:
         return Response({'detail': 'Host not found'}, status=status.HTTP_404_NOT_FOUND)
     except Image.DoesNotExist:
         return Response({'detail': 'Image not found'}, status=status.HTTP_404_NOT_FOUND)
+
+def _get_own_job(request, job_id):
+    job = Job.objects.filter(pk=job_id).first()
+    if job is None or not (request.user.is_admin() or request.user.pk == job.created_by_id):
+        return None
+    return job
+
+@api_view(['GET'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_job(request, job_id):
+    """State of a background job; live updates are sent on ws/jobs/<job_id>/."""
+    job = _get_own_job(request, job_id)
+    if job is None:
+        return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(serialize_job(job), status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([RoleClaimJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def cancel_job(request, job_id):
+    """Cancel a queued job, or ask a running one to stop at its next checkpoint."""
+    job = _get_own_job(request, job_id)
+    if job is None:
+        return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    if job.status in Job.FINISHED_STATUSES:
+        return Response({'message': f'Job already {job.status}.'}, status=status.HTTP_409_CONFLICT)
+    return Response(serialize_job(cancel_job_run(job)), status=status.HTTP_202_ACCEPTED)
@@ -8,11 +8,12 @@ django.setup()
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from api.authentication import JWTAuthMiddleware
 from api.routing import websocket_urlpatterns
 
 application = ProtocolTypeRouter({
     'http': get_asgi_application(),
     'websocket': AuthMiddlewareStack(
-        URLRouter(websocket_urlpatterns)
+        JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
     ),
 })
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -47,9 +48,51 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = "home.asgi.application"
 
+# Channel layer used for group fan-out (events, stats, jobs...).
+# Set REDIS_URL to share groups between daphne replicas and worker commands;
+# without it an in-process layer is used, which is enough for tests and a
+# single local server.
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', 1500)),
+                'expiry': 10,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Cache for role lookups and rendered listings. It has to be shared by every
+# process for invalidation (e.g. a revoked role) to reach all of them, so it
+# lives in Redis when REDIS_URL is set; the per-process fallback only suits a
+# single local server.
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.RoleClaimJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -159,3 +202,169 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Docker client pooling
+# One DockerClient is kept per DockerHost and reused across requests.
+
+DOCKER_CLIENT_MAX_POOL_SIZE = 4     # urllib3 connections per host
+DOCKER_CLIENT_IDLE_TIMEOUT = 300    # seconds before an unused client is closed
+DOCKER_CLIENT_TIMEOUT = 60          # socket timeout for Docker API calls
+
+# Docker API circuit breakers and call budgets (api/circuit_breaker.py)
+
+DOCKER_CONNECT_TIMEOUT = 3              # seconds to open a connection to a daemon
+DOCKER_BREAKER_FAILURE_THRESHOLD = 3    # consecutive connection failures/timeouts that open a host's circuit
+DOCKER_BREAKER_RESET_TIMEOUT = 30       # seconds an open circuit fails fast before one probe call is let through
+DOCKER_CALL_BUDGETS = {                 # seconds all Docker calls of one request may take, per @docker_budget name
+    'read': 10,
+    'write': 30,
+    'create': 60,
+    'default': 30,
+}
+
+# List endpoints (api/pagination.py), paginated when `limit` or `cursor` is given
+
+LIST_DEFAULT_LIMIT = 100            # rows per page when only a cursor is given
+LIST_MAX_LIMIT = 1000               # largest accepted `limit`
+
+# Conditional GETs of host listings (api/inventory.py), rendered responses kept in the default cache
+INVENTORY_CACHE_TTL = 300           # seconds a rendered listing is kept for its ETag
+
+# Bulk container actions (api/bulk.py)
+
+BULK_ACTION_MAX_WORKERS = 32        # daemon calls in flight per request, across all hosts
+BULK_ACTION_PER_HOST = 8            # daemon calls in flight per host
+BULK_ACTION_MAX_CONTAINERS = 1000   # containers per request
+
+# Background jobs (python manage.py run_jobs), for requests made with async=true
+
+JOBS_CONCURRENCY = 8                # jobs run at once by one worker
+JOBS_PER_HOST = 2                   # jobs running at once per Docker host, over all workers
+JOBS_POLL_INTERVAL = 1              # seconds between checks for queued jobs
+JOBS_MAX_ATTEMPTS = 3               # runs of a job failing with transient Docker errors
+JOBS_RETRY_BASE_DELAY = 5           # seconds before the first retry, doubled on each retry
+JOBS_RETRY_MAX_DELAY = 300
+JOBS_HEARTBEAT_INTERVAL = 10        # seconds between heartbeats of running jobs
+JOBS_STALE_AFTER = 60               # seconds without a heartbeat before a job is requeued
+JOBS_PULL_POLL_INTERVAL = 1         # seconds a container.create job waits between checks of its image pull
+JOBS_SOCKET_POLL_INTERVAL = 2       # seconds a job socket waits for an update before re-reading the row
+
+# Image pulls (api/image_pulls.py), run in the background of the requesting process
+
+IMAGE_PULL_PUBLISH_INTERVAL = 0.5   # seconds between progress messages on ws/images/pulls/<id>/
+IMAGE_PULL_SAVE_INTERVAL = 5        # seconds between progress writes (the pull's heartbeat)
+IMAGE_PULL_STALE_AFTER = 300        # seconds without a heartbeat before a running pull is replaced
+IMAGE_PULL_POLL_INTERVAL = 2        # seconds a pull socket waits for an update before re-reading the row
+
+# Fleet summary (GET /api/fleet/summary/, api/fleet.py)
+FLEET_LIVE_DEADLINE = 3             # seconds the live fan-out waits before marking hosts stale
+FLEET_LIVE_MAX_DEADLINE = 10        # upper bound for the `deadline` query parameter
+FLEET_LIVE_CONCURRENCY = 50         # hosts queried at once
+
+# Container placement (api/placement.py, POST /api/containers/place/)
+PLACEMENT_INDEX_TTL = 30                # seconds before the in-memory host index is rebuilt
+PLACEMENT_STATS_WINDOW = 300            # seconds of stats history averaged for a container's usage
+PLACEMENT_DEFAULT_CPU = 0.1             # cores counted for a container with no stats and no request
+PLACEMENT_DEFAULT_MEMORY_MB = 128       # MB counted for a container with no stats and no request
+PLACEMENT_MAX_ATTEMPTS = 3              # hosts tried when the chosen one is unreachable or has a port taken
+
+# Host health monitor (python manage.py monitor_hosts)
+
+HEALTH_INTERVAL = 30                # seconds between sweeps over all hosts
+HEALTH_INTERVAL_JITTER = 0.1        # each interval varies by up to this fraction
+HEALTH_CONCURRENCY = 100            # hosts probed in parallel
+HEALTH_PROBE_JITTER = 0.5           # seconds; probes start at random offsets up to this
+HEALTH_PROBE_TIMEOUT = 5            # seconds allowed for one host's ping and info
+HEALTH_PING_RETENTION_DAYS = 7      # HostPing history kept
+
+# Inventory sync (python manage.py sync_inventory)
+
+INVENTORY_SYNC_INTERVAL = 30        # seconds between passes over all hosts
+INVENTORY_SYNC_CONCURRENCY = 8      # hosts synced in parallel
+
+# Docker events (python manage.py watch_events)
+
+DOCKER_EVENTS_BATCH_WINDOW = 0.5    # seconds of events coalesced into one DB write
+DOCKER_EVENTS_BATCH_SIZE = 500      # max events per batch
+DOCKER_EVENTS_RECONNECT_DELAY = 5   # initial backoff after the stream drops
+
+# Role lookups (CustomUser.get_roles)
+
+# seconds roles are cached per user; 0 disables. Only on with a shared cache,
+# since a per-process one would keep serving roles revoked in another process.
+USER_ROLE_CACHE_TTL = 60 if REDIS_URL else 0
+TRUST_TOKEN_ROLE_CLAIM = False      # take roles from the JWT 'role' claim instead of the DB
+
+# WebSocket streams relayed from Docker (logs, stats, terminals)
+
+DOCKER_STREAM_MAX_PER_PROCESS = 256     # concurrent upstream Docker streams per backend process
+DOCKER_STREAM_MAX_PER_CONNECTION = 4    # streams a single WebSocket may open
+DOCKER_STREAM_BUFFER_SIZE = 64          # items buffered per stream before the Docker read pauses
+
+# Terminal sockets (TerminalConsumer)
+TERMINAL_READ_SIZE = 16384                  # bytes per read from the exec socket
+TERMINAL_BUFFER_CHUNKS = 16                 # reads buffered before the exec socket read pauses
+TERMINAL_BATCH_WINDOW = 0.015               # seconds output is coalesced into one frame
+TERMINAL_MAX_FRAME_BYTES = 64 * 1024        # output frame size limit
+TERMINAL_MAX_UNACKED_BYTES = 512 * 1024     # for acking clients; reading pauses past this
+
+# Exec sessions (api/exec_sessions.py)
+EXEC_MAX_PER_CONTAINER = 4          # open shells per container, all users
+EXEC_MAX_PER_USER = 10              # open shells per user, all containers
+EXEC_IDLE_TIMEOUT = 30 * 60         # seconds without input or output before a shell is killed
+EXEC_REATTACH_GRACE = 60            # seconds a shell outlives its socket, for a page refresh to reattach
+EXEC_ATTACH_TIMEOUT = 120           # seconds a created shell may wait for its first socket
+EXEC_REAP_INTERVAL = 15             # seconds between reaper sweeps (and session heartbeats)
+EXEC_SCROLLBACK_BYTES = 64 * 1024   # recent output replayed to a reattaching socket
+
+# Container logs endpoint (api/logs.py)
+
+CONTAINER_LOGS_DEFAULT_TAIL = 1000      # lines returned when neither tail nor since is given
+CONTAINER_LOGS_BATCH_BYTES = 32 * 1024  # NDJSON bytes per streamed chunk
+CONTAINER_LOGS_PAGE_WINDOW = 60         # seconds of log first searched for a page before `until`, doubled as needed
+
+# Live log socket (ChatConsumer)
+
+LOG_STREAM_DEFAULT_TAIL = 100               # lines sent on connect without since/cursor
+LOG_STREAM_BATCH_LINES = 200                # lines per frame
+LOG_STREAM_BATCH_WINDOW = 0.1               # seconds a partial frame waits for more lines
+LOG_STREAM_MAX_LINES_PER_SECOND = 2000      # per stream; lines over the rate are skipped
+LOG_STREAM_MAX_UNACKED_BYTES = 1024 * 1024  # for acking clients; lines are skipped past this
+
+# Merged multi-container logs (api/log_merge.py)
+
+LOG_MERGE_MAX_CONTAINERS = 200      # containers per merged stream
+LOG_MERGE_MAX_CONTAINERS_PER_CONNECTION = 50  # containers merged by one WebSocket, all streams together
+LOG_MERGE_MAX_DELAY = 0.5           # seconds a quiet container may hold back the others
+LOG_MERGE_BUFFER_BATCHES = 4        # daemon reads buffered per container
+
+# Log archive (python manage.py archive_logs, api/log_archive.py)
+# Optional: set LOG_ARCHIVE_DIR (shared by the archiver and the backend) to enable.
+
+LOG_ARCHIVE_DIR = os.environ.get('LOG_ARCHIVE_DIR')
+LOG_ARCHIVE_BLOCK_BYTES = 256 * 1024            # uncompressed bytes per gzip block, the unit a search reads
+LOG_ARCHIVE_FLUSH_INTERVAL = 5                  # seconds before a partial block is written and searchable
+LOG_ARCHIVE_SEGMENT_BYTES = 16 * 1024 * 1024    # compressed bytes per segment file
+LOG_ARCHIVE_SEGMENT_SECONDS = 86400             # log time covered by one segment
+LOG_ARCHIVE_MAX_BYTES = 10 * 1024 ** 3          # whole archive; oldest segments removed first
+LOG_ARCHIVE_MAX_AGE = 30 * 86400                # seconds since a segment was last written
+LOG_ARCHIVE_RETENTION_INTERVAL = 300            # seconds between retention passes
+LOG_ARCHIVE_SEARCH_MAX_RESULTS = 1000           # max lines per search page
+LOG_ARCHIVE_ON_REMOVE_TIMEOUT = 10              # seconds a container removal waits for its log to be archived
+LOG_ARCHIVE_ON_REMOVE_MAX_BYTES = 64 * 1024 ** 2  # log bytes archived at most before a removal
+
+# Shared container stats streams (api/stats_hub.py)
+
+STATS_HUB_PUBLISH_INTERVAL = 2      # seconds between samples pushed to subscribers
+STATS_HUB_GRACE_PERIOD = 10         # seconds an unwatched upstream stays open
+
+# Stats history (python manage.py record_stats, api/stats_history.py), kept in the database
+
+STATS_RECORD_INTERVAL = 10                  # seconds between samples of every running container
+STATS_RECORD_CONCURRENCY = 16               # stats calls in flight per sweep
+STATS_RECORD_TIMEOUT = 10                   # seconds budget of one container's stats call
+STATS_HISTORY_RAW_RETENTION = 1800          # seconds of raw samples kept
+STATS_HISTORY_MINUTE_RETENTION = 86400      # seconds of 1-minute averages kept
+STATS_HISTORY_HOUR_RETENTION = 30 * 86400   # seconds of 1-hour averages kept
+STATS_HISTORY_RETENTION_INTERVAL = 300      # seconds between retention passes
+STATS_HISTORY_MAX_POINTS = 500              # max buckets returned by the history endpoint
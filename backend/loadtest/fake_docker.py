@@ -0,0 +1,148 @@
+"""
+A tiny stand-in for the Docker Engine API, just enough for the backend's
+log and stats streams: /version, /_ping, /containers/<id>/json,
+/containers/<id>/logs and /containers/<id>/stats.
+
+    python loadtest/fake_docker.py --port 2375 --log-rate 50
+
+Every container id exists and is a running TTY container. Logs emit
+--log-rate lines per second per stream (forever when follow=1) and stats
+emit one sample per second, like the real daemon.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    log_rate = 50
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, code=200):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def send_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if parts and parts[0].startswith('v1.'):
+            parts = parts[1:]
+
+        if parts == ['version']:
+            return self.send_json({'ApiVersion': '1.43', 'Version': '24.0.0-fake'})
+        if parts == ['_ping']:
+            body = b'OK'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            return self.wfile.write(body)
+        if parts == ['info']:
+            return self.send_json({
+                'NCPU': 8, 'MemTotal': 16 * 1024 ** 3, 'ContainersRunning': 1,
+                'Images': 1, 'OperatingSystem': 'Fake Linux', 'ServerVersion': '24.0.0-fake',
+            })
+        if len(parts) == 3 and parts[0] == 'containers':
+            container_id, action = parts[1], parts[2]
+            if action == 'json':
+                return self.send_json({
+                    'Id': container_id, 'Name': f'/{container_id[:12]}',
+                    'Config': {'Tty': True}, 'State': {'Status': 'running', 'Running': True},
+                    'NetworkSettings': {'Networks': {}}, 'Mounts': [],
+                })
+            if action == 'logs':
+                return self.stream_logs(container_id, query)
+            if action == 'stats':
+                return self.stream_stats(container_id, query)
+        return self.send_json({'message': 'page not found'}, 404)
+
+    def stream_logs(self, container_id, query):
+        follow = query.get('follow', ['0'])[0] in ('1', 'True', 'true')
+        timestamps = query.get('timestamps', ['0'])[0] in ('1', 'True', 'true')
+        self.start_chunked('application/vnd.docker.raw-stream')
+        interval = 1.0 / self.log_rate
+        count = 0
+        try:
+            while follow or count < 100:
+                stamp = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ ') if timestamps else ''
+                self.send_chunk(f'{stamp}{container_id[:12]} line {count}\n'.encode())
+                count += 1
+                time.sleep(interval)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def stream_stats(self, container_id, query):
+        stream = query.get('stream', ['1'])[0] in ('1', 'True', 'true')
+        tick = 0
+
+        def sample():
+            return {
+                'id': container_id, 'name': f'/{container_id[:12]}',
+                'read': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+                'cpu_stats': {
+                    'cpu_usage': {'total_usage': 10 ** 9 * (tick + 1), 'usage_in_usermode': 6 * 10 ** 8 * (tick + 1), 'usage_in_kernelmode': 4 * 10 ** 8 * (tick + 1)},
+                    'system_cpu_usage': 8 * 10 ** 9 * (tick + 1), 'online_cpus': 8,
+                },
+                'precpu_stats': {
+                    'cpu_usage': {'total_usage': 10 ** 9 * tick, 'usage_in_usermode': 0, 'usage_in_kernelmode': 0},
+                    'system_cpu_usage': 8 * 10 ** 9 * tick, 'online_cpus': 8,
+                },
+                'memory_stats': {'usage': 64 * 1024 ** 2, 'limit': 1024 ** 3, 'stats': {'inactive_file': 8 * 1024 ** 2}},
+                'networks': {'eth0': {'rx_bytes': 4096 * tick, 'tx_bytes': 2048 * tick}},
+                'blkio_stats': {'io_service_bytes_recursive': []},
+                'pids_stats': {'current': 4},
+            }
+
+        if not stream:
+            return self.send_json(sample())
+        self.start_chunked('application/json')
+        try:
+            while True:
+                self.send_chunk((json.dumps(sample()) + '\n').encode())
+                tick += 1
+                time.sleep(1)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=2375)
+    parser.add_argument('--log-rate', type=int, default=50, help="log lines per second per stream")
+    args = parser.parse_args()
+
+    FakeDockerHandler.log_rate = args.log_rate
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), FakeDockerHandler)
+    server.daemon_threads = True
+    print(f"Fake Docker daemon on tcp://0.0.0.0:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+WebSocket throughput test against one or more daphne replicas.
+
+Opens --connections log (or stats) sockets spread round-robin over the
+given backend URLs, lets them run for --duration seconds and reports
+messages per second, overall and per replica.
+
+    # 1. seed a host + containers pointing at the fake daemon
+    python loadtest/ws_load.py seed --docker-url tcp://127.0.0.1:2375 --containers 200
+
+    # 2. run the test against 1, 2, 3... replicas
+    python loadtest/ws_load.py run --url ws://127.0.0.1:8001 --url ws://127.0.0.1:8002 \\
+        --connections 400 --duration 30
+
+See loadtest/README.md for the full procedure.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+SEED_PREFIX = 'loadtest'
+
+
+def seed(args):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'home.settings')
+    import django
+    django.setup()
+    from django.utils import timezone
+    from api.models import ContainerRecord, CustomUser, DockerHost
+
+    user, _ = CustomUser.objects.get_or_create(username=f'{SEED_PREFIX}-user')
+    host, _ = DockerHost.objects.get_or_create(
+        owner=user, host_ip='127.0.0.1', port=None,
+        defaults={'host_name': f'{SEED_PREFIX}-host', 'docker_api_url': args.docker_url},
+    )
+    host.docker_api_url = args.docker_url
+    host.save()
+    ContainerRecord.objects.filter(host=host).delete()
+    ContainerRecord.objects.bulk_create([
+        ContainerRecord(
+            container_id=f'{SEED_PREFIX}{i:056d}',
+            name=f'{SEED_PREFIX}-{i}',
+            image='fake:latest',
+            status='running',
+            created_at=timezone.now(),
+            host=host,
+            created_by=user,
+        )
+        for i in range(args.containers)
+    ])
+    print(f"Seeded host {host.id} with {args.containers} containers")
+
+
+async def run_socket(url, path, container_id, counts, deadline):
+    import websockets
+
+    async with websockets.connect(f'{url}{path}', max_size=None) as ws:
+        await ws.recv()  # connection_established
+        await ws.send(json.dumps({'container_id': container_id}))
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+            payload = json.loads(message)
+            counts[url] += len(payload['lines']) if 'lines' in payload else 1
+
+
+async def run(args):
+    path = '/ws/socket-server/' if args.mode == 'logs' else '/ws/stats/'
+    counts = Counter()
+    deadline = time.monotonic() + args.duration
+    sockets = []
+    for i in range(args.connections):
+        url = args.url[i % len(args.url)]
+        container_id = f'{SEED_PREFIX}{i % args.containers:056d}'
+        sockets.append(run_socket(url, path, container_id, counts, deadline))
+
+    started = time.monotonic()
+    results = await asyncio.gather(*sockets, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    failures = [r for r in results if isinstance(r, Exception)]
+
+    total = sum(counts.values())
+    print(f"replicas={len(args.url)} connections={args.connections} mode={args.mode} duration={elapsed:.1f}s")
+    print(f"messages={total} rate={total / elapsed:.0f}/s failed_sockets={len(failures)}")
+    for url in args.url:
+        print(f"  {url}: {counts[url] / elapsed:.0f}/s")
+    if failures:
+        print(f"  first failure: {failures[0]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = sub.add_parser('seed', help="create a host and container rows for the fake daemon")
+    seed_parser.add_argument('--docker-url', default='tcp://127.0.0.1:2375')
+    seed_parser.add_argument('--containers', type=int, default=200)
+
+    run_parser = sub.add_parser('run', help="open sockets and measure throughput")
+    run_parser.add_argument('--url', action='append', required=True, help="ws://host:port of a replica (repeatable)")
+    run_parser.add_argument('--connections', type=int, default=200)
+    run_parser.add_argument('--containers', type=int, default=200, help="must match the seeded count")
+    run_parser.add_argument('--duration', type=int, default=30)
+    run_parser.add_argument('--mode', choices=['logs', 'stats'], default='logs')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
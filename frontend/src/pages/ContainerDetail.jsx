@@ -1,7 +1,7 @@
 import React, { useEffect, useState, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { getAccessToken, logout } from '../utils/auth';
-import { API_BASE_URL, WS_BASE_URL } from '../config';
+import { getAccessToken, logout, socketUrl } from '../utils/auth';
+import { API_BASE_URL } from '../config';
 import { Line } from 'react-chartjs-2';
 import {
   Chart as ChartJS,
@@ -24,6 +24,10 @@ ChartJS.register(
   Legend
 );
 
+// Terminal output kept on screen, and how many bytes are read between acks.
+const TERMINAL_MAX_CHARS = 200000;
+const TERMINAL_ACK_BYTES = 64 * 1024;
+
 export default function ContainerDetail() {
   const { host_id, container_id } = useParams();
   const [container, setContainer] = useState(null);
@@ -38,9 +42,13 @@ export default function ContainerDetail() {
   const [selectedNetwork, setSelectedNetwork] = useState('');
   const [liveLogs, setLiveLogs] = useState([]);
   const [ws, setWs] = useState(null);
+  const logsCursorRef = useRef(null);
+  const logsOpenRef = useRef(false);
   const [statsWs, setStatsWs] = useState(null);
   const [terminalWs, setTerminalWs] = useState(null);
   const [terminalOutput, setTerminalOutput] = useState('');
+  const terminalBoxRef = useRef(null);
+  const terminalKey = `terminal:${host_id}:${container_id}`;
   const [command, setCommand] = useState('');
   const [showTerminal, setShowTerminal] = useState(false);
   const [volumeBindings, setVolumeBindings] = useState([]);
@@ -60,10 +68,6 @@ export default function ContainerDetail() {
     }]
   });
 
-  // Previous CPU time for percentage calculation using refs
-  const prevCpuTimeRef = useRef(null);
-  const prevTimestampRef = useRef(null);
-
   const [memoryData, setMemoryData] = useState({
     labels: [],
     datasets: [{
@@ -104,16 +108,9 @@ export default function ContainerDetail() {
   const updateChartData = (newStats) => {
     const now = new Date().toLocaleTimeString();
     
-    // Calculate CPU percentage
-    let cpuPercentage = 0;
-    if (prevCpuTimeRef.current !== null && prevTimestampRef.current !== null) {
-      const cpuDelta = newStats.cpu_total_time_sec - prevCpuTimeRef.current;
-      const timeDelta = (new Date(newStats.timestamp) - new Date(prevTimestampRef.current)) / 1000; // Convert to seconds
-      if (timeDelta > 0) {
-        cpuPercentage = (cpuDelta / timeDelta) * 100; // Convert to percentage
-      }
-    }
-    
+    // CPU percentage over the daemon's sampling window, computed by the backend
+    const cpuPercentage = newStats.cpu_percent || 0;
+
     // Update CPU data
     setCpuData(prev => ({
       ...prev,
@@ -280,29 +277,55 @@ export default function ContainerDetail() {
     }
   };
 
-  const handleViewLogs = () => {
+  // Keep the log view bounded so chatty containers don't freeze the page
+  const MAX_LIVE_LOG_LINES = 2000;
+
+  const appendLiveLogs = (lines) => {
+    setLiveLogs(prev => {
+      const next = prev.concat(lines);
+      return next.length > MAX_LIVE_LOG_LINES ? next.slice(-MAX_LIVE_LOG_LINES) : next;
+    });
+  };
+
+  const handleViewLogs = (resume = false) => {
     setShowLogs(true);
-    setLiveLogs([]); // Clear previous logs
+    logsOpenRef.current = true;
+    if (!resume) {
+      setLiveLogs([]); // Clear previous logs
+      logsCursorRef.current = null;
+    }
     
     // Connect to WebSocket for live logs
-    const socket = new WebSocket(`${WS_BASE_URL}/ws/socket-server/`);
+    const socket = new WebSocket(socketUrl('/ws/socket-server/'));
     
     socket.onopen = () => {
       console.log('WebSocket connected for logs');
-      // Send container_id to start streaming logs
-      socket.send(JSON.stringify({ container_id: container.container_id }));
+      // Resume after the last line we received, or start from the recent tail
+      const request = { container_id: container.container_id, ack: true };
+      if (logsCursorRef.current) {
+        request.cursor = logsCursorRef.current;
+      } else {
+        request.tail = 200;
+      }
+      socket.send(JSON.stringify(request));
     };
   
     socket.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        if (data.type === 'log') {
-          setLiveLogs(prev => [...prev, data.message]);
+        if (data.type === 'logs') {
+          appendLiveLogs(data.lines.map(line => line.message));
+        } else if (data.type === 'skipped') {
+          appendLiveLogs([`... ${data.count} lines skipped ...`]);
         } else if (data.type === 'error') {
-          setLiveLogs(prev => [...prev, `Error: ${data.message}`]);
+          appendLiveLogs([`Error: ${data.message}`]);
         } else if (data.type === 'connection_established') {
           console.log('WebSocket connection established');
         }
+        if (data.seq) {
+          if (data.cursor) logsCursorRef.current = data.cursor;
+          socket.send(JSON.stringify({ type: 'ack', seq: data.seq }));
+        }
       } catch (err) {
         console.error('Error parsing WebSocket message:', err);
       }
@@ -310,12 +333,18 @@ export default function ContainerDetail() {
   
     socket.onerror = (err) => {
       console.error('WebSocket error:', err);
-      setLiveLogs(prev => [...prev, 'WebSocket connection error']);
+      appendLiveLogs(['WebSocket connection error']);
     };
   
-    socket.onclose = () => {
+    socket.onclose = (event) => {
       console.log('WebSocket disconnected');
-      setLiveLogs(prev => [...prev, 'WebSocket connection closed']);
+      appendLiveLogs(['WebSocket connection closed']);
+      // Dropped rather than closed by us: reconnect and continue from the cursor
+      if (event.code !== 1000 && event.code !== 1005) {
+        setTimeout(() => {
+          if (logsOpenRef.current) handleViewLogs(true);
+        }, 2000);
+      }
     };
   
     setWs(socket);
@@ -357,14 +386,11 @@ export default function ContainerDetail() {
           { ...prev.datasets[1], data: [] }
         ] 
       }));
-      // Reset refs
-      prevCpuTimeRef.current = null;
-      prevTimestampRef.current = null;
     }
     
     if (container && container.status === 'running') {
       // Connect to WebSocket for live stats
-      statsSocket = new WebSocket(`${WS_BASE_URL}/ws/stats/`);
+      statsSocket = new WebSocket(socketUrl('/ws/stats/'));
       
       statsSocket.onopen = () => {
         console.log('WebSocket connected for stats');
@@ -376,10 +402,6 @@ export default function ContainerDetail() {
         try {
           const data = JSON.parse(event.data);
           if (data.type === 'stats') {
-            // Store previous values for next calculation
-            prevCpuTimeRef.current = data.data.cpu_total_time_sec;
-            prevTimestampRef.current = data.data.timestamp;
-            
             setStats(data.data);
             updateChartData(data.data);
           } else if (data.type === 'error') {
@@ -523,9 +545,14 @@ export default function ContainerDetail() {
     }
   };
 
-  // 1. Open terminal: create exec session and open websocket
+  // 1. Open terminal: create exec session (or get back the one a page
+  // refresh left behind) and open websocket
   const handleOpenTerminal = async () => {
     const token = getAccessToken();
+    if (terminalWs && terminalWs.readyState === WebSocket.OPEN) {
+      setShowTerminal(true);
+      return;
+    }
     setTerminalOutput('');
     setShowTerminal(true);
 
@@ -536,21 +563,46 @@ export default function ContainerDetail() {
     });
     const data = await res.json();
     if (!res.ok || !data.exec_id) {
-      setTerminalOutput('Failed to create exec session');
+      setTerminalOutput(data.message || 'Failed to create exec session');
+      sessionStorage.removeItem(terminalKey);
       return;
     }
     const exec_id = data.exec_id;
+    // Reopened on load, so a refresh returns to the same shell.
+    sessionStorage.setItem(terminalKey, exec_id);
 
-    // Step 2: Open WebSocket to terminal endpoint
-    const wsUrl = `${WS_BASE_URL}/ws/terminal/${container_id}/${exec_id}/`;
+    // Step 2: Open WebSocket to terminal endpoint. Output arrives as binary
+    // frames of raw bytes; status messages as JSON text frames.
+    const size = terminalSize();
+    const wsUrl = socketUrl(`/ws/terminal/${container_id}/${exec_id}/?cols=${size.cols}&rows=${size.rows}`);
     const ws = new window.WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
+    const decoder = new TextDecoder('utf-8');
+    let received = 0;
+    let acked = 0;
 
     ws.onopen = () => {
-      setTerminalOutput('Connected to terminal.\n');
+      setTerminalOutput(data.reattached ? 'Reattached to terminal.\n' : 'Connected to terminal.\n');
     };
 
     ws.onmessage = (event) => {
-      setTerminalOutput(prev => prev + event.data);
+      if (typeof event.data === 'string') {
+        const status = JSON.parse(event.data);
+        const note = status.type === 'exit' ? `\n[exited with code ${status.exit_code}]\n`
+          : status.type === 'closed' ? `\n[session ${status.reason}]\n` : `\n[${status.message}]\n`;
+        if (status.type !== 'error') sessionStorage.removeItem(terminalKey);
+        setTerminalOutput(prev => (prev + note).slice(-TERMINAL_MAX_CHARS));
+        return;
+      }
+      // stream: true keeps a multibyte character split across frames for the next one.
+      const text = decoder.decode(event.data, { stream: true });
+      setTerminalOutput(prev => (prev + text).slice(-TERMINAL_MAX_CHARS));
+      // Acknowledge what we have read so the server keeps sending.
+      received += event.data.byteLength;
+      if (received - acked >= TERMINAL_ACK_BYTES) {
+        acked = received;
+        ws.send(JSON.stringify({ type: 'ack', bytes: received }));
+      }
     };
 
     ws.onerror = (e) => {
@@ -564,20 +616,50 @@ export default function ContainerDetail() {
     setTerminalWs(ws);
   };
 
+  // Columns and rows that fit the terminal box, for the TTY size.
+  const terminalSize = () => {
+    const box = terminalBoxRef.current;
+    if (!box) return { cols: 80, rows: 24 };
+    return {
+      cols: Math.max(20, Math.floor((box.clientWidth - 32) / 8.4)),
+      rows: Math.max(5, Math.floor((box.clientHeight - 32) / 20))
+    };
+  };
+
+  useEffect(() => {
+    if (!terminalWs) return;
+    const onResize = () => {
+      if (terminalWs.readyState === WebSocket.OPEN) {
+        terminalWs.send(JSON.stringify({ type: 'resize', ...terminalSize() }));
+      }
+    };
+    window.addEventListener('resize', onResize);
+    return () => window.removeEventListener('resize', onResize);
+  }, [terminalWs]);
+
   // 2. Send command over websocket
   const handleSendCommand = () => {
     if (terminalWs && terminalWs.readyState === WebSocket.OPEN && command.trim() !== '') {
-      terminalWs.send(command + '\n');
+      terminalWs.send(new TextEncoder().encode(command + '\n'));
       setCommand('');
     }
   };
 
-  // 3. Close terminal websocket
+  // 3. Close terminal: ends the session (any other disconnect keeps it
+  // for a while to be reattached)
   const handleCloseTerminal = () => {
-    if (terminalWs) terminalWs.close();
+    if (terminalWs) {
+      if (terminalWs.readyState === WebSocket.OPEN) terminalWs.send(JSON.stringify({ type: 'close' }));
+      terminalWs.close(1000);
+    }
+    sessionStorage.removeItem(terminalKey);
     setShowTerminal(false);
   };
 
+  useEffect(() => {
+    if (sessionStorage.getItem(terminalKey)) handleOpenTerminal();
+  }, [terminalKey]);
+
   // Auto-clear messages after 5 seconds
   useEffect(() => {
     if (message || error) {
@@ -1391,7 +1473,7 @@ export default function ContainerDetail() {
                     Start Container
                   </button>
                 )}
-                <button onClick={handleViewLogs}
+                <button onClick={() => handleViewLogs()}
                   style={{
                     padding: '0.75rem 1.5rem',
                     backgroundColor: '#3b82f6',
@@ -1472,6 +1554,7 @@ export default function ContainerDetail() {
               <button
                 onClick={() => {
                   setShowLogs(false);
+                  logsOpenRef.current = false;
                   if (ws) ws.close();
                   setLiveLogs([]);
                 }}
@@ -1590,8 +1673,7 @@ export default function ContainerDetail() {
               </h2>
               <button
                 onClick={() => {
-                  setShowTerminal(false);
-                  if (terminalWs) terminalWs.close();
+                  handleCloseTerminal();
                   setTerminalOutput('');
                 }}
                 style={{
@@ -1610,7 +1692,7 @@ export default function ContainerDetail() {
                 ×
               </button>
             </div>
-            <div style={{
+            <div ref={terminalBoxRef} style={{
               flex: 1,
               backgroundColor: '#000',
               color: '#0f0',
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import { getAccessToken } from '../utils/auth';
 import { API_BASE_URL, WS_BASE_URL } from '../config';
+import { describePull, waitForPull } from '../utils/imagePulls';
 
 export default function CreateContainer() {
   const navigate = useNavigate();
@@ -48,7 +49,7 @@ export default function CreateContainer() {
 
     try {
       const token = getAccessToken();
-      const response = await fetch(`${API_BASE_URL}/hosts/${host_id}/containers/create/`, {
+      const createContainer = () => fetch(`${API_BASE_URL}/hosts/${host_id}/containers/create/`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -57,16 +58,29 @@ export default function CreateContainer() {
         body: JSON.stringify(formData)
       });
 
-      const data = await response.json();
+      let response = await createContainer();
+      let data = await response.json();
 
-      if (response.ok) {
+      if (response.status === 202 && data.pull) {
+        // The image is not on the host yet: wait for the pull, then create again.
+        const pull = await waitForPull(data.pull, (update) => setSuccess(describePull(update)));
+        setSuccess('');
+        if (pull.status !== 'succeeded') {
+          setError(pull.error || `Failed to pull image ${pull.reference}`);
+          return;
+        }
+        response = await createContainer();
+        data = await response.json();
+      }
+
+      if (response.status === 201 || response.status === 200) {
         setSuccess('Container created successfully!');
         setTimeout(() => navigate(`/hosts/${host_id}/containers/`), 2000);
       } else {
         setError(data.message || 'Failed to create container');
       }
     } catch (err) {
-      setError('Network error or server is not responding');
+      setError(err.message || 'Network error or server is not responding');
     } finally {
       setIsSubmitting(false);
     }
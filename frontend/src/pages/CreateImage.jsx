@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import { getAccessToken, logout } from '../utils/auth';
 import { API_BASE_URL } from '../config';
+import { describePull, waitForPull } from '../utils/imagePulls';
 
 export default function CreateImage() {
   const { host_id } = useParams();
@@ -39,13 +40,20 @@ export default function CreateImage() {
 
       const data = await response.json();
       if (response.ok) {
-        setSuccess(`Image ${formData.name}:${formData.tag} pulled successfully`);
-        setTimeout(() => navigate(`/hosts/${host_id}/images`), 1200);
+        // The pull runs in the background; follow its progress.
+        const pull = await waitForPull(data.pull, (update) => setSuccess(describePull(update)));
+        if (pull.status === 'succeeded') {
+          setSuccess(`Image ${pull.reference} pulled successfully`);
+          setTimeout(() => navigate(`/hosts/${host_id}/images`), 1200);
+        } else {
+          setSuccess('');
+          setError(pull.error || 'Failed to pull image');
+        }
       } else {
         setError(data.detail || 'Failed to pull image');
       }
     } catch (err) {
-      setError('Network error or server not responding');
+      setError(err.message || 'Network error or server not responding');
     } finally {
       setIsSubmitting(false);
     }
@@ -368,6 +368,23 @@ export default function Home() {
                     }}>
                       {host.status}
                     </span>
+                    {host.circuit_state && host.circuit_state !== 'closed' && (
+                      <span
+                        title="Calls to this host are suspended after repeated connection failures"
+                        style={{
+                          marginLeft: '0.5rem',
+                          padding: '0.375rem 0.75rem',
+                          borderRadius: '9999px',
+                          fontSize: '0.75rem',
+                          fontWeight: '600',
+                          backgroundColor: 'rgba(245, 158, 11, 0.15)',
+                          color: '#f59e0b',
+                          border: '1px solid rgba(245, 158, 11, 0.3)'
+                        }}
+                      >
+                        circuit {host.circuit_state.replace('_', '-')}
+                      </span>
+                    )}
                   </div>
                   
                   <div style={{ 
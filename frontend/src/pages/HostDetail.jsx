@@ -17,25 +17,35 @@ export default function HostDetail() {
         const fetchHostDetails = async () => {
             const token = getAccessToken();
             try {
-                const response = await fetch(`${API_BASE_URL}/hosts/${host_id}/containers/`, {
-                    headers: {
-                        'Authorization': `Bearer ${token}`
-                    }
-                });
+                // Page through the list so the first rows show up while large hosts are still loading.
+                let cursor = null;
+                do {
+                    const params = new URLSearchParams({
+                        limit: '500',
+                        fields: 'id,container_id,name,image,status',
+                    });
+                    if (cursor) params.set('cursor', cursor);
+                    const response = await fetch(`${API_BASE_URL}/hosts/${host_id}/containers/?${params}`, {
+                        headers: {
+                            'Authorization': `Bearer ${token}`
+                        }
+                    });
 
-                if (response.status === 401) {
-                    navigate('/login');
-                    return;
-                }
+                    if (response.status === 401) {
+                        navigate('/login');
+                        return;
+                    }
 
-                if (!response.ok) {
-                    throw new Error('Failed to fetch host details');
-                }
+                    if (!response.ok) {
+                        throw new Error('Failed to fetch host details');
+                    }
 
-                const data = await response.json();
-                setHost(data.host);
-                setContainers(data.containers);
-                setLoading(false);
+                    const data = await response.json();
+                    setHost(data.host);
+                    setContainers(prev => cursor ? [...prev, ...data.containers] : data.containers);
+                    setLoading(false);
+                    cursor = data.next_cursor;
+                } while (cursor);
             } catch (err) {
                 setError(err.message);
                 setLoading(false);
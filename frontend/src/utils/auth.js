@@ -1,4 +1,6 @@
 // src/utils/auth.js
+import { WS_BASE_URL } from '../config';
+
 export const setTokens = ({ access, refresh }) => {
     localStorage.setItem('access_token', access);
     localStorage.setItem('refresh_token', refresh);
@@ -7,6 +9,15 @@ export const setTokens = ({ access, refresh }) => {
   export const getAccessToken = () => localStorage.getItem('access_token');
   
   export const isAuthenticated = () => !!getAccessToken();
+
+  // WebSockets cannot send an Authorization header, so the access token
+  // goes in the `token` query parameter.
+  export const socketUrl = (path) => {
+    const token = getAccessToken();
+    if (!token) return `${WS_BASE_URL}${path}`;
+    const separator = path.includes('?') ? '&' : '?';
+    return `${WS_BASE_URL}${path}${separator}token=${encodeURIComponent(token)}`;
+  };
   
   export const logout = () => {
     localStorage.removeItem('access_token');
@@ -0,0 +1,35 @@
+// src/utils/imagePulls.js
+import { socketUrl } from './auth';
+
+// Follow a background image pull until it finishes. Resolves with the
+// final pull ({status: 'succeeded' | 'failed', error, ...}); onProgress
+// gets every update, including the first snapshot.
+export const waitForPull = (pull, onProgress) => new Promise((resolve, reject) => {
+  if (pull.status !== 'running') {
+    resolve(pull);
+    return;
+  }
+  let latest = pull;
+  const socket = new WebSocket(socketUrl(`/ws/images/pulls/${pull.id}/`));
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if (message.type !== 'pull') return;
+    latest = message;
+    if (onProgress) onProgress(message);
+  };
+  socket.onclose = () => {
+    if (latest.status === 'running') {
+      reject(new Error('Lost connection while pulling the image'));
+    } else {
+      resolve(latest);
+    }
+  };
+});
+
+export const describePull = (pull) => {
+  const progress = pull.progress || {};
+  if (progress.percent != null) {
+    return `Pulling ${pull.reference}: ${progress.percent}% (${progress.layers_done}/${progress.layers} layers)`;
+  }
+  return `Pulling ${pull.reference}${progress.status ? `: ${progress.status}` : '...'}`;
+};